@@ -1,11 +1,12 @@
 from django.contrib import admin
 from django.contrib.auth.models import User, Group
-from .models import Empleado, Cliente, Producto, Factura, DetalleFactura
+from .models import (Empleado, Cliente, Producto, Factura, DetalleFactura, SecuenciaFactura, MovimientoStock,
+                     ResumenVentasDiario)
 
 
 @admin.register(Empleado)
 class EmpleadoAdmin(admin.ModelAdmin):
-    list_display = ['cedula', 'nombre', 'apellido', 'cargo', 'celular', 'activo']
+    list_display = ['cedula', 'nombre', 'apellido', 'cargo', 'punto_emision', 'celular', 'activo']
     list_filter = ['cargo', 'activo']
     search_fields = ['cedula', 'nombre', 'apellido']
 
@@ -23,6 +24,10 @@ class ProductoAdmin(admin.ModelAdmin):
     list_filter = ['es_primera_necesidad', 'activo', 'marca']
     search_fields = ['codigo', 'nombre', 'marca']
 
+    def get_readonly_fields(self, request, obj=None):
+        # Una vez creado, el stock solo cambia a traves de MovimientoStock
+        return ['stock'] if obj else []
+
 
 class DetalleFacturaInline(admin.TabularInline):
     model = DetalleFactura
@@ -39,6 +44,39 @@ class FacturaAdmin(admin.ModelAdmin):
     readonly_fields = ['numero', 'subtotal_sin_iva', 'subtotal_con_iva', 'valor_iva', 'total']
 
 
+@admin.register(SecuenciaFactura)
+class SecuenciaFacturaAdmin(admin.ModelAdmin):
+    list_display = ['establecimiento', 'punto_emision', 'ultimo_numero']
+    readonly_fields = ['ultimo_numero']
+
+
+@admin.register(MovimientoStock)
+class MovimientoStockAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'producto', 'tipo', 'cantidad', 'referencia']
+    list_filter = ['tipo', 'fecha']
+    search_fields = ['producto__codigo', 'producto__nombre', 'referencia']
+    list_select_related = ['producto']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ResumenVentasDiario)
+class ResumenVentasDiarioAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'empleado', 'facturas', 'clientes', 'total']
+    list_filter = ['fecha', 'empleado']
+    list_select_related = ['empleado']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 def crear_datos_iniciales():
     from decimal import Decimal
 
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class AppConfig(AppConfig):
     name = 'App'
+
+    def ready(self):
+        # Conectan las senales que mantienen el indice de busqueda y las caches y
+        # el medidor de SQL de cada conexion nueva; registran los checks de despliegue
+        from . import busqueda, cache, checks, comprobantes, metricas  # noqa: F401
@@ -0,0 +1,304 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Producto, MovimientoStock, normalizar_texto, stock_actualizado
+
+# Los textos se indexan como ' texto' + FIN: el espacio inicial marca el inicio
+# de palabra (asi ' ar' lista los productos con una palabra que empieza por "ar")
+# y FIN hace que los dos ultimos caracteres tambien generen un trigrama.
+FIN = '\x00'
+LOTE_CARGA = 5000
+LIMITE_32 = 2 ** 32
+
+
+def preparar(texto):
+    return ' ' + normalizar_texto(texto)
+
+
+def gramas(texto):
+    texto = texto + FIN
+    resultado = set()
+    for i in range(len(texto) - 1):
+        resultado.add(texto[i:i + 2])
+        if i + 3 <= len(texto):
+            resultado.add(texto[i:i + 3])
+    return resultado
+
+
+def contiene(ids, producto_id):
+    i = bisect_left(ids, producto_id)
+    return i < len(ids) and ids[i] == producto_id
+
+
+def gramas_consulta(consulta):
+    if len(consulta) == 2:
+        return [consulta]
+    return [consulta[i:i + 3] for i in range(len(consulta) - 2)]
+
+
+class IndiceProductos:
+    # Indice de bigramas/trigramas en memoria sobre los productos activos.
+    # Cada proceso mantiene el suyo: se arma al iniciar cada worker (ver
+    # Proyecto/gunicorn.conf.py), se actualiza con las senales de Producto y de
+    # stock de este proceso y se recarga completo cada BUSQUEDA_INDICE_TTL
+    # segundos para recoger los cambios hechos en otros procesos.
+    #
+    # Cada grama guarda sus ids en un array ordenado (4 bytes por id) y no en un
+    # set (unos 40). Con mas de BUSQUEDA_INDICE_MAXIMO productos activos no se
+    # arma y la busqueda va al ORM.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._productos = {}
+        self._gramas = {}
+        self.cargado_en = None
+        self.excedido = False
+        self._tipo = 'I'
+        self._recargando = False
+        # Marcado para rearmar en la proxima busqueda, aunque no haya vencido
+        self._vencido = False
+
+    @property
+    def cargado(self):
+        return self.cargado_en is not None
+
+    @property
+    def disponible(self):
+        return not self.excedido
+
+    def cargar(self, queryset=None, avisar=None):
+        # avisar() se llama cada LOTE_CARGA productos (el latido del worker de gunicorn)
+        if queryset is None:
+            queryset = Producto.objects.filter(activo=True)
+        maximo = getattr(settings, 'BUSQUEDA_INDICE_MAXIMO', None)
+        resumen = queryset.aggregate(cantidad=Count('id'), ultimo=Max('id'))
+        # Ids de 4 bytes mientras alcancen
+        tipo = 'I' if (resumen['ultimo'] or 0) < LIMITE_32 else 'q'
+        if maximo is not None and resumen['cantidad'] > maximo:
+            with self._lock:
+                self._productos = {}
+                self._gramas = {}
+                self.excedido = True
+                self.cargado_en = time.monotonic()
+                self._recargando = False
+                self._vencido = False
+            return
+
+        # En orden de id: cada lista ya queda ordenada
+        filas = queryset.order_by('id').values_list('id', 'codigo', 'nombre', 'stock')
+        productos = {}
+        listas = {}
+        for producto_id, codigo, nombre, stock in filas.iterator(chunk_size=LOTE_CARGA):
+            entrada = (preparar(codigo), preparar(nombre), stock)
+            productos[producto_id] = entrada
+            if avisar and len(productos) % LOTE_CARGA == 0:
+                avisar()
+            for grama in gramas(entrada[0]) | gramas(entrada[1]):
+                lista = listas.get(grama)
+                if lista is None:
+                    listas[grama] = array(tipo, (producto_id,))
+                else:
+                    lista.append(producto_id)
+
+        with self._lock:
+            self._productos = productos
+            self._gramas = listas
+            self._tipo = tipo
+            self.excedido = False
+            self.cargado_en = time.monotonic()
+            self._recargando = False
+            self._vencido = False
+
+    def _quitar(self, producto_id):
+        entrada = self._productos.pop(producto_id, None)
+        if entrada is None:
+            return
+        for grama in gramas(entrada[0]) | gramas(entrada[1]):
+            ids = self._gramas.get(grama)
+            if ids is not None:
+                i = bisect_left(ids, producto_id)
+                if i < len(ids) and ids[i] == producto_id:
+                    del ids[i]
+                if not ids:
+                    del self._gramas[grama]
+
+    def actualizar(self, producto):
+        with self._lock:
+            if self.excedido:
+                return
+            if producto.pk >= LIMITE_32 and self._tipo == 'I':
+                # El id no entra en las listas de 4 bytes: se rearma en segundo
+                # plano desde la proxima busqueda
+                self._vencido = True
+                return
+            self._quitar(producto.pk)
+            if not producto.activo:
+                return
+            entrada = (preparar(producto.codigo), preparar(producto.nombre), producto.stock)
+            self._productos[producto.pk] = entrada
+            for grama in gramas(entrada[0]) | gramas(entrada[1]):
+                ids = self._gramas.get(grama)
+                if ids is None:
+                    self._gramas[grama] = array(self._tipo, (producto.pk,))
+                else:
+                    insort(ids, producto.pk)
+
+    def eliminar(self, producto_id):
+        with self._lock:
+            self._quitar(producto_id)
+
+    def ajustar_stock(self, delta):
+        with self._lock:
+            for producto_id, cantidad in delta.items():
+                entrada = self._productos.get(producto_id)
+                if entrada is not None:
+                    self._productos[producto_id] = (entrada[0], entrada[1], entrada[2] + cantidad)
+
+    def _asegurar_cargado(self):
+        if not self.cargado:
+            self.cargar()
+        else:
+            self._renovar()
+
+    def _renovar(self):
+        # No lee la base en este hilo: se puede llamar desde el bucle de eventos
+        ttl = getattr(settings, 'BUSQUEDA_INDICE_TTL', 300)
+        with self._lock:
+            vencido = not self._recargando and (self._vencido or time.monotonic() - self.cargado_en > ttl)
+            if vencido:
+                self._recargando = True
+        if vencido:
+            # Mientras se reconstruye se sigue respondiendo con el indice anterior
+            threading.Thread(target=self._recargar, daemon=True).start()
+
+    def _recargar(self):
+        from django.db import connection
+        try:
+            self.cargar()
+        finally:
+            self._recargando = False
+            connection.close()
+
+    def _candidatos(self, gramas_buscados):
+        listas = []
+        for grama in gramas_buscados:
+            ids = self._gramas.get(grama)
+            if not ids:
+                return set()
+            listas.append(ids)
+        listas.sort(key=len)
+        candidatos = set(listas[0])
+        for ids in listas[1:]:
+            if not candidatos:
+                break
+            if len(candidatos) * 20 < len(ids):
+                # Pocos candidatos contra una lista larga: busqueda binaria
+                candidatos = {i for i in candidatos if contiene(ids, i)}
+            else:
+                candidatos.intersection_update(ids)
+        return candidatos
+
+    def _puntuar(self, candidatos, consulta, solo_con_stock):
+        palabra = ' ' + consulta
+        puntuados = []
+        for producto_id in candidatos:
+            codigo, nombre, stock = self._productos[producto_id]
+            if solo_con_stock and stock <= 0:
+                continue
+            if codigo == palabra:
+                rango = 0
+            elif codigo.startswith(palabra):
+                rango = 1
+            elif nombre.startswith(palabra):
+                rango = 2
+            elif palabra in nombre:
+                rango = 3
+            elif consulta in nombre or consulta in codigo:
+                rango = 4
+            else:
+                # Los gramas coinciden pero no forman la subcadena completa
+                continue
+            puntuados.append((rango, nombre, producto_id))
+        return puntuados
+
+    def buscar(self, consulta, limite=10, solo_con_stock=True):
+        # Ids ordenados por relevancia, o None si el catalogo supera
+        # BUSQUEDA_INDICE_MAXIMO (la busqueda va al ORM)
+        self._asegurar_cargado()
+        return self._buscar(consulta, limite, solo_con_stock)
+
+    def _buscar(self, consulta, limite, solo_con_stock):
+        # Solo memoria, con el indice tal como este
+        consulta = normalizar_texto(consulta)
+        if len(consulta) < 2:
+            return []
+        if self.excedido:
+            return None
+
+        with self._lock:
+            # Primero solo los productos con una palabra (o el codigo) que empieza
+            # por la consulta: siempre ganan a las coincidencias a mitad de palabra,
+            # asi que si alcanzan el limite no hace falta puntuar el resto.
+            inicio = self._candidatos(gramas_consulta(' ' + consulta))
+            puntuados = self._puntuar(inicio, consulta, solo_con_stock)
+            if len(puntuados) < limite:
+                resto = self._candidatos(gramas_consulta(consulta)) - inicio
+                puntuados += self._puntuar(resto, consulta, solo_con_stock)
+
+        return [producto_id for _, _, producto_id in heapq.nsmallest(limite, puntuados)]
+
+    async def abuscar(self, consulta, limite=10, solo_con_stock=True):
+        # Para las vistas async: solo la primera carga lee la base (en un hilo);
+        # despues la busqueda es memoria pura y corre en el bucle de eventos, y
+        # los rearmados van al hilo de _recargar
+        if self.cargado:
+            self._renovar()
+        else:
+            await sync_to_async(self._asegurar_cargado)()
+        return self._buscar(consulta, limite, solo_con_stock)
+
+
+def buscar_productos_orm(consulta, limite=10):
+    return Producto.objects.filter(
+        Q(nombre__icontains=consulta) | Q(codigo__icontains=consulta),
+        activo=True,
+        stock__gt=0
+    )[:limite]
+
+
+indice_productos = IndiceProductos()
+
+
+def precargar(avisar=None):
+    # Desde el arranque de cada worker, antes de la primera solicitud
+    from django.db import connection
+    if settings.BUSQUEDA_EN_MEMORIA:
+        try:
+            indice_productos.cargar(avisar=avisar)
+        finally:
+            connection.close()
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, raw=False, **kwargs):
+    if indice_productos.cargado and not raw:
+        indice_productos.actualizar(instance)
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    if indice_productos.cargado:
+        indice_productos.eliminar(instance.pk)
+
+
+@receiver(stock_actualizado, sender=MovimientoStock)
+def indexar_stock(sender, delta, **kwargs):
+    if indice_productos.cargado:
+        indice_productos.ajustar_stock(delta)
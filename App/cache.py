@@ -0,0 +1,306 @@
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Cliente, Empleado, Factura, Producto, MovimientoStock, stock_actualizado
+from .replicas import PRIMARIA
+from .catalogo import instantanea, comprimir
+
+TIEMPO_PRODUCTO = 60 * 60
+TIEMPO_CLIENTE = 60 * 60
+TIEMPO_NO_ENCONTRADO = 5 * 60
+TIEMPO_TOTALES = 60
+TIEMPO_CATALOGO_CAJA = 60
+CEDULA_CONSUMIDOR_FINAL = '9999999999'
+
+# Backends que viven dentro del proceso: lo que se invalida en uno no llega a
+# los demas workers ni desde un comando de gestion
+CACHES_LOCALES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_compartida(alias='default'):
+    return settings.CACHES[alias]['BACKEND'] not in CACHES_LOCALES
+
+
+# Contadores por proceso: '<tipo>:aciertos', '<tipo>:fallos', '<tipo>:negativos'
+contadores = Counter()
+
+
+def estadisticas():
+    resultado = {}
+    for tipo in ('productos', 'clientes'):
+        aciertos = contadores[f'{tipo}:aciertos']
+        negativos = contadores[f'{tipo}:negativos']
+        fallos = contadores[f'{tipo}:fallos']
+        total = aciertos + negativos + fallos
+        resultado[tipo] = {
+            'aciertos': aciertos,
+            'aciertos_negativos': negativos,
+            'fallos': fallos,
+            'tasa_aciertos': round((aciertos + negativos) / total, 4) if total else None,
+        }
+    resultado['clientes']['consumidor_final_en_memoria'] = _consumidor_final is not None
+    return resultado
+
+
+def producto_a_dict(producto):
+    return {
+        'id': producto.id,
+        'codigo': producto.codigo,
+        'nombre': producto.nombre,
+        'marca': producto.marca,
+        'precio': str(producto.precio_unitario),
+        'stock': producto.stock,
+        'es_primera_necesidad': producto.es_primera_necesidad,
+        'iva': '0%' if producto.es_primera_necesidad else '15%'
+    }
+
+
+# Productos por codigo
+#
+# Dos niveles: 'producto:codigo:<codigo>' guarda solo el id y depende de la
+# version del catalogo, que sube con cada guardado de Producto (invalida todos
+# los codigos de una vez, incluidos los "no encontrado"). 'producto:<id>' guarda
+# los datos y se borra cuando cambia ese producto o su stock, asi una venta no
+# invalida el resto del catalogo.
+#
+# Lo que se guarda en cache se lee de la primaria aunque la vista lea de una
+# replica: un dato atrasado guardado justo despues de invalidarlo duraria una hora.
+# La cache es la compartida (ver CACHES en settings): un precio cambiado en un
+# worker o en una importacion deja de servirse en todos.
+
+def version_catalogo():
+    # Si la cache compartida pierde la version se empieza de un valor nuevo (como
+    # en los roles): volver a 1 reusaria codigos guardados con una version vieja
+    return cache.get_or_set('productos:version', time.time_ns, None)
+
+
+def invalidar_catalogo():
+    try:
+        cache.incr('productos:version')
+    except ValueError:
+        cache.set('productos:version', time.time_ns(), None)
+
+
+def producto_por_codigo(codigo):
+    version = version_catalogo()
+    clave_codigo = f'producto:codigo:{codigo}'
+    producto_id = cache.get(clave_codigo, version=version)
+
+    if producto_id is None:
+        contadores['productos:fallos'] += 1
+        producto = Producto.objects.using(PRIMARIA).filter(codigo=codigo, activo=True).first()
+        if producto is None:
+            cache.set(clave_codigo, 0, TIEMPO_NO_ENCONTRADO, version=version)
+            return None
+        datos = producto_a_dict(producto)
+        cache.set(clave_codigo, producto.id, TIEMPO_PRODUCTO, version=version)
+        cache.set(f'producto:{producto.id}', datos, TIEMPO_PRODUCTO)
+        return datos
+
+    if producto_id == 0:
+        contadores['productos:negativos'] += 1
+        return None
+    return producto_por_id(producto_id)
+
+
+def producto_por_id(producto_id):
+    datos = cache.get(f'producto:{producto_id}')
+    if datos is None:
+        contadores['productos:fallos'] += 1
+        producto = Producto.objects.using(PRIMARIA).filter(pk=producto_id, activo=True).first()
+        if producto is None:
+            return None
+        datos = producto_a_dict(producto)
+        cache.set(f'producto:{producto_id}', datos, TIEMPO_PRODUCTO)
+    else:
+        contadores['productos:aciertos'] += 1
+    return datos
+
+
+def marcas_productos():
+    # Para el filtro de la lista de productos; cambia con la version del catalogo
+    def calcular():
+        return list(Producto.objects.using(PRIMARIA).order_by('marca').values_list('marca', flat=True).distinct())
+    return cache.get_or_set('productos:marcas', calcular, TIEMPO_PRODUCTO, version=version_catalogo())
+
+
+def catalogo_caja():
+    # Catalogo completo de las cajas ya comprimido (ver App/catalogo.py). Cambia
+    # con la version del catalogo; el stock (las ventas no suben esa version)
+    # puede tener hasta un minuto, y las cajas lo ponen al dia con los cambios.
+    return cache.get_or_set('productos:catalogo_caja', lambda: comprimir(instantanea()), TIEMPO_CATALOGO_CAJA,
+                            version=version_catalogo())
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_producto(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    cache.delete(f'producto:{instance.pk}')
+    invalidar_catalogo()
+
+
+@receiver(stock_actualizado, sender=MovimientoStock)
+def invalidar_stock(sender, delta, **kwargs):
+    cache.delete_many([f'producto:{producto_id}' for producto_id in delta])
+
+
+# Totales generales del dashboard: cuatro COUNT(*) que no necesitan ser exactos
+# al segundo, se recalculan como mucho una vez por minuto.
+
+def totales_dashboard():
+    def calcular():
+        return {
+            'total_empleados': Empleado.objects.filter(activo=True).count(),
+            'total_productos': Producto.objects.filter(activo=True).count(),
+            'total_clientes': Cliente.objects.count(),
+            'total_facturas': Factura.objects.count(),
+        }
+    return cache.get_or_set('dashboard:totales', calcular, TIEMPO_TOTALES)
+
+
+# Clientes por cedula
+#
+# El Consumidor Final se fija en memoria del proceso la primera vez, junto a la
+# version compartida 'cliente:consumidor_final:version'; cada uso solo compara
+# esa version (sin consulta ni deserializar) y si otro proceso lo edito se
+# vuelve a leer. El resto va a 'cliente:cedula:<cedula>', con 0 para cedulas que
+# no existen. Las vistas que crean, editan o eliminan clientes llaman a
+# invalidar_cliente().
+
+_consumidor_final = None  # (version, datos)
+_consumidor_final_lock = threading.Lock()
+
+
+def cliente_a_dict(cliente):
+    return {
+        'id': cliente.id,
+        'cedula': cliente.cedula,
+        'nombre': cliente.nombre,
+        'apellido': cliente.apellido,
+        'celular': cliente.celular,
+        'correo': cliente.correo,
+        'es_consumidor_final': cliente.es_consumidor_final
+    }
+
+
+def version_consumidor_final():
+    return cache.get_or_set('cliente:consumidor_final:version', time.time_ns, None)
+
+
+def consumidor_final():
+    global _consumidor_final
+    version = version_consumidor_final()
+    fijado = _consumidor_final
+    if fijado is None or fijado[0] != version:
+        with _consumidor_final_lock:
+            fijado = _consumidor_final
+            if fijado is None or fijado[0] != version:
+                contadores['clientes:fallos'] += 1
+                _consumidor_final = (version, cliente_a_dict(Cliente.get_consumidor_final()))
+                return _consumidor_final[1]
+    contadores['clientes:aciertos'] += 1
+    return fijado[1]
+
+
+def cliente_por_cedula(cedula):
+    if cedula == CEDULA_CONSUMIDOR_FINAL:
+        return consumidor_final()
+
+    clave = f'cliente:cedula:{cedula}'
+    datos = cache.get(clave)
+    if datos == 0:
+        contadores['clientes:negativos'] += 1
+        return None
+    if datos is not None:
+        contadores['clientes:aciertos'] += 1
+        return datos
+
+    contadores['clientes:fallos'] += 1
+    cliente = Cliente.objects.using(PRIMARIA).filter(cedula=cedula).first()
+    if cliente is None:
+        cache.set(clave, 0, TIEMPO_NO_ENCONTRADO)
+        return None
+    datos = cliente_a_dict(cliente)
+    cache.set(clave, datos, TIEMPO_CLIENTE)
+    return datos
+
+
+def invalidar_cliente(cedula):
+    global _consumidor_final
+    if cedula == CEDULA_CONSUMIDOR_FINAL:
+        _consumidor_final = None
+        cache.set('cliente:consumidor_final:version', time.time_ns(), None)
+    cache.delete(f'cliente:cedula:{cedula}')
+
+
+# Roles por usuario
+#
+# RolesMiddleware guarda los roles en la sesion junto a 'roles:version:<id>'.
+# La version tiene que estar en una cache compartida (ver CACHES en settings):
+# si cada worker tuviera la suya, quitar a alguien de Admin solo se notaria en
+# el worker que atendio el cambio.
+# La version es un valor unico (no un contador): si la cache la pierde se crea
+# otra distinta y las sesiones vuelven a calcular los roles en vez de quedarse
+# con datos viejos.
+
+def version_roles(user_id):
+    return cache.get_or_set(f'roles:version:{user_id}', time.time_ns, None)
+
+
+def invalidar_roles(*user_ids):
+    cache.set_many({f'roles:version:{user_id}': time.time_ns() for user_id in user_ids if user_id}, None)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidar_roles_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # group.user_set.clear() no trae los ids y despues del clear el grupo ya
+        # esta vacio: se toman antes y se invalidan en post_clear
+        instance._usuarios_antes_de_vaciar = list(instance.user_set.values_list('pk', flat=True))
+        return
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidar_roles(instance.pk)
+    elif pk_set:
+        invalidar_roles(*pk_set)
+    else:
+        invalidar_roles(*instance.__dict__.pop('_usuarios_antes_de_vaciar', []))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidar_roles_grupo_eliminado(sender, instance, **kwargs):
+    invalidar_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidar_roles_usuario(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar_roles(instance.pk)
+
+
+@receiver(post_init, sender=Empleado)
+def recordar_usuario_empleado(sender, instance, **kwargs):
+    # Si se reasigna el usuario, tambien hay que invalidar los roles del anterior.
+    # Por __dict__: con only()/defer() leer el atributo haria una consulta por
+    # instancia (el selector de empleados del historial).
+    instance._usuario_id_anterior = instance.__dict__.get('usuario_id')
+
+
+@receiver(post_save, sender=Empleado)
+@receiver(post_delete, sender=Empleado)
+def invalidar_roles_empleado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = getattr(instance, '_usuario_id_anterior', None)
+    invalidar_roles(instance.usuario_id, anterior)
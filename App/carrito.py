@@ -0,0 +1,153 @@
+from decimal import Decimal
+from django.db import transaction
+from .cache import producto_por_id, producto_por_codigo
+from .facturacion import ErrorFacturacion, guardar_factura, idempotente
+from .models import Producto, StockInsuficiente, importes
+
+# Carrito de la caja en la sesion
+#
+# Cada escaneo valida y precia solo la linea que cambia, con los datos del
+# producto en cache, y ajusta los subtotales acumulados (sin IVA y gravado):
+# el costo por escaneo no crece con el carrito. El precio queda fijo desde el
+# primer escaneo, como la etiqueta de la percha. Al cobrar no se vuelven a leer
+# ni a bloquear los productos; el stock lo asegura el UPDATE condicional de
+# MovimientoStock.registrar y, si otra caja vendio antes, se informa que falta.
+
+CLAVE_SESION = 'carrito'
+
+
+class Carrito:
+    def __init__(self, session):
+        self.session = session
+        self.datos = session.get(CLAVE_SESION) or {'lineas': {}, 'sin_iva': '0.00', 'gravado': '0.00'}
+
+    @property
+    def lineas(self):
+        return self.datos['lineas']
+
+    def guardar(self):
+        self.session[CLAVE_SESION] = self.datos
+        self.session.modified = True
+
+    def sumar(self, linea, cantidad):
+        # Ajusta el subtotal que corresponde a la linea en precio * cantidad
+        campo = 'sin_iva' if linea['primera_necesidad'] else 'gravado'
+        self.datos[campo] = str(Decimal(self.datos[campo]) + Decimal(linea['precio']) * cantidad)
+
+    def agregar(self, cantidad=1, producto_id=None, codigo=None):
+        producto = producto_por_codigo(codigo) if codigo else producto_por_id(producto_id)
+        if producto is None:
+            raise ErrorFacturacion('Producto no encontrado.')
+        if cantidad < 1:
+            raise ErrorFacturacion('La cantidad debe ser mayor a cero.')
+
+        clave = str(producto['id'])
+        linea = self.lineas.get(clave)
+        if linea is None:
+            linea = {
+                'cantidad': 0,
+                'precio': producto['precio'],
+                'nombre': producto['nombre'],
+                'primera_necesidad': producto['es_primera_necesidad'],
+            }
+        self.validar_stock(producto, linea['cantidad'] + cantidad)
+
+        linea['cantidad'] += cantidad
+        linea['stock'] = producto['stock']
+        self.lineas[clave] = linea
+        self.sumar(linea, cantidad)
+        self.guardar()
+        return producto['id']
+
+    def actualizar(self, producto_id, cantidad):
+        # Cantidad 0 quita la linea
+        linea = self.lineas.get(str(producto_id))
+        if linea is None:
+            raise ErrorFacturacion('El producto no esta en el carrito.')
+        if cantidad < 0:
+            raise ErrorFacturacion('La cantidad no puede ser negativa.')
+        if cantidad == 0:
+            return self.quitar(producto_id)
+
+        if cantidad > linea['cantidad']:
+            producto = producto_por_id(producto_id)
+            if producto is None:
+                raise ErrorFacturacion('Producto no encontrado.')
+            self.validar_stock(producto, cantidad)
+            linea['stock'] = producto['stock']
+
+        self.sumar(linea, cantidad - linea['cantidad'])
+        linea['cantidad'] = cantidad
+        self.guardar()
+
+    def quitar(self, producto_id):
+        linea = self.lineas.pop(str(producto_id), None)
+        if linea is not None:
+            self.sumar(linea, -linea['cantidad'])
+            self.guardar()
+
+    def vaciar(self):
+        self.session.pop(CLAVE_SESION, None)
+        self.datos = {'lineas': {}, 'sin_iva': '0.00', 'gravado': '0.00'}
+
+    def validar_stock(self, producto, cantidad):
+        if cantidad > producto['stock']:
+            raise StockInsuficiente(
+                f"Stock insuficiente para {producto['nombre']}. Disponible: {producto['stock']}"
+            )
+
+    def linea(self, producto_id):
+        linea = self.lineas.get(str(producto_id))
+        if linea is None:
+            return None
+        return {'producto_id': int(producto_id), **linea}
+
+    def totales(self):
+        valores = importes(Decimal(self.datos['sin_iva']), Decimal(self.datos['gravado']))
+        return {
+            **{campo: str(valor) for campo, valor in valores.items()},
+            'lineas': len(self.lineas),
+            'articulos': sum(linea['cantidad'] for linea in self.lineas.values()),
+        }
+
+    def estado(self):
+        return {
+            'lineas': [self.linea(producto_id) for producto_id in self.lineas],
+            'totales': self.totales(),
+        }
+
+    def cobrar(self, cliente, empleado_id, punto_emision='', clave=None):
+        # Devuelve (factura, creada) como registrar_factura_idempotente. Con la
+        # clave de un cobro que ya entro devuelve esa factura aunque el carrito
+        # ya se haya vaciado.
+        def registrar():
+            if not self.lineas:
+                raise ErrorFacturacion('No hay productos en la factura.')
+            lineas = []
+            precios = {}
+            for producto_id, linea in self.lineas.items():
+                # Solo lo que usan el detalle y el comprobante; no se lee la base
+                producto = Producto(pk=int(producto_id), nombre=linea['nombre'],
+                                    es_primera_necesidad=linea['primera_necesidad'])
+                lineas.append((producto, linea['cantidad']))
+                precios[producto.pk] = Decimal(linea['precio'])
+            with transaction.atomic():
+                return guardar_factura(cliente, empleado_id, lineas, punto_emision, clave, precios)
+
+        try:
+            resultado = idempotente(clave, registrar)
+        except StockInsuficiente:
+            raise StockInsuficiente(self.faltantes())
+        self.vaciar()
+        return resultado
+
+    def faltantes(self):
+        # Solo cuando el cobro fallo por stock: una consulta para decir que falta
+        disponibles = dict(Producto.objects.filter(pk__in=[int(pk) for pk in self.lineas])
+                           .values_list('pk', 'stock'))
+        mensajes = [
+            f"{linea['nombre']} (disponible: {disponibles.get(int(producto_id), 0)})"
+            for producto_id, linea in self.lineas.items()
+            if linea['cantidad'] > disponibles.get(int(producto_id), 0)
+        ]
+        return 'Stock insuficiente para ' + ', '.join(mensajes) if mensajes else 'Stock insuficiente.'
@@ -0,0 +1,79 @@
+import gzip
+import json
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Producto, ProductoBorrado, version_actual
+from .replicas import PRIMARIA
+
+# Catalogo de las cajas
+#
+# La caja baja el catalogo completo una vez y despues solo los cambios desde la
+# version que tiene. La version es el momento (version_actual) en que se armo la
+# respuesta; cada producto guarda la version de su ultimo cambio de datos y la de
+# su ultimo movimiento de stock. De lo que solo cambio el stock se manda id y
+# stock, y de los eliminados solo el id (ProductoBorrado). Las columnas van
+# como listas paralelas (sin repetir los nombres en cada fila) y la respuesta
+# va en gzip.
+#
+# Una venta toma su version antes de confirmar: los cambios se piden con un
+# MARGEN hacia atras para no perder los que confirmaron despues de la respuesta
+# anterior. Se repiten algunos y la caja los vuelve a aplicar sin problema.
+
+COLUMNAS = ('id', 'codigo', 'nombre', 'marca', 'precio', 'stock', 'es_primera_necesidad')
+CAMPOS = ('id', 'codigo', 'nombre', 'marca', 'precio_unitario', 'stock', 'es_primera_necesidad')
+MARGEN = 30 * 1000000
+# Mas atras que esto los cambios serian casi todo el catalogo
+HORIZONTE = 24 * 60 * 60 * 1000000
+
+
+def columnas(filas, nombres):
+    filas = list(filas)
+    return {nombre: [fila[i] for fila in filas] for i, nombre in enumerate(nombres)}
+
+
+def productos(consulta, nombres=COLUMNAS, campos=CAMPOS):
+    datos = columnas(consulta.order_by('id').values_list(*campos), nombres)
+    datos['precio'] = [str(precio) for precio in datos['precio']]
+    return datos
+
+
+def instantanea():
+    version = version_actual()
+    return {
+        'version': version,
+        'completo': True,
+        'productos': productos(Producto.objects.using(PRIMARIA).filter(activo=True)),
+    }
+
+
+def cambios(desde):
+    version = version_actual()
+    if desde < version - HORIZONTE:
+        return instantanea()
+
+    corte = desde - MARGEN
+    todos = Producto.objects.using(PRIMARIA)
+    return {
+        'version': version,
+        'completo': False,
+        # Con activo: los desactivados se quitan de la caja
+        'productos': productos(todos.filter(version_datos__gt=corte), COLUMNAS + ('activo',), CAMPOS + ('activo',)),
+        'stock': columnas(todos.filter(version_stock__gt=corte).exclude(version_datos__gt=corte)
+                          .order_by('id').values_list('id', 'stock'), ('id', 'stock')),
+        'borrados': list(ProductoBorrado.objects.using(PRIMARIA).filter(version__gt=corte)
+                         .values_list('producto_id', flat=True)),
+    }
+
+
+def comprimir(datos):
+    return gzip.compress(json.dumps(datos, separators=(',', ':')).encode(), compresslevel=6)
+
+
+@receiver(post_delete, sender=Producto)
+def registrar_borrado(sender, instance, **kwargs):
+    # Un producto que ya no esta no sale en los cambios: queda su id con la
+    # version del borrado, en la misma transaccion. Mas alla del HORIZONTE las
+    # cajas reciben el catalogo completo y ya no hace falta.
+    version = version_actual()
+    ProductoBorrado.objects.filter(version__lt=version - HORIZONTE).delete()
+    ProductoBorrado.objects.create(producto_id=instance.pk, version=version)
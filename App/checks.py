@@ -0,0 +1,16 @@
+from django.core.checks import Tags, Warning, register
+from .cache import cache_compartida
+
+
+@register(Tags.caches, deploy=True)
+def revisar_cache_compartida(app_configs, **kwargs):
+    locales = [alias for alias in ('default', 'comprobantes') if not cache_compartida(alias)]
+    if not locales:
+        return []
+    return [Warning(
+        f'Caches locales a cada proceso: {", ".join(locales)}.',
+        hint=('Con varios workers las versiones de roles y del catalogo, los clientes no encontrados y los '
+              'comprobantes de facturas editadas quedan distintos en cada uno; use Redis o Memcached '
+              '(ver CACHES en settings).'),
+        id='App.W001',
+    )]
@@ -0,0 +1,252 @@
+import hashlib
+import textwrap
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Prefetch
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .exportacion import lotes_facturas
+from .models import Factura, DetalleFactura, Empleado
+
+NOMBRE_LOCAL = "UNIMARK"
+MENSAJE_LOCAL = ("En Unimark encontraras productos de calidad a precios "
+                 "justos y atencion rapida y amable. Visitanos hoy y descubre "
+                 "por que nuestros clientes confian en nosotros.")
+
+LINEA = "=" * 50
+LINEA_SIMPLE = "-" * 50
+MENSAJE_CENTRADO = "\n".join(
+    ml.center(len(LINEA))
+    for ml in textwrap.wrap(MENSAJE_LOCAL, width=len(LINEA), break_long_words=False, break_on_hyphens=False)
+) + "\n"
+
+# Una factura emitida no cambia: su comprobante se renderiza una vez y se guarda
+# en 'comprobante:<id>' (los enlaces usan el id; la entrada lleva el numero) en
+# la cache compartida 'comprobantes'. Se borra si la factura se edita o elimina;
+# el plazo solo acota lo que quede de una invalidacion perdida.
+TIEMPO_COMPROBANTE = 7 * 24 * 60 * 60
+
+
+def cache_comprobantes():
+    return caches['comprobantes']
+
+
+def texto_comprobante(factura, detalles):
+    contenido = f"""
+{LINEA}
+{"UNIMARK":^50}
+{LINEA}
+
+FACTURA N: {factura.numero}
+FECHA: {factura.fecha.strftime('%d/%m/%Y %H:%M')}
+
+{LINEA_SIMPLE}
+DATOS DEL CLIENTE
+{LINEA_SIMPLE}
+Cedula: {factura.cliente.cedula}
+Nombre: {factura.cliente.nombre_completo}
+Telefono: {factura.cliente.celular}
+Correo: {factura.cliente.correo}
+
+{LINEA_SIMPLE}
+"""
+    contenido += MENSAJE_CENTRADO
+    contenido += f"{LINEA_SIMPLE}\n\n"
+
+    contenido += "{:<20} {:>6} {:>10} {:>10}\n{}\n".format("PRODUCTO", "CANT", "P.UNIT", "TOTAL", LINEA_SIMPLE)
+
+    for detalle in detalles:
+        nombre = detalle.producto.nombre[:20]
+        iva_tag = "(0%)" if detalle.producto.es_primera_necesidad else "(15%)"
+        contenido += f"{nombre:<20} {detalle.cantidad:>6} ${detalle.precio_unitario:>9.2f} ${detalle.total_linea:>9.2f} {iva_tag}\n"
+
+    contenido += f"""
+{LINEA_SIMPLE}
+
+{"Subtotal (IVA 0%):":<30} ${factura.subtotal_sin_iva:>15.2f}
+{"Subtotal (IVA 15%):":<30} ${factura.subtotal_con_iva:>15.2f}
+{LINEA}
+{"TOTAL A PAGAR:":<30} ${factura.total:>15.2f}
+{LINEA}
+
+Atendido por: {factura.empleado.nombre_completo}
+
+Gracias por su compra!
+Vuelva pronto a UNIMARK
+"""
+    return contenido
+
+
+def html_comprobante(factura, detalles):
+    return render_to_string('cajero/comprobante.html', {
+        'factura': factura,
+        'detalles': detalles,
+        'nombre_local': NOMBRE_LOCAL,
+        'mensaje_local': MENSAJE_LOCAL,
+    })
+
+
+def etag(contenido):
+    return '"%s"' % hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:32]
+
+
+def renderizar(factura, detalles):
+    texto = texto_comprobante(factura, detalles)
+    html = html_comprobante(factura, detalles)
+    comprobante = {
+        'numero': factura.numero,
+        'texto': texto,
+        'etag_texto': etag(texto),
+        'html': html,
+        'etag_html': etag(html),
+    }
+    cache_comprobantes().set(f'comprobante:{factura.pk}', comprobante, TIEMPO_COMPROBANTE)
+    return comprobante
+
+
+def comprobante(pk):
+    # Devuelve el comprobante renderizado, o None si la factura no existe
+    datos = cache_comprobantes().get(f'comprobante:{pk}')
+    if datos is not None:
+        return datos
+
+    factura = Factura.objects.select_related('cliente', 'empleado').filter(pk=pk).first()
+    if factura is None:
+        return None
+    detalles = list(factura.detalles.select_related('producto').order_by('id'))
+    return renderizar(factura, detalles)
+
+
+def prerenderizar(factura, detalles):
+    # Para registrar_factura: usa los objetos que ya estan en memoria
+    if not Factura.empleado.is_cached(factura):
+        factura.empleado = Empleado.objects.get(pk=factura.empleado_id)
+    renderizar(factura, detalles)
+
+
+# Archivo ZIP de comprobantes de un rango de fechas
+#
+# El hilo principal recorre las facturas por lotes (fecha, id) y reparte cada
+# lote a un hilo del pool, que toma los textos ya cacheados y arma el resto con
+# una consulta por lote. Los lotes se escriben en orden a un ZipFile sobre una
+# salida sin seek, que se vacia despues de cada lote: en memoria solo estan los
+# lotes en curso.
+
+LOTE_ARCHIVO = 200
+
+
+def textos_lote(ids):
+    try:
+        claves = {f'comprobante:{pk}': pk for pk in ids}
+        cacheados = {claves[clave]: datos for clave, datos in cache_comprobantes().get_many(claves).items()}
+        textos = {pk: (datos['numero'], datos['texto']) for pk, datos in cacheados.items()}
+
+        faltantes = [pk for pk in ids if pk not in textos]
+        if faltantes:
+            facturas = Factura.objects.filter(pk__in=faltantes).select_related('cliente', 'empleado').prefetch_related(
+                Prefetch('detalles', queryset=DetalleFactura.objects.select_related('producto').order_by('id'))
+            )
+            for factura in facturas:
+                textos[factura.pk] = (factura.numero, texto_comprobante(factura, factura.detalles.all()))
+        return textos
+    finally:
+        # Cada hilo del pool tiene su propia conexion
+        connection.close()
+
+
+class SalidaZip:
+    # Destino sin seek para ZipFile: acumula lo escrito hasta que se retira
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+class ArchivoComprobantes:
+    # Iterable de bytes del ZIP, como Exportacion
+
+    def __init__(self, desde, hasta, hilos=4):
+        self.desde = desde
+        self.hasta = hasta
+        self.hilos = hilos
+        self.comprobantes = 0
+        self.duracion = None
+
+    @property
+    def nombre_archivo(self):
+        return f'comprobantes_{self.desde:%Y%m%d}_{self.hasta:%Y%m%d}.zip'
+
+    def _lotes(self):
+        for lote in lotes_facturas(self.desde, self.hasta, LOTE_ARCHIVO, campos=('id', 'fecha')):
+            yield [(factura['id'], timezone.localtime(factura['fecha'])) for factura in lote]
+
+    def __iter__(self):
+        inicio = time.perf_counter()
+        salida = SalidaZip()
+        with ThreadPoolExecutor(max_workers=self.hilos) as pool:
+            with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as archivo:
+                # Como mucho 2 lotes por hilo en vuelo, para no adelantarse al cliente
+                pendientes = []
+                for lote in self._lotes():
+                    pendientes.append((pool.submit(textos_lote, [pk for pk, _ in lote]), lote))
+                    if len(pendientes) >= self.hilos * 2:
+                        yield self._escribir(archivo, salida, *pendientes.pop(0))
+                for futuro, lote in pendientes:
+                    yield self._escribir(archivo, salida, futuro, lote)
+            yield salida.retirar()
+        self.duracion = time.perf_counter() - inicio
+
+    def _escribir(self, archivo, salida, futuro, lote):
+        textos = futuro.result()
+        for pk, fecha in lote:
+            if pk not in textos:
+                # Eliminada mientras se armaba el archivo
+                continue
+            numero, texto = textos[pk]
+            info = zipfile.ZipInfo(f'factura_{numero}.txt', date_time=fecha.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archivo.writestr(info, texto.encode('utf-8'))
+            self.comprobantes += 1
+        return salida.retirar()
+
+
+def invalidar_comprobante(factura_id):
+    cache_comprobantes().delete(f'comprobante:{factura_id}')
+
+
+@receiver(post_save, sender=Factura)
+def invalidar_factura_editada(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        invalidar_comprobante(instance.pk)
+
+
+@receiver(post_delete, sender=Factura)
+def invalidar_factura_eliminada(sender, instance, **kwargs):
+    invalidar_comprobante(instance.pk)
+
+
+@receiver(post_save, sender=DetalleFactura)
+@receiver(post_delete, sender=DetalleFactura)
+def invalidar_detalle(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar_comprobante(instance.factura_id)
@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+from django.db.models import Q
+from django.utils import timezone
+from .models import Factura, DetalleFactura
+
+logger = logging.getLogger(__name__)
+
+LOTE = 2000
+FORMATOS = ('csv', 'jsonl')
+CONTENIDOS = ('facturas', 'detalles')
+
+COLUMNAS = {
+    'facturas': ['numero', 'fecha', 'cedula', 'cliente', 'empleado',
+                 'subtotal_sin_iva', 'subtotal_con_iva', 'valor_iva', 'total'],
+    'detalles': ['numero', 'fecha', 'codigo', 'producto', 'iva', 'cantidad', 'precio_unitario', 'total_linea'],
+}
+
+
+def rango_fechas(desde, hasta):
+    inicio = timezone.make_aware(datetime.combine(desde, datetime.min.time()))
+    fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    return inicio, fin
+
+
+CAMPOS_FACTURA = (
+    'id', 'numero', 'fecha', 'cliente__cedula', 'cliente__nombre', 'cliente__apellido',
+    'empleado__nombre', 'empleado__apellido', 'subtotal_sin_iva', 'subtotal_con_iva', 'valor_iva', 'total'
+)
+
+
+def lotes_facturas(desde, hasta, tamano=LOTE, campos=CAMPOS_FACTURA):
+    # MySQL no mantiene cursores del lado del servidor con iterator(): mysqlclient
+    # trae el resultado completo a memoria. Se lee por lotes avanzando sobre
+    # (fecha, id), que usa el indice factura_fecha_id y no se degrada como OFFSET.
+    # campos debe incluir 'id' y 'fecha'.
+    inicio, fin = rango_fechas(desde, hasta)
+    facturas = Factura.objects.filter(fecha__gte=inicio, fecha__lt=fin).order_by('fecha', 'id').values(*campos)
+    ultima = None
+    while True:
+        lote = facturas
+        if ultima:
+            lote = lote.filter(Q(fecha__gt=ultima['fecha']) | Q(fecha=ultima['fecha'], id__gt=ultima['id']),
+                               fecha__gte=ultima['fecha'])
+        lote = list(lote[:tamano])
+        if not lote:
+            return
+        yield lote
+        ultima = lote[-1]
+
+
+def filas_facturas(lote):
+    for factura in lote:
+        yield {
+            'numero': factura['numero'],
+            'fecha': timezone.localtime(factura['fecha']).isoformat(timespec='seconds'),
+            'cedula': factura['cliente__cedula'],
+            'cliente': f"{factura['cliente__nombre']} {factura['cliente__apellido']}",
+            'empleado': f"{factura['empleado__nombre']} {factura['empleado__apellido']}",
+            'subtotal_sin_iva': factura['subtotal_sin_iva'],
+            'subtotal_con_iva': factura['subtotal_con_iva'],
+            'valor_iva': factura['valor_iva'],
+            'total': factura['total'],
+        }
+
+
+def filas_detalles(lote):
+    facturas = {factura['id']: factura for factura in lote}
+    detalles = DetalleFactura.objects.filter(factura_id__in=list(facturas)).order_by('factura_id', 'id').values_list(
+        'factura_id', 'producto__codigo', 'producto__nombre', 'producto__es_primera_necesidad',
+        'cantidad', 'precio_unitario', 'total_linea'
+    )
+    por_factura = {}
+    for detalle in detalles:
+        por_factura.setdefault(detalle[0], []).append(detalle)
+
+    for factura_id, factura in facturas.items():
+        fecha = timezone.localtime(factura['fecha']).isoformat(timespec='seconds')
+        for _, codigo, nombre, primera_necesidad, cantidad, precio, total in por_factura.get(factura_id, ()):
+            yield {
+                'numero': factura['numero'],
+                'fecha': fecha,
+                'codigo': codigo,
+                'producto': nombre,
+                'iva': '0%' if primera_necesidad else '15%',
+                'cantidad': cantidad,
+                'precio_unitario': precio,
+                'total_linea': total,
+            }
+
+
+class Exportacion:
+    # Iterable de bloques de bytes (uno por lote), pensado para StreamingHttpResponse
+    # o para escribir a un archivo. Al terminar deja filas y duracion.
+
+    def __init__(self, desde, hasta, contenido='facturas', formato='csv', comprimir=False):
+        if contenido not in CONTENIDOS:
+            raise ValueError(f'Contenido invalido: {contenido}')
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato invalido: {formato}')
+        self.desde = desde
+        self.hasta = hasta
+        self.contenido = contenido
+        self.formato = formato
+        self.comprimir = comprimir
+        self.filas = 0
+        self.duracion = None
+
+    @property
+    def nombre_archivo(self):
+        nombre = f'{self.contenido}_{self.desde:%Y%m%d}_{self.hasta:%Y%m%d}.{self.formato}'
+        return nombre + '.gz' if self.comprimir else nombre
+
+    @property
+    def content_type(self):
+        if self.comprimir:
+            return 'application/gzip'
+        return 'text/csv; charset=utf-8' if self.formato == 'csv' else 'application/x-ndjson; charset=utf-8'
+
+    @property
+    def filas_por_segundo(self):
+        if not self.duracion:
+            return None
+        return self.filas / self.duracion
+
+    def _texto(self):
+        columnas = COLUMNAS[self.contenido]
+        filas = filas_facturas if self.contenido == 'facturas' else filas_detalles
+        buffer = io.StringIO()
+
+        if self.formato == 'csv':
+            escritor = csv.DictWriter(buffer, fieldnames=columnas)
+            escritor.writeheader()
+            escribir = escritor.writerow
+        else:
+            def escribir(fila):
+                buffer.write(json.dumps(fila, default=str, ensure_ascii=False))
+                buffer.write('\n')
+
+        for lote in lotes_facturas(self.desde, self.hasta):
+            for fila in filas(lote):
+                escribir(fila)
+                self.filas += 1
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def __iter__(self):
+        inicio = time.perf_counter()
+        compresor = zlib.compressobj(wbits=31) if self.comprimir else None  # 31: formato gzip
+
+        for texto in self._texto():
+            datos = texto.encode('utf-8')
+            if compresor:
+                datos = compresor.compress(datos)
+            if datos:
+                yield datos
+        if compresor:
+            yield compresor.flush()
+
+        self.duracion = time.perf_counter() - inicio
+        logger.info('Exportacion %s: %d filas en %.2fs (%.0f filas/s)', self.nombre_archivo,
+                    self.filas, self.duracion, self.filas_por_segundo or 0)
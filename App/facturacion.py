@@ -0,0 +1,201 @@
+import re
+from django.db import transaction, IntegrityError
+from .models import (Cliente, Producto, Factura, DetalleFactura, MovimientoStock, SecuenciaFactura,
+                     ResumenVentasDiario, StockInsuficiente)
+from .comprobantes import prerenderizar
+
+
+# Facturas por solicitud de sincronizacion
+MAXIMO_LOTE = 100
+CLAVE_VALIDA = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+
+
+class ErrorFacturacion(Exception):
+    pass
+
+
+def normalizar_items(items):
+    lineas = []
+    for item in items:
+        producto_id = int(item['producto_id'])
+        cantidad = int(item['cantidad'])
+        if cantidad < 1:
+            raise ErrorFacturacion('La cantidad debe ser mayor a cero.')
+        lineas.append((producto_id, cantidad))
+
+    if not lineas:
+        raise ErrorFacturacion('No hay productos en la factura.')
+    return lineas
+
+
+def bloquear_productos(cantidades):
+    # Orden por pk para que dos cajas con los mismos productos no se bloqueen mutuamente
+    productos = Producto.objects.select_for_update().filter(pk__in=list(cantidades)).order_by('pk')
+    productos = {p.pk: p for p in productos}
+
+    for producto_id in cantidades:
+        if producto_id not in productos:
+            raise ErrorFacturacion(f'No existe el producto con id {producto_id}.')
+
+    for producto_id, cantidad in cantidades.items():
+        producto = productos[producto_id]
+        if producto.stock < cantidad:
+            raise StockInsuficiente(
+                f'Stock insuficiente para {producto.nombre}. Disponible: {producto.stock}'
+            )
+    return productos
+
+
+def registrar_factura(cliente, empleado_id, items, punto_emision='', clave=None):
+    lineas = normalizar_items(items)
+
+    cantidades = {}
+    for producto_id, cantidad in lineas:
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+
+    with transaction.atomic():
+        productos = bloquear_productos(cantidades)
+        return guardar_factura(
+            cliente, empleado_id, [(productos[producto_id], cantidad) for producto_id, cantidad in lineas],
+            punto_emision, clave
+        )
+
+
+def guardar_factura(cliente, empleado_id, lineas, punto_emision='', clave=None, precios=None):
+    # lineas: pares (producto, cantidad) ya validados. El producto solo aporta
+    # id, nombre e IVA; el precio es precios[producto.id] si se da (el del carrito)
+    # o el del producto. No vuelve a leer los productos: el stock lo asegura el
+    # UPDATE condicional de MovimientoStock.registrar. Va dentro de la transaccion
+    # de quien llama.
+    detalles = []
+    for producto, cantidad in lineas:
+        precio = precios[producto.pk] if precios else producto.precio_unitario
+        detalles.append(DetalleFactura(
+            producto=producto,
+            cantidad=cantidad,
+            precio_unitario=precio,
+            total_linea=precio * cantidad
+        ))
+
+    factura = Factura(
+        cliente=cliente,
+        empleado_id=empleado_id,
+        numero=SecuenciaFactura.siguiente_numero(punto_emision=punto_emision or None),
+        clave_sincronizacion=clave
+    )
+    factura.asignar_totales(
+        (detalle.producto.es_primera_necesidad, detalle.total_linea) for detalle in detalles
+    )
+    factura.save()
+
+    for detalle in detalles:
+        detalle.factura = factura
+    DetalleFactura.objects.bulk_create(detalles)
+
+    MovimientoStock.registrar(
+        [(producto.pk, -cantidad) for producto, cantidad in lineas], 'venta', factura.numero
+    )
+    ResumenVentasDiario.registrar(factura)
+    # Reimpresiones y el detalle salen de la cache desde la primera visita
+    transaction.on_commit(lambda: prerenderizar(factura, detalles))
+
+    return factura
+
+
+def validar_clave(clave):
+    if clave is None:
+        return None
+    if not isinstance(clave, str) or not CLAVE_VALIDA.match(clave):
+        raise ErrorFacturacion('Clave de sincronizacion invalida.')
+    return clave
+
+
+def resultado_factura(factura, estado):
+    return {
+        'estado': estado,
+        'factura_id': factura.id,
+        'numero': factura.numero,
+        'total': str(factura.total),
+    }
+
+
+def idempotente(clave, registrar):
+    # Devuelve (factura, creada). Con la misma clave devuelve la factura ya
+    # registrada: la caja puede reenviar una venta cuya respuesta no le llego.
+    if clave:
+        existente = Factura.objects.filter(clave_sincronizacion=clave).first()
+        if existente:
+            return existente, False
+    try:
+        return registrar(), True
+    except IntegrityError:
+        # Otra solicitud con la misma clave gano la carrera
+        existente = Factura.objects.filter(clave_sincronizacion=clave).first() if clave else None
+        if existente is None:
+            raise
+        return existente, False
+
+
+def registrar_factura_idempotente(cliente, empleado_id, items, punto_emision='', clave=None):
+    return idempotente(clave, lambda: registrar_factura(cliente, empleado_id, items, punto_emision, clave))
+
+
+def sincronizar_facturas(facturas, empleado_id, punto_emision=''):
+    # Ventas hechas sin conexion: todas en una transaccion, cada una en su
+    # savepoint (el atomic de registrar_factura). Si una falla por stock o
+    # datos invalidos se revierte solo esa y se informa en su resultado.
+    if len(facturas) > MAXIMO_LOTE:
+        raise ErrorFacturacion(f'Maximo {MAXIMO_LOTE} facturas por sincronizacion.')
+
+    claves = [factura.get('clave') for factura in facturas]
+    for clave in claves:
+        validar_clave(clave)
+    if None in claves:
+        raise ErrorFacturacion('Cada factura necesita su clave de sincronizacion.')
+
+    registradas = {f.clave_sincronizacion: f for f in Factura.objects.filter(clave_sincronizacion__in=claves)}
+    clientes = Cliente.objects.in_bulk([f.get('cliente_id') for f in facturas if str(f.get('cliente_id')).isdigit()])
+
+    resultados = []
+    with transaction.atomic():
+        # Bloqueo previo de todos los productos del lote en orden de pk: dos cajas
+        # sincronizando a la vez no se bloquean mutuamente a mitad del lote
+        productos = set()
+        for factura in facturas:
+            for item in factura.get('items') or []:
+                if str(item.get('producto_id')).isdigit():
+                    productos.add(int(item['producto_id']))
+        list(Producto.objects.select_for_update().filter(pk__in=productos).order_by('pk').values_list('pk'))
+
+        for factura, clave in zip(facturas, claves):
+            if clave in registradas:
+                resultados.append({'clave': clave, **resultado_factura(registradas[clave], 'duplicada')})
+                continue
+            cliente_id = factura.get('cliente_id')
+            cliente = clientes.get(int(cliente_id)) if str(cliente_id).isdigit() else None
+            try:
+                if cliente is None:
+                    raise ErrorFacturacion('El cliente no existe.')
+                registrada = registrar_factura(cliente, empleado_id, factura.get('items') or [], punto_emision, clave)
+            except (ErrorFacturacion, StockInsuficiente, KeyError, TypeError, ValueError) as e:
+                resultados.append({'clave': clave, 'estado': 'rechazada', 'error': str(e)})
+                continue
+            except IntegrityError:
+                # La misma clave entro por procesar_factura mientras tanto. Con
+                # REPEATABLE READ (MySQL) la fila del otro no se ve desde esta
+                # transaccion; se vuelve a buscar al terminar el lote
+                resultados.append({'clave': clave, 'estado': 'pendiente'})
+                continue
+            registradas[clave] = registrada
+            resultados.append({'clave': clave, **resultado_factura(registrada, 'creada')})
+
+    pendientes = [r['clave'] for r in resultados if r['estado'] == 'pendiente']
+    if pendientes:
+        # Fuera de la transaccion ya se ve la factura que gano la carrera. Si
+        # aun no aparece (la otra se revirtio) sigue pendiente y la caja reintenta
+        ganadoras = {f.clave_sincronizacion: f for f in Factura.objects.filter(clave_sincronizacion__in=pendientes)}
+        for resultado in resultados:
+            if resultado['clave'] in ganadoras:
+                resultado.update(resultado_factura(ganadoras[resultado['clave']], 'duplicada'))
+    return resultados
+
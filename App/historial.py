@@ -0,0 +1,117 @@
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from urllib.parse import urlencode
+from django.db.models import Q
+from django.utils import timezone
+from .models import Factura, SecuenciaFactura
+
+TAMANO_PAGINA = 25
+TAMANO_MAXIMO = 100
+
+NUMERO_COMPLETO = re.compile(r'^(\d{3})-(\d{3})-(\d{1,9})$')
+
+
+# Paginacion por clave (fecha, id)
+#
+# En vez de OFFSET, cada pagina recuerda la (fecha, id) de su primera y ultima
+# factura y la siguiente consulta empieza justo despues. Con los indices de
+# Factura.Meta el costo de una pagina no depende de cuantas facturas haya.
+
+def codificar_cursor(factura):
+    return f"{factura.fecha.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.{factura.pk}"
+
+
+def leer_cursor(valor):
+    try:
+        fecha, pk = valor.split('.')
+        fecha = datetime.strptime(fecha, '%Y%m%dT%H%M%S%f').replace(tzinfo=dt_timezone.utc)
+        return fecha, int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def leer_fecha(valor):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def filtrar_facturas(parametros):
+    # Devuelve el queryset filtrado y los filtros validos (para repetirlos en los enlaces)
+    facturas = Factura.objects.all()
+    filtros = {}
+
+    numero = parametros.get('numero', '').strip()
+    if numero:
+        filtros['numero'] = numero
+        completo = NUMERO_COMPLETO.match(numero)
+        if completo:
+            establecimiento, punto_emision, secuencial = completo.groups()
+            facturas = facturas.filter(numero=f"{establecimiento}-{punto_emision}-{secuencial.zfill(9)}")
+        elif numero.isdigit() and len(numero) <= 9:
+            # Solo el secuencial: se busca en cada serie existente por igualdad exacta
+            series = SecuenciaFactura.objects.values_list('establecimiento', 'punto_emision')
+            facturas = facturas.filter(numero__in=[
+                f"{establecimiento}-{punto_emision}-{numero.zfill(9)}" for establecimiento, punto_emision in series
+            ])
+        else:
+            facturas = facturas.filter(numero__startswith=numero)
+
+    cedula = parametros.get('cedula', '').strip()
+    if cedula:
+        filtros['cedula'] = cedula
+        facturas = facturas.filter(cliente__cedula=cedula)
+
+    desde = leer_fecha(parametros.get('desde'))
+    if desde:
+        filtros['desde'] = desde.isoformat()
+        facturas = facturas.filter(fecha__gte=timezone.make_aware(datetime.combine(desde, time.min)))
+
+    hasta = leer_fecha(parametros.get('hasta'))
+    if hasta:
+        filtros['hasta'] = hasta.isoformat()
+        facturas = facturas.filter(fecha__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)))
+
+    empleado = parametros.get('empleado', '')
+    if empleado.isdigit():
+        filtros['empleado'] = empleado
+        facturas = facturas.filter(empleado_id=int(empleado))
+
+    return facturas, filtros
+
+
+def pagina_facturas(facturas, antes=None, despues=None, tamano=TAMANO_PAGINA):
+    # antes: facturas mas antiguas que el cursor (pagina siguiente)
+    # despues: facturas mas recientes que el cursor (pagina anterior)
+    facturas = facturas.select_related('cliente', 'empleado')
+    cursor_antes = leer_cursor(antes) if antes else None
+    cursor_despues = leer_cursor(despues) if despues else None
+
+    if cursor_despues:
+        fecha, pk = cursor_despues
+        filas = list(
+            facturas.filter(Q(fecha__gt=fecha) | Q(fecha=fecha, pk__gt=pk), fecha__gte=fecha)
+            .order_by('fecha', 'id')[:tamano + 1]
+        )
+        hay_recientes = len(filas) > tamano
+        filas = filas[:tamano][::-1]
+        hay_antiguas = True
+    else:
+        if cursor_antes:
+            fecha, pk = cursor_antes
+            facturas = facturas.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, pk__lt=pk), fecha__lte=fecha)
+        filas = list(facturas.order_by('-fecha', '-id')[:tamano + 1])
+        hay_antiguas = len(filas) > tamano
+        filas = filas[:tamano]
+        hay_recientes = cursor_antes is not None
+
+    return {
+        'facturas': filas,
+        'antes': codificar_cursor(filas[-1]) if filas and hay_antiguas else None,
+        'despues': codificar_cursor(filas[0]) if filas and hay_recientes else None,
+    }
+
+
+def url_pagina(filtros, **cursor):
+    return '?' + urlencode({**filtros, **cursor})
@@ -0,0 +1,364 @@
+import csv
+import gzip
+import json
+import random
+import string
+import time
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from .cache import invalidar_catalogo, invalidar_cliente, invalidar_roles, CEDULA_CONSUMIDOR_FINAL
+from .models import Cliente, Empleado, Producto, MovimientoStock, version_actual
+
+# Importacion masiva de productos, clientes y empleados desde CSV o JSONL
+#
+# El archivo se lee como flujo (tambien .gz) y se procesa por lotes: cada fila
+# se valida en memoria (full_clean sin las consultas de unicidad), una consulta
+# trae cuales claves del lote ya existen y el lote entra con un solo
+# bulk_create que actualiza las existentes (upsert por codigo o cedula). Cada
+# lote va en su propia transaccion; una fila invalida se informa y se salta.
+#
+# bulk_create no dispara senales: aqui se hace lo que harian (busqueda del
+# cliente, stock inicial de los productos nuevos, caches). La importacion corre
+# en otro proceso que los workers: sus invalidaciones solo les llegan con la
+# cache compartida (ver CACHES en settings); el indice de busqueda de cada
+# worker recoge los cambios en su proxima recarga (BUSQUEDA_INDICE_TTL).
+
+LOTE = 5000
+FORMATOS = ('csv', 'jsonl')
+# Errores que se guardan con su linea; el resto solo se cuenta
+ERRORES_DETALLADOS = 20
+VERDADERO = {'1', 'true', 't', 'si', 's', 'x', 'yes', 'y'}
+FALSO = {'0', 'false', 'f', 'no', 'n', ''}
+
+
+class ErrorImportacion(Exception):
+    pass
+
+
+def formato_de(ruta):
+    nombre = ruta[:-3] if ruta.endswith('.gz') else ruta
+    if nombre.endswith('.csv'):
+        return 'csv'
+    if nombre.endswith('.jsonl') or nombre.endswith('.json'):
+        return 'jsonl'
+    raise ErrorImportacion(f'No se reconoce el formato de {ruta}; indique csv o jsonl.')
+
+
+def abrir(ruta):
+    if ruta.endswith('.gz'):
+        return gzip.open(ruta, 'rt', encoding='utf-8-sig', newline='')
+    return open(ruta, encoding='utf-8-sig', newline='')
+
+
+def leer_filas(archivo, formato):
+    # (numero de linea, dict) sin cargar el archivo en memoria
+    if formato == 'csv':
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, fila
+        return
+    for numero, linea in enumerate(archivo, 1):
+        if linea.strip():
+            try:
+                yield numero, json.loads(linea)
+            except ValueError:
+                yield numero, None
+
+
+def lotes(filas, tamano):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) == tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def texto(fila, campo, defecto=''):
+    valor = fila.get(campo)
+    return defecto if valor is None else str(valor).strip()
+
+
+def booleano(fila, campo, defecto):
+    valor = fila.get(campo)
+    if valor is None:
+        return defecto
+    if isinstance(valor, bool):
+        return valor
+    valor = str(valor).strip().lower()
+    if valor in VERDADERO:
+        return True
+    if valor in FALSO:
+        return False
+    raise ValidationError({campo: f'Valor no valido: {valor}'})
+
+
+class GeneradorCodigos:
+    # Codigos aleatorios unicos contra un conjunto en memoria con los que ya
+    # existen (una consulta por prefijo) y los que trae el archivo
+    caracteres = string.ascii_uppercase + string.digits
+
+    def __init__(self, longitud=6):
+        self.longitud = longitud
+        self.usados = set()
+        self.prefijos = set()
+
+    def reservar(self, codigo):
+        self.usados.add(codigo)
+
+    def generar(self, prefijo):
+        if prefijo not in self.prefijos:
+            self.usados.update(Producto.objects.filter(codigo__startswith=prefijo)
+                               .values_list('codigo', flat=True).iterator(chunk_size=LOTE))
+            self.prefijos.add(prefijo)
+        while True:
+            codigo = prefijo + ''.join(random.choices(self.caracteres, k=self.longitud))
+            if codigo not in self.usados:
+                self.usados.add(codigo)
+                return codigo
+
+
+class Resultado:
+    def __init__(self):
+        self.leidas = 0
+        self.creadas = 0
+        self.actualizadas = 0
+        self.omitidas = 0
+        self.con_error = 0
+        self.errores = []
+        self.inicio = time.perf_counter()
+        self.segundos = 0
+
+    @property
+    def filas_por_segundo(self):
+        return self.leidas / self.segundos if self.segundos else 0
+
+    def error(self, numero, error):
+        self.con_error += 1
+        if len(self.errores) < ERRORES_DETALLADOS:
+            if isinstance(error, ValidationError) and hasattr(error, 'message_dict'):
+                error = '; '.join(f'{campo}: {" ".join(mensajes)}' for campo, mensajes in error.message_dict.items())
+            self.errores.append(f'linea {numero}: {error}')
+
+
+class Importacion:
+    modelo = None
+    clave = None
+    # Campos que se sobrescriben cuando la clave ya existe
+    actualizables = ()
+    excluir_validacion = ()
+
+    def __init__(self, tamano_lote=LOTE, actualizar=True):
+        # actualizar=False deja como estan las filas cuya clave ya existe
+        self.tamano_lote = tamano_lote
+        self.actualizar = actualizar
+        self.resultado = Resultado()
+        # Claves ya vistas en el archivo: una clave repetida es un error de la fila
+        self.vistas = set()
+
+    def construir(self, fila):
+        raise NotImplementedError
+
+    def importar(self, filas, progreso=None):
+        for lote in lotes(filas, self.tamano_lote):
+            self.importar_lote(lote)
+            self.resultado.segundos = time.perf_counter() - self.resultado.inicio
+            if progreso:
+                progreso(self.resultado)
+        self.terminar()
+        self.resultado.segundos = time.perf_counter() - self.resultado.inicio
+        return self.resultado
+
+    def validar(self, lote):
+        objetos = []
+        for numero, fila in lote:
+            self.resultado.leidas += 1
+            try:
+                if not isinstance(fila, dict):
+                    raise ErrorImportacion('la fila no es un objeto JSON')
+                objeto = self.construir(fila)
+                if objeto is None:
+                    self.resultado.omitidas += 1
+                    continue
+                objeto.full_clean(exclude=self.excluir_validacion, validate_unique=False,
+                                  validate_constraints=False)
+            except (ValidationError, ErrorImportacion, ValueError, TypeError) as e:
+                self.resultado.error(numero, e)
+                continue
+            clave = getattr(objeto, self.clave)
+            if clave in self.vistas:
+                self.resultado.error(numero, f'{self.clave} {clave} repetido en el archivo')
+                continue
+            self.vistas.add(clave)
+            objetos.append(objeto)
+        return objetos
+
+    def importar_lote(self, lote):
+        objetos = self.validar(self.preparar(lote))
+        if not objetos:
+            return
+        claves = [getattr(objeto, self.clave) for objeto in objetos]
+        # clave -> pk de las que ya estaban
+        existentes = dict(self.modelo.objects.filter(**{f'{self.clave}__in': claves})
+                          .values_list(self.clave, 'pk'))
+        nuevos = [objeto for objeto in objetos if getattr(objeto, self.clave) not in existentes]
+        if not self.actualizar:
+            self.resultado.omitidas += len(existentes)
+            objetos, existentes = nuevos, {}
+
+        # MySQL no acepta unique_fields: su ON DUPLICATE KEY UPDATE ya choca con
+        # el indice unico de la clave
+        opciones = {}
+        if connections[router.db_for_write(self.modelo)].features.supports_update_conflicts_with_target:
+            opciones['unique_fields'] = [self.clave]
+        with transaction.atomic():
+            self.modelo.objects.bulk_create(objetos, update_conflicts=True, update_fields=list(self.actualizables),
+                                            **opciones)
+            self.guardado(nuevos, existentes)
+
+        self.resultado.creadas += len(nuevos)
+        self.resultado.actualizadas += len(existentes)
+
+    def preparar(self, lote):
+        return lote
+
+    def guardado(self, nuevos, existentes):
+        pass
+
+    def terminar(self):
+        pass
+
+
+class ImportacionProductos(Importacion):
+    # Columnas: codigo (opcional), nombre, descripcion, marca, precio_unitario,
+    # stock, es_primera_necesidad, activo. Sin codigo se genera uno (PN para los
+    # de primera necesidad, PR para el resto) y la fila se omite si ya hay un
+    # producto con ese nombre. El stock solo se usa al crear: el de los productos
+    # existentes se mueve con inventario (MovimientoStock), no con la importacion.
+    modelo = Producto
+    clave = 'codigo'
+    actualizables = ('nombre', 'descripcion', 'marca', 'precio_unitario', 'es_primera_necesidad', 'activo',
+                     'version_datos')
+
+    def __init__(self, tamano_lote=LOTE, actualizar=True):
+        super().__init__(tamano_lote, actualizar)
+        self.codigos = GeneradorCodigos()
+        self.nombres_existentes = set()
+        self.nombres_archivo = set()
+
+    def preparar(self, lote):
+        # Una consulta por lote para los nombres de las filas sin codigo
+        nombres = [texto(fila, 'nombre') for _, fila in lote if isinstance(fila, dict) and not texto(fila, 'codigo')]
+        if nombres:
+            self.nombres_existentes = set(Producto.objects.filter(nombre__in=nombres)
+                                          .values_list('nombre', flat=True))
+        return lote
+
+    def construir(self, fila):
+        codigo = texto(fila, 'codigo')
+        nombre = texto(fila, 'nombre')
+        es_primera_necesidad = booleano(fila, 'es_primera_necesidad', False)
+        if codigo:
+            self.codigos.reservar(codigo)
+        elif nombre in self.nombres_existentes or nombre in self.nombres_archivo:
+            return None
+        else:
+            self.nombres_archivo.add(nombre)
+            codigo = self.codigos.generar('PN' if es_primera_necesidad else 'PR')
+        return Producto(
+            codigo=codigo,
+            nombre=nombre,
+            descripcion=texto(fila, 'descripcion'),
+            marca=texto(fila, 'marca'),
+            precio_unitario=texto(fila, 'precio_unitario', None),
+            stock=texto(fila, 'stock', '0') or '0',
+            es_primera_necesidad=es_primera_necesidad,
+            activo=booleano(fila, 'activo', True),
+            version_datos=version_actual(),
+        )
+
+    def guardado(self, nuevos, existentes):
+        MovimientoStock.registrar_iniciales(nuevos)
+        if existentes:
+            claves = [f'producto:{pk}' for pk in existentes.values()]
+            transaction.on_commit(lambda: cache.delete_many(claves))
+
+    def terminar(self):
+        # Codigos nuevos y "no encontrado" de toda la cache de una vez
+        invalidar_catalogo()
+
+
+class ImportacionPersonas(Importacion):
+    clave = 'cedula'
+
+    def datos(self, fila):
+        return {
+            'cedula': texto(fila, 'cedula'),
+            'nombre': texto(fila, 'nombre'),
+            'apellido': texto(fila, 'apellido'),
+            'celular': texto(fila, 'celular'),
+            'correo': texto(fila, 'correo'),
+        }
+
+
+class ImportacionClientes(ImportacionPersonas):
+    # Columnas: cedula, nombre, apellido, celular, correo
+    modelo = Cliente
+    actualizables = ('nombre', 'apellido', 'celular', 'correo', 'busqueda')
+
+    def construir(self, fila):
+        cliente = Cliente(**self.datos(fila))
+        # Lo que hace Cliente.save()
+        cliente.busqueda = Cliente.texto_busqueda(cliente.nombre, cliente.apellido)
+        return cliente
+
+    def guardado(self, nuevos, existentes):
+        # Las cedulas nuevas pueden estar en cache como "no encontrado"
+        cedulas = [cliente.cedula for cliente in nuevos] + list(existentes)
+        if cedulas:
+            transaction.on_commit(lambda: self.invalidar(cedulas))
+
+    def invalidar(self, cedulas):
+        cache.delete_many([f'cliente:cedula:{cedula}' for cedula in cedulas])
+        if CEDULA_CONSUMIDOR_FINAL in cedulas:
+            invalidar_cliente(CEDULA_CONSUMIDOR_FINAL)
+
+
+class ImportacionEmpleados(ImportacionPersonas):
+    # Columnas: cedula, nombre, apellido, celular, correo, cargo, punto_emision,
+    # activo. El usuario del sistema se asigna aparte.
+    modelo = Empleado
+    actualizables = ('nombre', 'apellido', 'celular', 'correo', 'cargo', 'punto_emision', 'activo')
+    excluir_validacion = ('usuario',)
+
+    def construir(self, fila):
+        return Empleado(
+            **self.datos(fila),
+            cargo=texto(fila, 'cargo'),
+            punto_emision=texto(fila, 'punto_emision'),
+            activo=booleano(fila, 'activo', True),
+        )
+
+    def guardado(self, nuevos, existentes):
+        # El punto de emision va en los roles guardados en la sesion
+        if existentes:
+            usuarios = list(Empleado.objects.filter(pk__in=existentes.values(), usuario__isnull=False)
+                            .values_list('usuario_id', flat=True))
+            if usuarios:
+                transaction.on_commit(lambda: invalidar_roles(*usuarios))
+
+
+IMPORTACIONES = {
+    'productos': ImportacionProductos,
+    'clientes': ImportacionClientes,
+    'empleados': ImportacionEmpleados,
+}
+
+
+def importar_archivo(tipo, ruta, formato=None, tamano_lote=LOTE, actualizar=True, progreso=None):
+    formato = formato or formato_de(ruta)
+    with abrir(ruta) as archivo:
+        return IMPORTACIONES[tipo](tamano_lote, actualizar).importar(leer_filas(archivo, formato), progreso)
@@ -0,0 +1,69 @@
+from django.core.paginator import Paginator
+from django.db.models import Q
+from .models import Cliente, Producto, normalizar_texto
+
+PRODUCTOS_POR_PAGINA = 24
+CLIENTES_POR_PAGINA = 50
+
+BANDAS_STOCK = {
+    'agotado': Q(stock=0),
+    'bajo': Q(stock__gt=0, stock__lte=5),
+    'disponible': Q(stock__gt=5),
+}
+
+
+def filtrar_productos(parametros):
+    # Devuelve el queryset filtrado y los filtros validos (para repetirlos en los enlaces)
+    productos = Producto.objects.all()
+    filtros = {}
+
+    q = parametros.get('q', '').strip()
+    if q:
+        filtros['q'] = q
+        productos = productos.filter(Q(codigo__istartswith=q) | Q(nombre__icontains=q))
+
+    iva = parametros.get('iva', '')
+    if iva in ('0', '15'):
+        filtros['iva'] = iva
+        # __in y no =: SQLite escribe el filtro booleano como 'NOT campo', que no
+        # puede entrar por producto_iva_nombre
+        productos = productos.filter(es_primera_necesidad__in=[iva == '0'])
+
+    stock = parametros.get('stock', '')
+    if stock in BANDAS_STOCK:
+        filtros['stock'] = stock
+        productos = productos.filter(BANDAS_STOCK[stock])
+
+    marca = parametros.get('marca', '').strip()
+    if marca:
+        filtros['marca'] = marca
+        productos = productos.filter(marca=marca)
+
+    activo = parametros.get('activo', '')
+    if activo in ('si', 'no'):
+        filtros['activo'] = activo
+        productos = productos.filter(activo=(activo == 'si'))
+
+    return productos.order_by('nombre', 'id'), filtros
+
+
+def pagina(queryset, numero, por_pagina):
+    return Paginator(queryset, por_pagina).get_page(numero)
+
+
+def clientes_por_texto(consulta):
+    # Cedula parcial o inicio de 'nombre apellido'. Se usa istartswith y no
+    # startswith: en MySQL este ultimo es LIKE BINARY y no aprovecha el indice;
+    # la columna ya esta en minusculas, asi que el resultado es el mismo.
+    consulta = consulta.strip()
+    if consulta.isdigit():
+        return Cliente.objects.filter(cedula__istartswith=consulta).order_by('cedula')
+    texto = ' '.join(normalizar_texto(consulta).split())
+    return Cliente.objects.filter(busqueda__istartswith=texto).order_by('busqueda', 'id')
+
+
+def filtrar_clientes(parametros):
+    q = parametros.get('q', '').strip()
+    if q:
+        return clientes_por_texto(q), {'q': q}
+    return Cliente.objects.order_by('busqueda', 'id'), {}
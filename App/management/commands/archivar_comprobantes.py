@@ -0,0 +1,41 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from App.comprobantes import ArchivoComprobantes
+from App.historial import leer_fecha
+
+
+class Command(BaseCommand):
+    help = 'Genera un ZIP con los comprobantes de texto de las facturas de un rango de fechas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer dia (AAAA-MM-DD); por defecto el primero del mes')
+        parser.add_argument('--hasta', help='Ultimo dia (AAAA-MM-DD); por defecto hoy')
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos que arman los comprobantes')
+        parser.add_argument('--salida', help='Archivo de salida; por defecto el nombre sugerido, "-" para stdout')
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+        desde = leer_fecha(options['desde']) if options['desde'] else hoy.replace(day=1)
+        hasta = leer_fecha(options['hasta']) if options['hasta'] else hoy
+        if desde is None or hasta is None:
+            raise CommandError('Formato de fecha invalido, use AAAA-MM-DD.')
+        if desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta.')
+
+        archivo = ArchivoComprobantes(desde, hasta, hilos=max(1, options['hilos']))
+        salida = options['salida'] or archivo.nombre_archivo
+
+        if salida == '-':
+            for bloque in archivo:
+                sys.stdout.buffer.write(bloque)
+            sys.stdout.buffer.flush()
+        else:
+            with open(salida, 'wb') as destino:
+                for bloque in archivo:
+                    destino.write(bloque)
+
+        self.stderr.write(self.style.SUCCESS(
+            f'[OK] {archivo.comprobantes} comprobantes en {archivo.duracion:.2f}s '
+            f'({archivo.comprobantes / archivo.duracion if archivo.duracion else 0:.0f}/s) -> {salida}'
+        ))
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client as ClienteHttp
+from django.urls import reverse
+from django.utils import timezone
+from App.models import Cliente, Producto
+from App.sembrado import sembrar
+from .benchmark_pos import percentil, commit_actual
+
+# Levanta gunicorn con cada perfil de Proyecto/gunicorn.conf.py (WSGI y ASGI) y
+# distintas cantidades de workers, y lo carga con muchas cajas buscando a la
+# vez (buscar_producto, buscar_codigo, buscar_cliente). Reporta cuantos workers
+# necesita cada perfil para que el p95 quede bajo el objetivo sin errores.
+#
+# El generador de carga corre en esta misma maquina: con pocos nucleos compite
+# con el servidor por la CPU, y los numeros absolutos solo valen entre corridas
+# en la misma maquina. --latencia-db agrega una espera a cada consulta de los
+# workers para simular la base en otro servidor, que es donde ASGI se nota.
+USUARIO = 'bench_busqueda'
+MEZCLA = (('buscar_producto', 6), ('buscar_codigo', 2), ('buscar_cliente', 2))
+
+# Se carga despues del perfil: instala la latencia simulada en cada worker
+CONFIG_LATENCIA = '''
+exec(open({perfil!r}).read())
+
+
+def post_fork(server, worker):
+    import time
+    from django.db.backends.signals import connection_created
+
+    def esperar(execute, sql, params, many, context):
+        time.sleep({segundos!r})
+        return execute(sql, params, many, context)
+
+    def instalar(sender, connection, **kwargs):
+        # La misma conexion se reabre en cada solicitud
+        if esperar not in connection.execute_wrappers:
+            connection.execute_wrappers.append(esperar)
+
+    connection_created.connect(instalar, weak=False)
+'''
+
+
+async def pedir(puerto, ruta, cookie, espera):
+    inicio = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', puerto), espera)
+        writer.write(
+            f'GET {ruta} HTTP/1.1\r\nHost: localhost\r\nCookie: {settings.SESSION_COOKIE_NAME}={cookie}\r\n'
+            f'Connection: close\r\n\r\n'.encode()
+        )
+        respuesta = await asyncio.wait_for(reader.read(), espera)
+        writer.close()
+        estado = int(respuesta[9:12])
+    except (OSError, asyncio.TimeoutError, ValueError):
+        estado = 0
+    return (time.perf_counter() - inicio) * 1000, estado
+
+
+async def caja(puerto, rutas, cookie, fin, rnd, espera, mediciones):
+    while time.monotonic() < fin:
+        mediciones.append(await pedir(puerto, rnd.choice(rutas), cookie, espera))
+
+
+def generar(args):
+    # Un proceso generador: `concurrencia` cajas en un bucle de eventos
+    puerto, rutas, cookie, concurrencia, duracion, espera, semilla = args
+    rnd = random.Random(semilla)
+    mediciones = []
+
+    async def principal():
+        fin = time.monotonic() + duracion
+        await asyncio.gather(*(caja(puerto, rutas, cookie, fin, random.Random(rnd.random()), espera, mediciones)
+                               for _ in range(concurrencia)))
+
+    asyncio.run(principal())
+    return mediciones
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ('Compara cuantos workers WSGI y ASGI hacen falta para atender busquedas concurrentes de la caja '
+            'con un p95 bajo el objetivo. Necesita gunicorn y uvicorn instalados.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--perfiles', default='wsgi,asgi')
+        parser.add_argument('--workers', default='1,2,4,8', help='Cantidades de workers a probar, separadas por coma')
+        parser.add_argument('--concurrencia', type=int, default=500, help='Busquedas simultaneas')
+        parser.add_argument('--generadores', type=int, default=2, help='Procesos que generan la carga')
+        parser.add_argument('--duracion', type=float, default=10, help='Segundos medidos por corrida')
+        parser.add_argument('--calentamiento', type=float, default=2, help='Segundos sin medir por corrida')
+        parser.add_argument('--objetivo-p95', type=float, default=250, help='Milisegundos')
+        parser.add_argument('--latencia-db', type=float, default=0,
+                            help='Milisegundos de espera simulada en cada consulta de los workers')
+        parser.add_argument('--sembrar', action='store_true',
+                            help='Inserta un catalogo y clientes sinteticos si la base no los tiene')
+        parser.add_argument('--productos', type=int, default=5000)
+        parser.add_argument('--clientes', type=int, default=20000)
+        parser.add_argument('--salida', help='Guarda el resultado en un archivo JSON')
+
+    def handle(self, *args, **options):
+        for modulo in ('gunicorn', 'uvicorn'):
+            try:
+                __import__(modulo)
+            except ImportError:
+                raise CommandError(f'Falta {modulo}: pip install gunicorn uvicorn')
+        if options['sembrar'] and not Producto.objects.filter(codigo__startswith='SIN').exists():
+            sembrar(options['productos'], options['clientes'])
+
+        rutas = self.rutas()
+        cookie = self.sesion()
+        connections.close_all()
+
+        # Cada caja simulada abre un socket
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if blando < options['concurrencia'] + 1024:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(duro, options['concurrencia'] * 2 + 1024), duro))
+
+        corridas = []
+        for perfil in options['perfiles'].split(','):
+            for workers in [int(w) for w in options['workers'].split(',')]:
+                corrida = self.correr(perfil, workers, rutas, cookie, options)
+                corridas.append(corrida)
+                self.stdout.write(
+                    f'  {perfil:<5} workers={workers:<3} {corrida["solicitudes_por_segundo"]:>8.1f} sol/s  '
+                    f'p50={corrida["p50_ms"]:>8.1f}ms  p95={corrida["p95_ms"]:>8.1f}ms  '
+                    f'p99={corrida["p99_ms"]:>8.1f}ms  errores={corrida["errores"]}'
+                )
+
+        necesarios = {}
+        for perfil in options['perfiles'].split(','):
+            suficientes = [c['workers'] for c in corridas if c['perfil'] == perfil
+                           and c['errores'] == 0 and c['p95_ms'] <= options['objetivo_p95']]
+            necesarios[perfil] = min(suficientes) if suficientes else None
+            self.stdout.write(
+                f'{perfil}: ' + (f'{necesarios[perfil]} worker(s)' if necesarios[perfil] else 'ninguna cantidad probada')
+                + f' para p95 <= {options["objetivo_p95"]:.0f}ms con {options["concurrencia"]} busquedas simultaneas'
+            )
+
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump({
+                    'fecha': timezone.now().isoformat(timespec='seconds'),
+                    'commit': commit_actual(),
+                    'motor': connection.vendor,
+                    'nucleos': os.cpu_count(),
+                    'parametros': {clave: options[clave] for clave in (
+                        'concurrencia', 'generadores', 'duracion', 'objetivo_p95', 'latencia_db')},
+                    'workers_necesarios': necesarios,
+                    'corridas': corridas,
+                }, archivo, indent=2)
+            self.stdout.write(f'Resultado guardado en {options["salida"]}')
+
+    def rutas(self):
+        productos = list(Producto.objects.filter(activo=True, stock__gt=0).values_list('codigo', 'nombre')[:2000])
+        cedulas = list(Cliente.objects.values_list('cedula', flat=True)[:2000])
+        if not productos or not cedulas:
+            raise CommandError('Faltan productos o clientes; use --sembrar.')
+        rnd = random.Random(42)
+        rutas = []
+        for endpoint, peso in MEZCLA:
+            for codigo, nombre in productos[:200]:
+                if endpoint == 'buscar_producto':
+                    # Lo que se alcanza a escribir antes de la pausa
+                    palabra = nombre.split()[0].lower()
+                    ruta = f'{reverse(endpoint)}?q={palabra[:rnd.randint(2, max(2, len(palabra)))]}'
+                elif endpoint == 'buscar_codigo':
+                    ruta = f'{reverse(endpoint)}?codigo={codigo}'
+                else:
+                    ruta = f'{reverse(endpoint)}?cedula={rnd.choice(cedulas)}'
+                rutas.extend([ruta] * peso)
+        return rutas
+
+    def sesion(self):
+        # Sesion real en la base: los workers del servidor la leen igual que la de una caja
+        grupo, _ = Group.objects.get_or_create(name='Cajero')
+        usuario, creado = User.objects.get_or_create(username=USUARIO)
+        if creado:
+            usuario.set_unusable_password()
+            usuario.save()
+            usuario.groups.add(grupo)
+        http = ClienteHttp(SERVER_NAME='localhost')
+        http.force_login(usuario)
+        return http.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def correr(self, perfil, workers, rutas, cookie, options):
+        puerto = puerto_libre()
+        perfil_gunicorn = str(settings.BASE_DIR / 'Proyecto' / 'gunicorn.conf.py')
+        config = perfil_gunicorn
+        temporal = None
+        if options['latencia_db']:
+            temporal = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+            temporal.write(CONFIG_LATENCIA.format(perfil=perfil_gunicorn, segundos=options['latencia_db'] / 1000))
+            temporal.close()
+            config = temporal.name
+
+        aplicacion = 'Proyecto.asgi' if perfil == 'asgi' else 'Proyecto.wsgi'
+        entorno = dict(os.environ, SERVIDOR=perfil, WORKERS=str(workers), BIND=f'127.0.0.1:{puerto}')
+        servidor = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', config, aplicacion],
+            cwd=settings.BASE_DIR, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.esperar_servidor(servidor, puerto, rutas[0], cookie)
+            generadores = max(1, min(options['generadores'], options['concurrencia']))
+            por_generador = options['concurrencia'] // generadores
+            espera = 30
+
+            def tareas(duracion):
+                return [(puerto, rutas, cookie, por_generador + (i < options['concurrencia'] % generadores),
+                         duracion, espera, i) for i in range(generadores)]
+
+            with multiprocessing.get_context('fork').Pool(generadores) as pool:
+                if options['calentamiento']:
+                    pool.map(generar, tareas(options['calentamiento']))
+                inicio = time.perf_counter()
+                mediciones = [m for parte in pool.map(generar, tareas(options['duracion'])) for m in parte]
+                duracion = time.perf_counter() - inicio
+        finally:
+            servidor.send_signal(signal.SIGTERM)
+            try:
+                servidor.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                servidor.kill()
+                servidor.wait()
+            if temporal:
+                os.unlink(temporal.name)
+
+        correctas = [tiempo for tiempo, estado in mediciones if estado == 200]
+        return {
+            'perfil': perfil,
+            'workers': workers,
+            'solicitudes': len(mediciones),
+            'errores': len(mediciones) - len(correctas),
+            'solicitudes_por_segundo': round(len(correctas) / duracion, 2),
+            'p50_ms': round(percentil(correctas, 0.50), 2) if correctas else float('inf'),
+            'p95_ms': round(percentil(correctas, 0.95), 2) if correctas else float('inf'),
+            'p99_ms': round(percentil(correctas, 0.99), 2) if correctas else float('inf'),
+        }
+
+    def esperar_servidor(self, servidor, puerto, ruta, cookie):
+        limite = time.monotonic() + 60
+        while time.monotonic() < limite:
+            if servidor.poll() is not None:
+                raise CommandError(f'gunicorn termino con codigo {servidor.returncode}')
+            _, estado = asyncio.run(pedir(puerto, ruta, cookie, 5))
+            if estado == 200:
+                return
+            if estado and estado != 200:
+                raise CommandError(f'{ruta} respondio {estado}; revise ALLOWED_HOSTS y la sesion')
+            time.sleep(0.2)
+        raise CommandError('El servidor no respondio en 60 segundos')
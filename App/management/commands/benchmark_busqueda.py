@@ -0,0 +1,107 @@
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from App.busqueda import IndiceProductos, buscar_productos_orm
+from App.models import Producto, CATEGORIAS_PRIMERA_NECESIDAD
+
+MARCAS = ['Conejo', 'Vita', 'Supan', 'La Favorita', 'Nestle', 'Toni', 'Pronaca', 'Real', 'Facundo', 'Oriental']
+PRESENTACIONES = ['250g', '500g', '1kg', '2kg', '1L', '500ml', 'x6', 'x12', 'Familiar', 'Personal']
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+class Command(BaseCommand):
+    help = 'Compara la busqueda de productos por ORM (icontains) contra el indice en memoria'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 50000, 500000])
+        parser.add_argument('--consultas', type=int, default=200)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        for tamano in options['tamanos']:
+            try:
+                with transaction.atomic():
+                    self.medir(tamano, options['consultas'], random.Random(options['semilla']))
+                    # Los productos sinteticos nunca se confirman
+                    raise Rollback()
+            except Rollback:
+                pass
+
+    def medir(self, tamano, num_consultas, rnd):
+        inicio = time.perf_counter()
+        lote = []
+        for i in range(tamano):
+            categoria = rnd.choice(CATEGORIAS_PRIMERA_NECESIDAD + ['galletas', 'jabon', 'shampoo', 'chocolate'])
+            lote.append(Producto(
+                codigo=f'BEN{i:08d}',
+                nombre=f'{categoria.title()} {rnd.choice(MARCAS)} {rnd.choice(PRESENTACIONES)} {i}',
+                descripcion='Producto sintetico de benchmark',
+                marca=rnd.choice(MARCAS),
+                precio_unitario=Decimal('1.00'),
+                stock=rnd.randint(0, 100),
+            ))
+            if len(lote) == 5000:
+                Producto.objects.bulk_create(lote)
+                lote = []
+        Producto.objects.bulk_create(lote)
+        self.stdout.write(f'\n{tamano} productos insertados en {time.perf_counter() - inicio:.1f}s')
+
+        # Se mide el indice aunque pase de BUSQUEDA_INDICE_MAXIMO, para ver lo
+        # que costaria subir el limite
+        indice = IndiceProductos()
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        with override_settings(BUSQUEDA_INDICE_MAXIMO=None):
+            indice.cargar()
+        duracion = time.perf_counter() - inicio
+        memoria, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f'Indice construido en {duracion:.2f}s, {memoria / 2**20:.0f} MB '
+                          f'(pico de carga {pico / 2**20:.0f} MB)')
+        maximo = getattr(settings, 'BUSQUEDA_INDICE_MAXIMO', None)
+        activos = Producto.objects.filter(activo=True).count()
+        if maximo is not None and activos > maximo:
+            self.stdout.write(f'  {activos} productos activos pasan de BUSQUEDA_INDICE_MAXIMO={maximo}: '
+                              f'en produccion la busqueda iria al ORM')
+
+        consultas = []
+        for _ in range(num_consultas):
+            tipo = rnd.random()
+            if tipo < 0.3:
+                consultas.append(f'BEN{rnd.randrange(tamano):08d}')
+            elif tipo < 0.6:
+                consultas.append(rnd.choice(CATEGORIAS_PRIMERA_NECESIDAD)[:rnd.randint(2, 5)])
+            else:
+                consultas.append(rnd.choice(MARCAS).lower()[:rnd.randint(3, 6)])
+
+        tiempos_orm = []
+        tiempos_indice = []
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            list(buscar_productos_orm(consulta))
+            tiempos_orm.append((time.perf_counter() - inicio) * 1000)
+
+            inicio = time.perf_counter()
+            ids = indice.buscar(consulta)
+            list(Producto.objects.in_bulk(ids).values())
+            tiempos_indice.append((time.perf_counter() - inicio) * 1000)
+
+        for nombre, tiempos in (('ORM icontains', tiempos_orm), ('Indice memoria', tiempos_indice)):
+            self.stdout.write(
+                f'  {nombre:<15} media {statistics.mean(tiempos):8.2f} ms   '
+                f'p95 {percentil(tiempos, 0.95):8.2f} ms   max {max(tiempos):8.2f} ms'
+            )
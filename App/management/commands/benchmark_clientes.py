@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from App.listados import clientes_por_texto
+from App.models import Cliente
+
+NOMBRES = ['Maria', 'Jose', 'Luis', 'Ana', 'Carlos', 'Rosa', 'Jorge', 'Lucia', 'Andres', 'Monica',
+           'Cesar', 'Veronica', 'Angel', 'Ines', 'Raul', 'Belen', 'Sebastian', 'Mateo', 'Sofia', 'Ramon']
+APELLIDOS = ['Garcia', 'Perez', 'Lopez', 'Rodriguez', 'Zambrano', 'Mendoza', 'Vera', 'Cedeño', 'Muñoz',
+             'Guaman', 'Chavez', 'Quishpe', 'Moreira', 'Ordoñez', 'Sanchez', 'Velez', 'Ramirez', 'Castillo']
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def buscar_icontains(consulta):
+    # La busqueda que haria falta sin la columna normalizada
+    if consulta.isdigit():
+        return Cliente.objects.filter(cedula__contains=consulta).order_by('apellido', 'nombre')
+    filtro = Q()
+    for palabra in consulta.split():
+        filtro &= Q(nombre__icontains=palabra) | Q(apellido__icontains=palabra)
+    return Cliente.objects.filter(filtro).order_by('apellido', 'nombre')
+
+
+class Command(BaseCommand):
+    help = 'Compara la busqueda de clientes por prefijo en la columna normalizada contra icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[10000, 100000, 500000])
+        parser.add_argument('--consultas', type=int, default=200)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        for tamano in options['tamanos']:
+            try:
+                with transaction.atomic():
+                    self.medir(tamano, options['consultas'], random.Random(options['semilla']))
+                    # Los clientes sinteticos nunca se confirman
+                    raise Rollback()
+            except Rollback:
+                pass
+
+    def medir(self, tamano, num_consultas, rnd):
+        inicio = time.perf_counter()
+        lote = []
+        for i in range(tamano):
+            nombre = rnd.choice(NOMBRES)
+            apellido = f'{rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}'
+            lote.append(Cliente(
+                cedula=f'8{i:09d}',
+                nombre=nombre,
+                apellido=apellido,
+                celular='0990000000',
+                correo=f'cliente{i}@correo.com',
+                busqueda=Cliente.texto_busqueda(nombre, apellido),
+            ))
+            if len(lote) == 5000:
+                Cliente.objects.bulk_create(lote)
+                lote = []
+        Cliente.objects.bulk_create(lote)
+        self.stdout.write(f'\n{tamano} clientes insertados en {time.perf_counter() - inicio:.1f}s')
+
+        consultas = []
+        for _ in range(num_consultas):
+            tipo = rnd.random()
+            if tipo < 0.3:
+                consultas.append(f'8{rnd.randrange(tamano):09d}'[:rnd.randint(4, 8)])
+            elif tipo < 0.7:
+                consultas.append(rnd.choice(NOMBRES).lower()[:rnd.randint(3, 6)])
+            else:
+                consultas.append(f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)[:rnd.randint(2, 5)]}')
+
+        tiempos_icontains = []
+        tiempos_prefijo = []
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            list(buscar_icontains(consulta)[:10])
+            tiempos_icontains.append((time.perf_counter() - inicio) * 1000)
+
+            inicio = time.perf_counter()
+            list(clientes_por_texto(consulta)[:10])
+            tiempos_prefijo.append((time.perf_counter() - inicio) * 1000)
+
+        for nombre, tiempos in (('icontains', tiempos_icontains), ('Prefijo indice', tiempos_prefijo)):
+            self.stdout.write(
+                f'  {nombre:<15} media {statistics.mean(tiempos):8.2f} ms   '
+                f'p95 {percentil(tiempos, 0.95):8.2f} ms   max {max(tiempos):8.2f} ms'
+            )
@@ -0,0 +1,80 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, OperationalError
+from App.models import SecuenciaFactura
+
+ESTABLECIMIENTO_PRUEBA = '999'
+
+
+def asignar_numeros(args):
+    punto_emision, cantidad = args
+    # Cada proceso abre su propia conexion; la heredada del padre no se reutiliza
+    connections.close_all()
+    numeros = []
+    reintentos = 0
+    inicio = time.perf_counter()
+
+    while len(numeros) < cantidad:
+        try:
+            with transaction.atomic():
+                numeros.append(SecuenciaFactura.siguiente_numero(ESTABLECIMIENTO_PRUEBA, punto_emision))
+        except OperationalError:
+            # SQLite devuelve "database is locked" cuando se agota la espera
+            reintentos += 1
+
+    connections.close_all()
+    return numeros, reintentos, time.perf_counter() - inicio
+
+
+class Command(BaseCommand):
+    help = 'Mide la asignacion concurrente de numeros de factura y verifica que no haya huecos ni duplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=8)
+        parser.add_argument('--numeros', type=int, default=200, help='Numeros a asignar por proceso')
+        parser.add_argument('--series', type=int, default=1,
+                            help='Cantidad de puntos de emision compartidos por los procesos')
+
+    def handle(self, *args, **options):
+        procesos = options['procesos']
+        cantidad = options['numeros']
+        series = [str(900 + i).zfill(3) for i in range(max(1, min(options['series'], 99)))]
+
+        SecuenciaFactura.objects.filter(establecimiento=ESTABLECIMIENTO_PRUEBA).delete()
+        connections.close_all()
+
+        tareas = [(series[i % len(series)], cantidad) for i in range(procesos)]
+        inicio = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(procesos) as pool:
+            resultados = pool.map(asignar_numeros, tareas)
+        duracion = time.perf_counter() - inicio
+
+        todos = [numero for numeros, _, _ in resultados for numero in numeros]
+        reintentos = sum(r for _, r, _ in resultados)
+
+        por_serie = {}
+        for numero in todos:
+            establecimiento, punto_emision, secuencial = numero.split('-')
+            por_serie.setdefault(punto_emision, []).append(int(secuencial))
+
+        errores = []
+        if len(set(todos)) != len(todos):
+            errores.append(f'{len(todos) - len(set(todos))} numeros duplicados')
+        for punto_emision, secuenciales in sorted(por_serie.items()):
+            esperados = set(range(1, len(secuenciales) + 1))
+            faltantes = esperados - set(secuenciales)
+            if faltantes:
+                errores.append(f'Serie {punto_emision}: {len(faltantes)} huecos (primero {min(faltantes)})')
+
+        SecuenciaFactura.objects.filter(establecimiento=ESTABLECIMIENTO_PRUEBA).delete()
+
+        self.stdout.write(f'Procesos: {procesos}  Series: {len(series)}  Numeros: {len(todos)}')
+        self.stdout.write(f'Tiempo total: {duracion:.2f}s  ({len(todos) / duracion:.0f} numeros/s)')
+        self.stdout.write(f'Reintentos por bloqueo: {reintentos}')
+        for _, _, tiempo in resultados:
+            self.stdout.write(f'  proceso: {cantidad / tiempo:.0f} numeros/s')
+
+        if errores:
+            raise CommandError('; '.join(errores))
+        self.stdout.write(self.style.SUCCESS('[OK] Sin huecos ni duplicados'))
@@ -0,0 +1,264 @@
+import json
+import multiprocessing
+import random
+import statistics
+import subprocess
+import time
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client as ClienteHttp
+from django.urls import reverse
+from django.utils import timezone
+from App.models import Cliente, Empleado, Producto, CATEGORIAS_PRIMERA_NECESIDAD
+from App.sembrado import sembrar
+
+# Cada caja simulada es un proceso con su usuario, su empleado y su punto de
+# emision (950, 951, ...), como una caja real. Las facturas se guardan de
+# verdad: usar con una base de prueba.
+#
+# Con SQLite como base de prueba conviene OPTIONS = {'transaction_mode':
+# 'IMMEDIATE', 'timeout': 20}: con transacciones diferidas dos cajas que pasan
+# de leer a escribir a la vez fallan en el acto con "database is locked" (se
+# cuentan como ventas rechazadas) en vez de esperar su turno como en MySQL.
+PREFIJO_USUARIO = 'bench_cajero_'
+PUNTO_EMISION_INICIAL = 950
+
+ENDPOINTS = ('buscar_producto', 'buscar_codigo', 'buscar_cliente', 'procesar_factura')
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+class Contador:
+    # execute_wrapper: cuenta las consultas de la conexion de este proceso
+    def __init__(self):
+        self.consultas = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.consultas += 1
+        return execute(sql, params, many, context)
+
+
+def cajero(args):
+    usuario_id, ventas, calentamiento, lineas, catalogo, cedulas, semilla = args
+    connections.close_all()
+    rnd = random.Random(semilla)
+    http = ClienteHttp(SERVER_NAME='localhost')
+    http.force_login(User.objects.get(pk=usuario_id))
+    contador = Contador()
+    mediciones = {endpoint: [] for endpoint in ENDPOINTS}
+    errores = {endpoint: 0 for endpoint in ENDPOINTS}
+    rechazadas = {}
+
+    def pedir(endpoint, medir, **kwargs):
+        antes = contador.consultas
+        inicio = time.perf_counter()
+        if endpoint == 'procesar_factura':
+            respuesta = http.post(reverse(endpoint), json.dumps(kwargs), content_type='application/json')
+        else:
+            respuesta = http.get(reverse(endpoint), kwargs)
+        tiempo = (time.perf_counter() - inicio) * 1000
+        datos = respuesta.json() if respuesta.status_code == 200 else None
+        if medir:
+            mediciones[endpoint].append((tiempo, contador.consultas - antes))
+            if datos is None:
+                errores[endpoint] += 1
+        return datos
+
+    inicio = None
+    with connection.execute_wrapper(contador):
+        for venta in range(calentamiento + ventas):
+            medir = venta >= calentamiento
+            if medir and inicio is None:
+                inicio = time.perf_counter()
+
+            pedir('buscar_producto', medir, q=rnd.choice(CATEGORIAS_PRIMERA_NECESIDAD)[:rnd.randint(2, 4)])
+            items = []
+            for codigo, producto_id in rnd.sample(catalogo, lineas):
+                pedir('buscar_codigo', medir, codigo=codigo)
+                items.append({'producto_id': producto_id, 'cantidad': rnd.randint(1, 3)})
+            cliente = pedir('buscar_cliente', medir, cedula=rnd.choice(cedulas))
+            cliente_id = cliente['cliente']['id'] if cliente and cliente.get('encontrado') else None
+            resultado = pedir('procesar_factura', medir, cliente_id=cliente_id, items=items)
+            if medir and resultado is not None and not resultado.get('success'):
+                # Stock agotado, bloqueo de SQLite, etc.: la vista responde 200 con el error
+                motivo = resultado.get('error', '')[:60]
+                rechazadas[motivo] = rechazadas.get(motivo, 0) + 1
+
+    duracion = time.perf_counter() - inicio if inicio else 0
+    connections.close_all()
+    return mediciones, errores, rechazadas, duracion
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Simula cajas concurrentes que buscan productos y clientes y procesan facturas; '
+            'reporta ventas/s, latencias p50/p95/p99 y consultas por solicitud. Crea facturas reales.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cajeros', type=int, default=4)
+        parser.add_argument('--ventas', type=int, default=50, help='Ventas medidas por cajero')
+        parser.add_argument('--calentamiento', type=int, default=3, help='Ventas sin medir por cajero')
+        parser.add_argument('--lineas', type=int, default=5, help='Productos por venta')
+        parser.add_argument('--sembrar', action='store_true',
+                            help='Inserta un catalogo y clientes sinteticos si la base no los tiene')
+        parser.add_argument('--productos', type=int, default=5000)
+        parser.add_argument('--clientes', type=int, default=20000)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--salida', help='Guarda el resultado en un archivo JSON')
+        parser.add_argument('--comparar', help='Resultado JSON anterior contra el cual comparar')
+        parser.add_argument('--tolerancia', type=float,
+                            help='Con --comparar: falla si ventas/s o algun p95 empeora mas de este porcentaje')
+
+    def handle(self, *args, **options):
+        if options['sembrar'] and not Producto.objects.filter(codigo__startswith='SIN').exists():
+            inicio = time.perf_counter()
+            sembrar(options['productos'], options['clientes'], semilla=options['semilla'])
+            self.stdout.write(f'Datos sinteticos insertados en {time.perf_counter() - inicio:.1f}s')
+
+        lineas = options['lineas']
+        ventas_totales = options['cajeros'] * (options['ventas'] + options['calentamiento'])
+        # Productos con stock para todas las ventas aun si todas los eligen
+        catalogo = list(Producto.objects.filter(activo=True, stock__gte=3 * ventas_totales)
+                        .values_list('codigo', 'id')[:2000])
+        if len(catalogo) < lineas:
+            catalogo = list(Producto.objects.filter(activo=True, stock__gte=50).values_list('codigo', 'id')[:2000])
+        cedulas = list(Cliente.objects.values_list('cedula', flat=True)[:5000])
+        if len(catalogo) < lineas or not cedulas:
+            raise CommandError('Faltan productos con stock o clientes; use --sembrar.')
+
+        usuarios = self.preparar_cajeros(options['cajeros'])
+        connections.close_all()
+
+        tareas = [
+            (usuario_id, options['ventas'], options['calentamiento'], lineas, catalogo, cedulas,
+             options['semilla'] + i)
+            for i, usuario_id in enumerate(usuarios)
+        ]
+        inicio = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(len(tareas)) as pool:
+            resultados = pool.map(cajero, tareas)
+        duracion = time.perf_counter() - inicio
+
+        resultado = self.resumir(resultados, duracion, options)
+        self.mostrar(resultado)
+
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2)
+            self.stdout.write(f'Resultado guardado en {options["salida"]}')
+        if options['comparar']:
+            self.comparar(resultado, options['comparar'], options['tolerancia'])
+
+    def preparar_cajeros(self, cantidad):
+        grupo, _ = Group.objects.get_or_create(name='Cajero')
+        usuarios = []
+        for i in range(cantidad):
+            usuario, creado = User.objects.get_or_create(username=f'{PREFIJO_USUARIO}{i}')
+            if creado:
+                usuario.set_unusable_password()
+                usuario.save()
+                usuario.groups.add(grupo)
+                Empleado.objects.create(
+                    cedula=f'79{i:08d}', nombre='Cajero', apellido=f'Benchmark {i}', celular='0990000000',
+                    correo=f'{usuario.username}@benchmark.local', cargo='cajero', usuario=usuario,
+                    punto_emision=str(PUNTO_EMISION_INICIAL + i)[-3:],
+                )
+            usuarios.append(usuario.pk)
+        return usuarios
+
+    def resumir(self, resultados, duracion, options):
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            mediciones = [m for r in resultados for m in r[0][endpoint]]
+            tiempos = [tiempo for tiempo, _ in mediciones]
+            consultas = [cantidad for _, cantidad in mediciones]
+            endpoints[endpoint] = {
+                'solicitudes': len(mediciones),
+                'errores': sum(r[1][endpoint] for r in resultados),
+                'p50_ms': round(percentil(tiempos, 0.50), 2) if tiempos else None,
+                'p95_ms': round(percentil(tiempos, 0.95), 2) if tiempos else None,
+                'p99_ms': round(percentil(tiempos, 0.99), 2) if tiempos else None,
+                'media_ms': round(statistics.mean(tiempos), 2) if tiempos else None,
+                'consultas_media': round(statistics.mean(consultas), 2) if consultas else None,
+                'consultas_max': max(consultas) if consultas else None,
+            }
+
+        ventas = endpoints['procesar_factura']['solicitudes']
+        motivos = {}
+        for r in resultados:
+            for motivo, cantidad in r[2].items():
+                motivos[motivo] = motivos.get(motivo, 0) + cantidad
+        rechazadas = sum(motivos.values())
+        # Desde que termina el calentamiento del cajero mas lento
+        medido = max(r[3] for r in resultados) or duracion
+        return {
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'commit': commit_actual(),
+            'motor': connection.vendor,
+            'parametros': {clave: options[clave] for clave in ('cajeros', 'ventas', 'calentamiento', 'lineas')},
+            'duracion_s': round(medido, 3),
+            'ventas': ventas,
+            'ventas_rechazadas': rechazadas,
+            'motivos_rechazo': motivos,
+            'ventas_por_segundo': round((ventas - rechazadas) / medido, 2) if medido else None,
+            'solicitudes_por_segundo': round(sum(e['solicitudes'] for e in endpoints.values()) / medido, 2)
+            if medido else None,
+            'endpoints': endpoints,
+        }
+
+    def mostrar(self, resultado):
+        parametros = resultado['parametros']
+        self.stdout.write(
+            f'Motor: {resultado["motor"]}  Cajeros: {parametros["cajeros"]}  Ventas: {resultado["ventas"]}  '
+            f'Lineas por venta: {parametros["lineas"]}  Commit: {resultado["commit"] or "-"}'
+        )
+        self.stdout.write(
+            f'Tiempo: {resultado["duracion_s"]:.2f}s  Ventas/s: {resultado["ventas_por_segundo"]}  '
+            f'Solicitudes/s: {resultado["solicitudes_por_segundo"]}  Rechazadas: {resultado["ventas_rechazadas"]}'
+        )
+        for motivo, cantidad in resultado['motivos_rechazo'].items():
+            self.stdout.write(f'  rechazo x{cantidad}: {motivo}')
+        self.stdout.write(f'  {"endpoint":<18} {"n":>6} {"err":>4} {"p50":>8} {"p95":>8} {"p99":>8} {"consultas":>10}')
+        for endpoint, e in resultado['endpoints'].items():
+            if not e['solicitudes']:
+                continue
+            self.stdout.write(
+                f'  {endpoint:<18} {e["solicitudes"]:>6} {e["errores"]:>4} {e["p50_ms"]:>6.2f}ms '
+                f'{e["p95_ms"]:>6.2f}ms {e["p99_ms"]:>6.2f}ms {e["consultas_media"]:>10.1f}'
+            )
+
+    def comparar(self, resultado, ruta, tolerancia):
+        with open(ruta) as archivo:
+            anterior = json.load(archivo)
+        self.stdout.write(f'\nComparado con {anterior.get("commit") or ruta} ({anterior.get("fecha")}):')
+
+        regresiones = []
+
+        def cambio(nombre, antes, ahora, mayor_es_mejor):
+            if not antes or ahora is None:
+                return
+            porcentaje = (ahora - antes) / antes * 100
+            empeora = -porcentaje if mayor_es_mejor else porcentaje
+            self.stdout.write(f'  {nombre:<32} {antes:>9.2f} -> {ahora:>9.2f}  ({porcentaje:+.1f}%)')
+            if tolerancia is not None and empeora > tolerancia:
+                regresiones.append(f'{nombre} {porcentaje:+.1f}%')
+
+        cambio('ventas/s', anterior.get('ventas_por_segundo'), resultado['ventas_por_segundo'], True)
+        for endpoint, e in resultado['endpoints'].items():
+            previo = anterior.get('endpoints', {}).get(endpoint, {})
+            cambio(f'{endpoint} p95 ms', previo.get('p95_ms'), e['p95_ms'], False)
+            cambio(f'{endpoint} consultas', previo.get('consultas_media'), e['consultas_media'], False)
+
+        if regresiones:
+            raise CommandError(f'Regresiones mayores a {tolerancia}%: {", ".join(regresiones)}')
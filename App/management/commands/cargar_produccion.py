@@ -1,23 +1,75 @@
-import random
-import string
-from django.core.management.base import BaseCommand
+import sys
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User, Group
+from App.cache import cache_compartida
 from App.models import Empleado, Cliente, Producto
-from decimal import Decimal
+from App.importacion import IMPORTACIONES, FORMATOS, LOTE, ErrorImportacion, importar_archivo
 
-
-def generar_codigo_unico(prefijo, longitud=6):
-    caracteres = string.ascii_uppercase + string.digits
-    while True:
-        codigo = prefijo + ''.join(random.choices(caracteres, k=longitud))
-        if not Producto.objects.filter(codigo=codigo).exists():
-            return codigo
+# Cada cuantas filas se informa el avance de un archivo
+AVANCE = 100000
 
 
 class Command(BaseCommand):
-    help = 'Carga datos de produccion para el sistema Unimark'
+    help = ('Carga datos de produccion para el sistema Unimark. Con --productos, --clientes o --empleados '
+            'importa esos archivos CSV o JSONL por lotes en lugar de los datos de ejemplo')
+
+    def add_arguments(self, parser):
+        for tipo in IMPORTACIONES:
+            parser.add_argument(f'--{tipo}', metavar='ARCHIVO', help=f'CSV o JSONL (puede ir en .gz) de {tipo}')
+        parser.add_argument('--formato', choices=FORMATOS, help='Por defecto segun la extension del archivo')
+        parser.add_argument('--lote', type=int, default=LOTE, help='Filas por lote')
+        parser.add_argument('--solo-nuevos', action='store_true',
+                            help='No actualiza las filas cuyo codigo o cedula ya existe')
+
+    def informar(self, tipo, resultado):
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {tipo.title()}: {resultado.leidas} filas, {resultado.creadas} creadas, '
+            f'{resultado.actualizadas} actualizadas, {resultado.omitidas} omitidas, '
+            f'{resultado.con_error} con error en {resultado.segundos:.1f}s '
+            f'({resultado.filas_por_segundo:.0f} filas/s)'
+        ))
+        for error in resultado.errores:
+            self.stdout.write(self.style.WARNING(f'  {error}'))
+        if resultado.con_error > len(resultado.errores):
+            self.stdout.write(self.style.WARNING(f'  ... y {resultado.con_error - len(resultado.errores)} mas'))
+
+    def importar_archivos(self, options):
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor a cero.')
+        if not cache_compartida():
+            self.stdout.write(self.style.WARNING(
+                'La cache por defecto es local a este proceso: reinicie los workers despues de importar '
+                'o seguiran con precios, clientes y roles anteriores.'
+            ))
+        # Empleados y clientes primero: no dependen de nada
+        for tipo in ('empleados', 'clientes', 'productos'):
+            ruta = options[tipo]
+            if not ruta:
+                continue
+            avance = {'filas': 0}
+
+            def progreso(resultado):
+                if resultado.leidas - avance['filas'] >= AVANCE:
+                    avance['filas'] = resultado.leidas
+                    sys.stderr.write(f'  {tipo}: {resultado.leidas} filas ({resultado.filas_por_segundo:.0f} filas/s)\n')
+
+            try:
+                resultado = importar_archivo(tipo, ruta, options['formato'], options['lote'],
+                                             not options['solo_nuevos'], progreso)
+            except (OSError, ErrorImportacion) as e:
+                raise CommandError(str(e))
+            self.informar(tipo, resultado)
+
+    def importar_ejemplos(self, tipo, filas):
+        # Los datos de ejemplo pasan por la misma importacion; lo que ya existe no se toca
+        resultado = IMPORTACIONES[tipo](actualizar=False).importar(enumerate(filas, 1))
+        self.informar(tipo, resultado)
 
     def handle(self, *args, **options):
+        if any(options[tipo] for tipo in IMPORTACIONES):
+            self.importar_archivos(options)
+            return
+
         self.stdout.write('=' * 60)
         self.stdout.write('CARGANDO DATOS DE PRODUCCION PARA UNIMARK')
         self.stdout.write('=' * 60)
@@ -74,13 +126,15 @@ class Command(BaseCommand):
             {'cedula': '1705678901', 'nombre': 'Fernando', 'apellido': 'Castillo Bravo', 'celular': '0954567890', 'correo': 'fernando.castillo@unimark.com', 'cargo': 'oficina'},
         ]
 
-        for i, emp_data in enumerate(empleados_data):
-            if not Empleado.objects.filter(cedula=emp_data['cedula']).exists():
-                empleado = Empleado.objects.create(**emp_data)
-                if emp_data['cargo'] == 'cajero' and i - 2 < len(usuarios_cajero):
-                    empleado.usuario = usuarios_cajero[i - 2]
-                    empleado.save()
-                self.stdout.write(self.style.SUCCESS(f'[OK] Empleado {emp_data["nombre"]} {emp_data["apellido"]} - {emp_data["cargo"]}'))
+        self.importar_ejemplos('empleados', empleados_data)
+
+        # Cada usuario cajero con la ficha de un empleado cajero que no tenga usuario
+        cedulas_cajeros = [emp_data['cedula'] for emp_data in empleados_data if emp_data['cargo'] == 'cajero']
+        for cedula, usuario in zip(cedulas_cajeros, usuarios_cajero):
+            empleado = Empleado.objects.get(cedula=cedula)
+            if empleado.usuario_id is None and not Empleado.objects.filter(usuario=usuario).exists():
+                empleado.usuario = usuario
+                empleado.save()
 
         self.stdout.write('\n--- CREANDO CLIENTES ---')
 
@@ -105,10 +159,7 @@ class Command(BaseCommand):
             {'cedula': '1700000006', 'nombre': 'Mateo', 'apellido': 'Vargas Coronel', 'celular': '0954321097', 'correo': 'mateo.vargas@email.com'},
         ]
 
-        for cli_data in clientes_data:
-            if not Cliente.objects.filter(cedula=cli_data['cedula']).exists():
-                Cliente.objects.create(**cli_data)
-                self.stdout.write(self.style.SUCCESS(f'[OK] Cliente {cli_data["nombre"]} {cli_data["apellido"]}'))
+        self.importar_ejemplos('clientes', clientes_data)
 
         self.stdout.write('\n--- CREANDO PRODUCTOS ---')
 
@@ -249,33 +300,12 @@ class Command(BaseCommand):
             {'nombre': 'Cerveza Club Verde 330ml', 'descripcion': 'Cerveza premium', 'marca': 'Club', 'precio': '1.50', 'stock': 150},
         ]
 
-        for prod_data in productos_primera_necesidad:
-            if not Producto.objects.filter(nombre=prod_data['nombre']).exists():
-                codigo = generar_codigo_unico('PN')
-                Producto.objects.create(
-                    codigo=codigo,
-                    nombre=prod_data['nombre'],
-                    descripcion=prod_data['descripcion'],
-                    marca=prod_data['marca'],
-                    precio_unitario=Decimal(prod_data['precio']),
-                    stock=prod_data['stock'],
-                    es_primera_necesidad=True
-                )
-                self.stdout.write(self.style.SUCCESS(f'[OK] {prod_data["nombre"]} (IVA 0%) - Codigo: {codigo}'))
-
-        for prod_data in productos_con_iva:
-            if not Producto.objects.filter(nombre=prod_data['nombre']).exists():
-                codigo = generar_codigo_unico('PR')
-                Producto.objects.create(
-                    codigo=codigo,
-                    nombre=prod_data['nombre'],
-                    descripcion=prod_data['descripcion'],
-                    marca=prod_data['marca'],
-                    precio_unitario=Decimal(prod_data['precio']),
-                    stock=prod_data['stock'],
-                    es_primera_necesidad=False
-                )
-                self.stdout.write(self.style.SUCCESS(f'[OK] {prod_data["nombre"]} (IVA 15%) - Codigo: {codigo}'))
+        # Sin codigo: se genera uno y se omite el producto si ya hay uno con ese nombre
+        self.importar_ejemplos('productos', [
+            {**prod_data, 'precio_unitario': prod_data['precio'], 'es_primera_necesidad': es_primera_necesidad}
+            for productos, es_primera_necesidad in ((productos_primera_necesidad, True), (productos_con_iva, False))
+            for prod_data in productos
+        ])
 
         self.stdout.write('\n' + '=' * 60)
         self.stdout.write('RESUMEN DE DATOS CREADOS')
@@ -0,0 +1,67 @@
+from datetime import datetime, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from App.models import Producto, MovimientoStock
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye Producto.stock desde el diario de movimientos y, opcionalmente, compacta el historial antiguo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasta', help='Fecha (AAAA-MM-DD): los movimientos anteriores se agrupan en un saldo por producto')
+        parser.add_argument('--solo-verificar', action='store_true', help='Reporta diferencias sin corregirlas')
+
+    def handle(self, *args, **options):
+        hasta = None
+        if options['hasta']:
+            try:
+                fecha = datetime.strptime(options['hasta'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Formato de fecha invalido, use AAAA-MM-DD.')
+            hasta = timezone.make_aware(datetime.combine(fecha, time.min))
+
+        with transaction.atomic():
+            if hasta and not options['solo_verificar']:
+                self.compactar(hasta)
+            corregidos = self.reconstruir(options['solo_verificar'])
+
+        if options['solo_verificar']:
+            if corregidos:
+                raise CommandError(f'{corregidos} productos con stock distinto al del diario.')
+            self.stdout.write(self.style.SUCCESS('[OK] Stock coincide con el diario'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'[OK] {corregidos} productos corregidos'))
+
+    def compactar(self, hasta):
+        antiguos = MovimientoStock.objects.filter(fecha__lt=hasta)
+        saldos = antiguos.values('producto').annotate(total=Sum('cantidad')).order_by()
+        nuevos = [
+            MovimientoStock(producto_id=s['producto'], tipo='saldo', cantidad=s['total'], referencia=f'Saldo al {hasta:%Y-%m-%d}')
+            for s in saldos
+        ]
+        eliminados, _ = antiguos.delete()
+        MovimientoStock.objects.bulk_create(nuevos, batch_size=1000)
+        # auto_now_add no se puede fijar en el insert; el saldo queda fechado justo antes del corte
+        MovimientoStock.objects.filter(tipo='saldo', fecha__gte=hasta, referencia=f'Saldo al {hasta:%Y-%m-%d}').update(
+            fecha=hasta - timedelta(microseconds=1)
+        )
+        self.stdout.write(f'{eliminados} movimientos compactados en {len(nuevos)} saldos')
+
+    def reconstruir(self, solo_verificar):
+        saldos = dict(
+            MovimientoStock.objects.values('producto').annotate(total=Sum('cantidad')).order_by()
+            .values_list('producto', 'total')
+        )
+        corregidos = 0
+        productos = Producto.objects.select_for_update().values_list('id', 'codigo', 'stock').order_by('pk')
+        for producto_id, codigo, stock in productos.iterator(chunk_size=2000):
+            saldo = saldos.get(producto_id, 0)
+            if saldo == stock:
+                continue
+            corregidos += 1
+            self.stdout.write(self.style.WARNING(f'{codigo}: stock {stock}, diario {saldo}'))
+            if not solo_verificar:
+                Producto.objects.filter(pk=producto_id).update(stock=saldo)
+        return corregidos
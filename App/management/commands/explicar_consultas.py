@@ -0,0 +1,230 @@
+import json
+import re
+import statistics
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+from App.listados import filtrar_productos, clientes_por_texto
+from App.models import (Cliente, Producto, Factura, DetalleFactura, MovimientoStock, ResumenVentasDiario,
+                        ClienteDiario)
+from App.sembrado import sembrar
+
+
+class Rollback(Exception):
+    pass
+
+
+# Recorridos que una consulta puede tolerar: ninguno, un indice completo en
+# orden (primeras paginas con LIMIT, que se detienen al llenar la pagina) o la
+# tabla completa.
+NINGUNO = None
+INDICE = 'indice'
+TABLA = 'tabla'
+
+
+def consultas_calientes(m):
+    # (nombre, queryset, recorrido permitido). m trae valores reales de la base
+    # para que los filtros sean selectivos como en produccion.
+    hoy = timezone.localdate()
+    # En SQLite LIKE solo usa indices sobre columnas COLLATE NOCASE; istartswith
+    # recorre el indice cubriente. En MySQL (collation _ci) es un rango.
+    prefijo = INDICE if connection.vendor == 'sqlite' else NINGUNO
+    inicio_mes = timezone.make_aware(datetime.combine(hoy.replace(day=1), datetime.min.time()))
+    return [
+        # dashboard
+        # Ordenada por nombre (Meta.ordering): recorre producto_nombre hasta juntar 10
+        ('dashboard: productos bajo stock', Producto.objects.filter(stock__lte=5, activo=True)[:10], INDICE),
+        ('dashboard: ultimas facturas', Factura.objects.select_related('cliente').order_by('-fecha')[:5], INDICE),
+        ('dashboard: resumen de hoy', ResumenVentasDiario.objects.filter(fecha=hoy), NINGUNO),
+        # count() de casi toda la tabla; se cachea en totales_dashboard
+        ('dashboard: productos activos', Producto.objects.filter(activo=True).order_by().values('pk'), INDICE),
+        # caja
+        ('buscar_codigo', Producto.objects.filter(codigo=m['codigo'], activo=True), NINGUNO),
+        ('buscar_cliente', Cliente.objects.filter(cedula=m['cedula']), NINGUNO),
+        ('buscar_clientes por nombre', clientes_por_texto(m['nombre'][:4])[:10], prefijo),
+        ('buscar_clientes por cedula', clientes_por_texto(m['cedula'][:6])[:10], prefijo),
+        ('procesar: bloqueo de productos', Producto.objects.filter(pk__in=m['productos']).order_by('pk'), NINGUNO),
+        ('procesar: visita del cliente',
+         ClienteDiario.objects.filter(fecha=hoy, cliente_id=m['cliente_id']), NINGUNO),
+        ('procesar: resumen del empleado',
+         ResumenVentasDiario.objects.filter(fecha=hoy, empleado_id=m['empleado_id']), NINGUNO),
+        # historial
+        ('historial: primera pagina',
+         Factura.objects.select_related('cliente', 'empleado').order_by('-fecha', '-id')[:26], INDICE),
+        ('historial: pagina siguiente',
+         Factura.objects.filter(Q(fecha__lt=m['fecha']) | Q(fecha=m['fecha'], pk__lt=m['factura_id']),
+                                fecha__lte=m['fecha']).order_by('-fecha', '-id')[:26], NINGUNO),
+        ('historial: por empleado',
+         Factura.objects.filter(empleado_id=m['empleado_id']).order_by('-fecha', '-id')[:26], NINGUNO),
+        ('historial: por cedula',
+         Factura.objects.filter(cliente__cedula=m['cedula']).order_by('-fecha', '-id')[:26], NINGUNO),
+        ('historial: por rango de fechas',
+         Factura.objects.filter(fecha__gte=inicio_mes).order_by('-fecha', '-id')[:26], NINGUNO),
+        ('historial: por numero', Factura.objects.filter(numero=m['numero']), NINGUNO),
+        ('detalle de factura',
+         DetalleFactura.objects.filter(factura_id=m['factura_id']).select_related('producto'), NINGUNO),
+        # gestion
+        ('productos: primera pagina', filtrar_productos({})[0][:24], INDICE),
+        # Busqueda del admin (nombre__icontains): una subcadena no puede usar un
+        # indice; recorre producto_nombre en orden y se detiene al llenar la pagina
+        ('productos: busqueda', filtrar_productos({'q': m['texto_producto']})[0][:24], INDICE),
+        ('productos: IVA 0%', filtrar_productos({'iva': '0'})[0][:24], NINGUNO),
+        ('productos: IVA 15%', filtrar_productos({'iva': '15'})[0][:24], NINGUNO),
+        ('productos: por marca', filtrar_productos({'marca': m['marca']})[0][:24], NINGUNO),
+        ('productos: agotados', filtrar_productos({'stock': 'agotado'})[0][:24], NINGUNO),
+        ('productos: stock bajo', filtrar_productos({'stock': 'bajo'})[0][:24], NINGUNO),
+        ('productos: marcas', Producto.objects.order_by('marca').values_list('marca', flat=True).distinct(), INDICE),
+        ('clientes: primera pagina', Cliente.objects.order_by('busqueda', 'id')[:50], INDICE),
+        ('exportacion: lote del mes',
+         Factura.objects.filter(fecha__gte=inicio_mes).order_by('fecha', 'id')[:2000], NINGUNO),
+        ('stock en fecha',
+         MovimientoStock.objects.filter(producto_id=m['productos'][0], fecha__lte=timezone.now()), NINGUNO),
+        # Busqueda por subcadena: el indice en memoria es el camino normal, el ORM
+        # solo se usa con BUSQUEDA_EN_MEMORIA = False y no puede usar indices.
+        ('buscar_producto (ORM)', Producto.objects.filter(
+            Q(nombre__icontains='arro') | Q(codigo__icontains='arro'), activo=True, stock__gt=0)[:10], TABLA),
+    ]
+
+
+def tablas_mysql(nodo):
+    if isinstance(nodo, dict):
+        if 'table_name' in nodo and 'access_type' in nodo:
+            yield nodo
+        for valor in nodo.values():
+            yield from tablas_mysql(valor)
+    elif isinstance(nodo, list):
+        for valor in nodo:
+            yield from tablas_mysql(valor)
+
+
+def recorridos(plan):
+    # [(tabla, TABLA | INDICE)] por cada tabla leida completa segun el plan
+    if connection.vendor == 'sqlite':
+        # 'SCAN t' lee la tabla; 'SCAN t USING [COVERING] INDEX i' recorre el indice entero
+        return [(tabla, INDICE if indice else TABLA)
+                for tabla, indice in re.findall(r'SCAN (\w+)( USING (?:COVERING )?INDEX \w+)?', plan)]
+    if connection.vendor == 'mysql':
+        tipos = {'ALL': TABLA, 'index': INDICE}
+        return [(tabla['table_name'], tipos[tabla['access_type']])
+                for tabla in tablas_mysql(json.loads(plan)) if tabla['access_type'] in tipos]
+    if connection.vendor == 'postgresql':
+        return [(tabla, TABLA) for tabla in re.findall(r'Seq Scan on (\w+)', plan)]
+    return []
+
+
+def fuera_de_lo_permitido(leidos, permitido):
+    if permitido == TABLA:
+        return []
+    return [(tabla, tipo) for tabla, tipo in leidos if not (tipo == INDICE and permitido == INDICE)]
+
+
+def explicar(queryset):
+    if connection.vendor == 'mysql':
+        return queryset.explain(format='json')
+    return queryset.explain()
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta EXPLAIN sobre las consultas frecuentes, mide su tiempo y falla si alguna lee una tabla completa'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sembrar', action='store_true',
+                            help='Inserta datos sinteticos dentro de una transaccion que se revierte al final')
+        parser.add_argument('--productos', type=int, default=20000)
+        parser.add_argument('--clientes', type=int, default=50000)
+        parser.add_argument('--facturas', type=int, default=100000)
+        parser.add_argument('--empleados', type=int, default=20)
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--salida', help='Guarda los tiempos y planes en un archivo JSON')
+        parser.add_argument('--planes', action='store_true', help='Muestra el plan completo de cada consulta')
+
+    def handle(self, *args, **options):
+        resultado = None
+        try:
+            with transaction.atomic():
+                if options['sembrar']:
+                    inicio = time.perf_counter()
+                    sembrar(options['productos'], options['clientes'], options['facturas'],
+                            empleados=options['empleados'])
+                    self.stdout.write(f'Datos sinteticos insertados en {time.perf_counter() - inicio:.1f}s')
+                    if connection.vendor in ('sqlite', 'postgresql'):
+                        connection.cursor().execute('ANALYZE')
+                resultado = self.revisar(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Resultados guardados en {options["salida"]}')
+
+        fallidas = [c['nombre'] for c in resultado['consultas'] if c['escaneos']]
+        if fallidas:
+            raise CommandError(f'{len(fallidas)} consultas hacen escaneos completos: {", ".join(fallidas)}')
+        self.stdout.write(self.style.SUCCESS('[OK] Ninguna consulta frecuente lee mas de lo permitido'))
+
+    def muestra(self):
+        factura = Factura.objects.order_by('-fecha', '-id')[100:101].first() or Factura.objects.first()
+        # values() y no el modelo: asi tambien corre sobre migraciones anteriores
+        cliente = Cliente.objects.exclude(es_consumidor_final=True).order_by('id').values(
+            'id', 'cedula', 'nombre', 'apellido').first()
+        producto = Producto.objects.filter(activo=True).order_by('id').first()
+        if not (factura and cliente and producto):
+            raise CommandError('Se necesitan productos, clientes y facturas; use --sembrar.')
+        return {
+            'codigo': producto.codigo,
+            # Subcadena del medio de una palabra, como la escribe quien busca
+            'texto_producto': producto.nombre.split()[0][1:5],
+            'marca': producto.marca,
+            'productos': list(Producto.objects.order_by('id').values_list('id', flat=True)[:10]),
+            'cedula': cliente['cedula'],
+            'nombre': Cliente.texto_busqueda(cliente['nombre'], cliente['apellido']),
+            'cliente_id': cliente['id'],
+            'empleado_id': factura.empleado_id,
+            'factura_id': factura.id,
+            'fecha': factura.fecha,
+            'numero': factura.numero,
+        }
+
+    def revisar(self, options):
+        consultas = []
+        for nombre, queryset, permitido in consultas_calientes(self.muestra()):
+            try:
+                with transaction.atomic():
+                    plan = explicar(queryset)
+                    tiempos = []
+                    for _ in range(options['repeticiones']):
+                        inicio = time.perf_counter()
+                        list(queryset._chain())
+                        tiempos.append((time.perf_counter() - inicio) * 1000)
+            except DatabaseError as e:
+                # Por ejemplo, al medir con una migracion anterior a la columna que usa
+                self.stdout.write(self.style.WARNING(f'  {nombre:<40} error: {e}'))
+                continue
+
+            leidos = recorridos(plan)
+            escaneos = fuera_de_lo_permitido(leidos, permitido)
+            mediana = statistics.median(tiempos)
+            if escaneos:
+                estado = self.style.ERROR('escaneo: ' + ', '.join(f'{tabla} ({tipo})' for tabla, tipo in escaneos))
+            elif leidos:
+                estado = 'ok, recorre ' + ', '.join(f'{tabla} ({tipo})' for tabla, tipo in leidos)
+            else:
+                estado = 'ok'
+            self.stdout.write(f'  {nombre:<40} {mediana:8.2f} ms  {estado}')
+            if options['planes']:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+            consultas.append({
+                'nombre': nombre,
+                'mediana_ms': round(mediana, 3),
+                'max_ms': round(max(tiempos), 3),
+                'recorridos': leidos,
+                'recorrido_permitido': permitido,
+                'escaneos': escaneos,
+                'plan': plan,
+            })
+        return {'motor': connection.vendor, 'fecha': timezone.now().isoformat(), 'consultas': consultas}
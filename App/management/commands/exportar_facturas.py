@@ -0,0 +1,43 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from App.exportacion import Exportacion, CONTENIDOS, FORMATOS
+from App.historial import leer_fecha
+
+
+class Command(BaseCommand):
+    help = 'Exporta facturas o sus detalles de un rango de fechas a CSV o JSONL, leyendo por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer dia (AAAA-MM-DD); por defecto el primero del mes')
+        parser.add_argument('--hasta', help='Ultimo dia (AAAA-MM-DD); por defecto hoy')
+        parser.add_argument('--contenido', choices=CONTENIDOS, default='facturas')
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Comprime la salida en gzip')
+        parser.add_argument('--salida', help='Archivo de salida; por defecto el nombre sugerido, "-" para stdout')
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+        desde = leer_fecha(options['desde']) if options['desde'] else hoy.replace(day=1)
+        hasta = leer_fecha(options['hasta']) if options['hasta'] else hoy
+        if desde is None or hasta is None:
+            raise CommandError('Formato de fecha invalido, use AAAA-MM-DD.')
+        if desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta.')
+
+        exportacion = Exportacion(desde, hasta, options['contenido'], options['formato'], options['gzip'])
+        salida = options['salida'] or exportacion.nombre_archivo
+
+        if salida == '-':
+            for bloque in exportacion:
+                sys.stdout.buffer.write(bloque)
+            sys.stdout.buffer.flush()
+        else:
+            with open(salida, 'wb') as archivo:
+                for bloque in exportacion:
+                    archivo.write(bloque)
+
+        self.stderr.write(self.style.SUCCESS(
+            f'[OK] {exportacion.filas} filas en {exportacion.duracion:.2f}s '
+            f'({exportacion.filas_por_segundo or 0:.0f} filas/s) -> {salida}'
+        ))
@@ -0,0 +1,65 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from App.historial import leer_fecha
+from App.models import Factura, ResumenVentasDiario, ClienteDiario
+
+CAMPOS = ('subtotal_sin_iva', 'subtotal_con_iva', 'valor_iva', 'total')
+
+
+class Command(BaseCommand):
+    help = ('Recalcula el resumen de ventas diario y los clientes por dia desde las facturas '
+            '(necesario si se crearon facturas fuera de registrar_factura)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer dia a recalcular (AAAA-MM-DD); por defecto el de la primera factura')
+        parser.add_argument('--hasta', help='Ultimo dia a recalcular (AAAA-MM-DD); por defecto hoy')
+
+    def handle(self, *args, **options):
+        hasta = leer_fecha(options['hasta']) if options['hasta'] else timezone.localdate()
+        desde = leer_fecha(options['desde']) if options['desde'] else None
+        if hasta is None or (options['desde'] and desde is None):
+            raise CommandError('Formato de fecha invalido, use AAAA-MM-DD.')
+        if desde is None:
+            primera = Factura.objects.order_by('fecha').values_list('fecha', flat=True).first()
+            desde = timezone.localdate(primera) if primera else hasta
+        if desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta.')
+
+        inicio = timezone.make_aware(datetime.combine(desde, time.min))
+        fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min))
+
+        resumenes = {}
+        visitas = set()
+        facturas = (
+            Factura.objects.filter(fecha__gte=inicio, fecha__lt=fin)
+            .order_by('fecha', 'id')
+            .values_list('fecha', 'empleado_id', 'cliente_id', *CAMPOS)
+        )
+        for fecha, empleado_id, cliente_id, *importes in facturas.iterator(chunk_size=2000):
+            dia = timezone.localdate(fecha)
+            resumen = resumenes.get((dia, empleado_id))
+            if resumen is None:
+                resumen = resumenes[(dia, empleado_id)] = ResumenVentasDiario(fecha=dia, empleado_id=empleado_id)
+            resumen.facturas += 1
+            # El cliente cuenta para el empleado que lo atendio primero en el dia
+            if (dia, cliente_id) not in visitas:
+                visitas.add((dia, cliente_id))
+                resumen.clientes += 1
+            for campo, importe in zip(CAMPOS, importes):
+                setattr(resumen, campo, getattr(resumen, campo) + (importe or Decimal('0.00')))
+
+        with transaction.atomic():
+            ResumenVentasDiario.objects.filter(fecha__range=(desde, hasta)).delete()
+            ClienteDiario.objects.filter(fecha__range=(desde, hasta)).delete()
+            ResumenVentasDiario.objects.bulk_create(resumenes.values(), batch_size=1000)
+            ClienteDiario.objects.bulk_create(
+                (ClienteDiario(fecha=dia, cliente_id=cliente_id) for dia, cliente_id in visitas),
+                batch_size=1000
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {len(resumenes)} resumenes y {len(visitas)} clientes por dia entre {desde} y {hasta}'
+        ))
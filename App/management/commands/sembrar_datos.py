@@ -0,0 +1,77 @@
+import sys
+import time
+from datetime import datetime, time as hora, timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from App.historial import leer_fecha
+from App.models import Cliente, Producto
+from App.sembrado import ALFA, sembrar
+
+# Cada cuantas lineas se informa el avance
+AVANCE = 1000000
+
+
+class Command(BaseCommand):
+    help = ('Genera datos sinteticos reproducibles para pruebas de rendimiento: productos, clientes y facturas '
+            'con ventas concentradas en pocos productos y clientes (Pareto). No usa senales ni mueve stock.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=0)
+        parser.add_argument('--clientes', type=int, default=0)
+        parser.add_argument('--facturas', type=int, default=0)
+        parser.add_argument('--empleados', type=int, default=0, help='Cajeros sinteticos para repartir las facturas')
+        parser.add_argument('--lineas', type=float, default=3, help='Lineas promedio por factura')
+        parser.add_argument('--alfa', type=float, default=ALFA,
+                            help='Concentracion de las ventas; mayor es mas concentrada (1.0 ~ 80/20)')
+        parser.add_argument('--desde', help='Primer dia de las facturas (AAAA-MM-DD); por defecto --dias antes de hoy')
+        parser.add_argument('--hasta', help='Ultimo dia de las facturas (AAAA-MM-DD); por defecto hoy')
+        parser.add_argument('--dias', type=int, default=365)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--resumen', action='store_true',
+                            help='Recalcula el resumen de ventas diario del rango al terminar')
+
+    def handle(self, *args, **options):
+        if options['lineas'] < 1:
+            raise CommandError('--lineas debe ser al menos 1.')
+        hoy = timezone.localdate()
+        hasta = leer_fecha(options['hasta']) if options['hasta'] else hoy
+        desde = leer_fecha(options['desde']) if options['desde'] else None
+        if hasta is None or (options['desde'] and desde is None):
+            raise CommandError('Formato de fecha invalido, use AAAA-MM-DD.')
+        desde = desde or hasta - timedelta(days=options['dias'])
+        if desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta.')
+        if desde > hoy:
+            raise CommandError('--desde no puede ser una fecha futura.')
+
+        if options['facturas']:
+            faltan = [nombre for nombre, modelo, nuevos in (('productos', Producto, options['productos']),
+                                                            ('clientes', Cliente, options['clientes']))
+                      if not nuevos and not modelo.objects.exists()]
+            if faltan:
+                raise CommandError(f'No hay {" ni ".join(faltan)} para las facturas; use --{faltan[0]}.')
+
+        inicio = time.perf_counter()
+        avance = {'lineas': 0}
+
+        def progreso(facturas, lineas):
+            if lineas - avance['lineas'] >= AVANCE:
+                avance['lineas'] = lineas
+                segundos = time.perf_counter() - inicio
+                sys.stderr.write(f'  {facturas} facturas, {lineas} lineas ({lineas / segundos:.0f} lineas/s)\n')
+
+        fin = min(timezone.make_aware(datetime.combine(hasta + timedelta(days=1), hora.min)), timezone.now())
+        lineas = sembrar(
+            options['productos'], options['clientes'], options['facturas'], semilla=options['semilla'],
+            empleados=options['empleados'], lineas=options['lineas'], alfa=options['alfa'], progreso=progreso,
+            desde=timezone.make_aware(datetime.combine(desde, hora.min)), hasta=fin,
+        )
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {options["productos"]} productos, {options["clientes"]} clientes, {options["facturas"]} facturas '
+            f'y {lineas} lineas en {segundos:.1f}s ({lineas / segundos if segundos else 0:.0f} lineas/s)'
+        ))
+
+        if options['resumen'] and options['facturas']:
+            call_command('reconstruir_resumen_ventas', desde=str(desde), hasta=str(hasta), stdout=self.stdout)
@@ -0,0 +1,288 @@
+import atexit
+import ctypes
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (desarrollo con runserver)
+    fcntl = None
+    import msvcrt
+
+# Metricas por vista (nombre de la URL): histograma de latencia, consultas SQL,
+# tiempo en SQL y bytes de respuesta.
+#
+# Cada proceso del servidor acumula en memoria y vuelca su estado a
+# METRICAS_DIR/<pid>-<inicio>.json como mucho cada METRICAS_INTERVALO segundos.
+# El endpoint suma los archivos de todos los procesos: los contadores de un
+# worker reiniciado o terminado se conservan y el total nunca baja. Los archivos
+# de procesos que ya no existen se juntan en ACUMULADO y se borran, para que el
+# directorio y cada lectura no crezcan con los reinicios de workers.
+
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIN_RUTA = '<sin_ruta>'
+ACUMULADO = 'acumulado.json'
+BLOQUEO = '.bloqueo'
+ARCHIVO_PROCESO = re.compile(r'^(\d+)-(\d+)\.json$')
+# OpenProcess y GetExitCodeProcess (Windows)
+CONSULTA_LIMITADA = 0x1000
+ACCESO_DENEGADO = 5
+SIGUE_ACTIVO = 259
+
+
+def vacia():
+    return {
+        'cubetas': [0] * (len(CUBETAS) + 1),  # la ultima es +Inf
+        'suma': 0.0,
+        'cantidad': 0,
+        'consultas': 0,
+        'sql_segundos': 0.0,
+        'bytes': 0,
+        'estados': {},
+    }
+
+
+class Registro:
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.vistas = {}
+        self.lock = threading.Lock()
+        self.archivo = None
+        self.ultimo_volcado = 0.0
+
+    def registrar(self, vista, duracion, consultas, sql_segundos, tamano, estado):
+        cubeta = next((i for i, limite in enumerate(CUBETAS) if duracion <= limite), len(CUBETAS))
+        with self.lock:
+            datos = self.vistas.get(vista)
+            if datos is None:
+                datos = self.vistas[vista] = vacia()
+            datos['cubetas'][cubeta] += 1
+            datos['suma'] += duracion
+            datos['cantidad'] += 1
+            datos['consultas'] += consultas
+            datos['sql_segundos'] += sql_segundos
+            datos['bytes'] += tamano
+            clase = f'{estado // 100}xx'
+            datos['estados'][clase] = datos['estados'].get(clase, 0) + 1
+        if time.monotonic() - self.ultimo_volcado >= settings.METRICAS_INTERVALO:
+            self.volcar()
+
+    def volcar(self):
+        with self.lock:
+            self.ultimo_volcado = time.monotonic()
+            if not self.vistas:
+                return
+            contenido = json.dumps(self.vistas)
+            if self.archivo is None:
+                self.archivo = f'{os.getpid()}-{time.time_ns()}.json'
+        directorio = settings.METRICAS_DIR
+        os.makedirs(directorio, exist_ok=True)
+        escribir(os.path.join(directorio, self.archivo), contenido)
+
+
+registro = Registro()
+atexit.register(registro.volcar)
+# Un worker creado con fork empieza de cero y con su propio archivo: lo que el
+# padre ya habia contado sigue en el archivo del padre. Windows no tiene fork
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registro.reiniciar)
+
+
+def sumar(total, vistas):
+    for vista, datos in vistas.items():
+        acumulado = total.setdefault(vista, vacia())
+        for i, cantidad in enumerate(datos['cubetas']):
+            acumulado['cubetas'][i] += cantidad
+        for campo in ('suma', 'cantidad', 'consultas', 'sql_segundos', 'bytes'):
+            acumulado[campo] += datos[campo]
+        for clase, cantidad in datos['estados'].items():
+            acumulado['estados'][clase] = acumulado['estados'].get(clase, 0) + cantidad
+
+
+def leer(ruta):
+    try:
+        with open(ruta) as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return None
+
+
+def escribir(ruta, contenido):
+    temporal = f'{ruta}.tmp'
+    with open(temporal, 'w') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def vivo(pid):
+    if os.name == 'nt':
+        # En Windows os.kill termina el proceso: se consulta su codigo de salida
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        proceso = kernel32.OpenProcess(CONSULTA_LIMITADA, False, pid)
+        if not proceso:
+            return ctypes.get_last_error() == ACCESO_DENEGADO
+        try:
+            codigo = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(proceso, ctypes.byref(codigo))) and codigo.value == SIGUE_ACTIVO
+        finally:
+            kernel32.CloseHandle(proceso)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def bloqueado(directorio):
+    # Un scrape a la vez: otro worker compactando podria borrar un archivo
+    # entre la lectura del acumulado y la de los archivos
+    with open(os.path.join(directorio, BLOQUEO), 'a+') as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            yield
+            return
+        # msvcrt bloquea bytes desde la posicion actual y se rinde a los 10 s
+        archivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                pass
+        try:
+            yield
+        finally:
+            archivo.seek(0)
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def terminados(nombres):
+    # Archivos de procesos que ya no existen. Si el sistema reutilizo un pid,
+    # solo el archivo mas nuevo con ese pid puede ser del proceso vivo
+    archivos = sorted((int(m[1]), int(m[2]), m[0]) for m in map(ARCHIVO_PROCESO.match, nombres) if m)
+    ultimos = {pid: nombre for pid, _, nombre in archivos}
+    return [nombre for pid, _, nombre in archivos if ultimos[pid] != nombre or not vivo(pid)]
+
+
+def compactar(directorio, nombres):
+    # Suma los archivos de procesos terminados al acumulado y los borra. El
+    # acumulado anota los archivos que ya sumo: si el proceso se corta antes
+    # de borrarlos, la siguiente lectura no los cuenta dos veces
+    ruta = os.path.join(directorio, ACUMULADO)
+    acumulado = leer(ruta) or {'archivos': [], 'vistas': {}}
+    muertos = terminados(nombres)
+    nuevos = [nombre for nombre in muertos if nombre not in acumulado['archivos']]
+    if nuevos:
+        for nombre in nuevos:
+            sumar(acumulado['vistas'], leer(os.path.join(directorio, nombre)) or {})
+        acumulado['archivos'] = muertos
+        escribir(ruta, json.dumps(acumulado))
+    for nombre in muertos:
+        try:
+            os.remove(os.path.join(directorio, nombre))
+        except FileNotFoundError:
+            pass
+    return acumulado['vistas']
+
+
+def agregadas():
+    # Suma de todos los procesos, incluido el actual recien volcado
+    registro.volcar()
+    directorio = settings.METRICAS_DIR
+    if not os.path.isdir(directorio):
+        return {}
+    with bloqueado(directorio):
+        total = {}
+        sumar(total, compactar(directorio, os.listdir(directorio)))
+        for nombre in sorted(os.listdir(directorio)):
+            if ARCHIVO_PROCESO.match(nombre):
+                sumar(total, leer(os.path.join(directorio, nombre)) or {})
+    return total
+
+
+def etiqueta(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formato_prometheus(vistas):
+    lineas = [
+        '# HELP unimark_solicitud_duracion_segundos Latencia de las solicitudes por vista.',
+        '# TYPE unimark_solicitud_duracion_segundos histogram',
+    ]
+    for vista, datos in sorted(vistas.items()):
+        v = etiqueta(vista)
+        acumulado = 0
+        for limite, cantidad in zip(CUBETAS + ('+Inf',), datos['cubetas']):
+            acumulado += cantidad
+            lineas.append(f'unimark_solicitud_duracion_segundos_bucket{{vista="{v}",le="{limite}"}} {acumulado}')
+        lineas.append(f'unimark_solicitud_duracion_segundos_sum{{vista="{v}"}} {datos["suma"]:.6f}')
+        lineas.append(f'unimark_solicitud_duracion_segundos_count{{vista="{v}"}} {datos["cantidad"]}')
+
+    contadores = (
+        ('unimark_solicitudes_total', 'Solicitudes por vista y clase de estado HTTP.', None),
+        ('unimark_sql_consultas_total', 'Consultas SQL ejecutadas por vista.', 'consultas'),
+        ('unimark_sql_duracion_segundos_total', 'Tiempo en SQL por vista.', 'sql_segundos'),
+        ('unimark_respuesta_bytes_total', 'Bytes de respuesta por vista.', 'bytes'),
+    )
+    for nombre, ayuda, campo in contadores:
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} counter')
+        for vista, datos in sorted(vistas.items()):
+            v = etiqueta(vista)
+            if campo is None:
+                for clase, cantidad in sorted(datos['estados'].items()):
+                    lineas.append(f'{nombre}{{vista="{v}",estado="{clase}"}} {cantidad}')
+            elif isinstance(datos[campo], float):
+                lineas.append(f'{nombre}{{vista="{v}"}} {datos[campo]:.6f}')
+            else:
+                lineas.append(f'{nombre}{{vista="{v}"}} {datos[campo]}')
+    return '\n'.join(lineas) + '\n'
+
+
+class MedidorSql:
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos += time.perf_counter() - inicio
+
+
+# Medidor de la solicitud en curso. Con ASGI las consultas de una vista async
+# corren en otro hilo (sync_to_async), con la conexion de ese hilo: por eso el
+# envoltorio se instala en cada conexion al abrirse y toma el medidor del
+# contexto, que asgiref copia al hilo.
+medidor_actual = ContextVar('medidor_sql', default=None)
+
+
+def medir_sql(execute, sql, params, many, context):
+    medidor = medidor_actual.get()
+    if medidor is None:
+        return execute(sql, params, many, context)
+    return medidor(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def instalar_medidor(sender, connection, **kwargs):
+    if medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_sql)
+
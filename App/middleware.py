@@ -0,0 +1,160 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from .cache import version_roles
+from .metricas import registro, MedidorSql, SIN_RUTA, medidor_actual
+from .replicas import COOKIE_ESCRITURA
+from .models import Empleado
+
+
+class Roles:
+    def __init__(self, es_admin=False, es_cajero=False, empleado_id=None, punto_emision=''):
+        self.es_admin = es_admin
+        self.es_cajero = es_cajero
+        self.empleado_id = empleado_id
+        self.punto_emision = punto_emision
+
+
+def calcular_roles(user):
+    if not user.is_authenticated:
+        return Roles()
+    grupos = set(user.groups.values_list('name', flat=True))
+    empleado = Empleado.objects.filter(usuario=user).values('id', 'punto_emision').first() or {}
+    return Roles(
+        es_admin='Admin' in grupos or user.is_superuser,
+        es_cajero='Cajero' in grupos,
+        empleado_id=empleado.get('id'),
+        punto_emision=empleado.get('punto_emision', '')
+    )
+
+
+def obtener_roles(request):
+    user = request.user
+    if not user.is_authenticated:
+        return Roles()
+
+    # Los roles se guardan en la sesion junto a la version vigente del usuario;
+    # las senales de App/cache.py cambian esa version cuando cambian sus grupos
+    # o su empleado, y entonces se vuelven a calcular.
+    version = version_roles(user.pk)
+    guardados = request.session.get('roles')
+    if guardados and guardados.get('version') == version:
+        return Roles(
+            guardados['es_admin'], guardados['es_cajero'],
+            guardados['empleado_id'], guardados['punto_emision']
+        )
+
+    roles = calcular_roles(user)
+    request.session['roles'] = {
+        'version': version,
+        'es_admin': roles.es_admin,
+        'es_cajero': roles.es_cajero,
+        'empleado_id': roles.empleado_id,
+        'punto_emision': roles.punto_emision,
+    }
+    return roles
+
+
+class RolesMiddleware:
+    # Sync y async: con ASGI las vistas async no pasan por un hilo solo por este
+    # middleware. request.roles lee la sesion y la base al primer uso, asi que
+    # una vista async no debe tocarlo.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # En modo async get_response devuelve la corrutina y quien llama la espera
+        request.roles = SimpleLazyObject(lambda: obtener_roles(request))
+        return self.get_response(request)
+
+
+class ReplicasMiddleware:
+    # Tras una escritura exitosa el navegador lleva una cookie con el momento
+    # hasta el que sus lecturas van a la primaria (ver App/replicas.py)
+    sync_capable = True
+    async_capable = True
+    metodos_seguros = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.marcar(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.marcar(request, await self.get_response(request))
+
+    def marcar(self, request, response):
+        if settings.REPLICAS and request.method not in self.metodos_seguros and response.status_code < 400:
+            ventana = settings.REPLICA_VENTANA_ESCRITURA
+            response.set_cookie(COOKIE_ESCRITURA, f'{time.time() + ventana:.3f}', max_age=ventana,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class MetricasMiddleware:
+    # Debe ir primero en MIDDLEWARE para medir la solicitud completa
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medidor = MedidorSql()
+        inicio = time.perf_counter()
+        token = medidor_actual.set(medidor)
+        try:
+            response = self.get_response(request)
+        finally:
+            medidor_actual.reset(token)
+        return self.terminar(request, response, medidor, inicio)
+
+    async def __acall__(self, request):
+        medidor = MedidorSql()
+        inicio = time.perf_counter()
+        token = medidor_actual.set(medidor)
+        try:
+            response = await self.get_response(request)
+        finally:
+            medidor_actual.reset(token)
+        return self.terminar(request, response, medidor, inicio)
+
+    def terminar(self, request, response, medidor, inicio):
+        match = request.resolver_match
+        vista = match.view_name if match else SIN_RUTA
+        if response.streaming and not response.is_async:
+            # Exportaciones y ZIP: se mide hasta que se envia el ultimo bloque
+            response.streaming_content = self.flujo(response.streaming_content, vista, medidor, inicio,
+                                                    response.status_code)
+        elif not response.streaming:
+            registro.registrar(vista, time.perf_counter() - inicio, medidor.consultas, medidor.segundos,
+                               len(response.content), response.status_code)
+        return response
+
+    def flujo(self, contenido, vista, medidor, inicio, estado):
+        # El servidor recorre el contenido despues de que el middleware termino
+        tamano = 0
+        medidor_actual.set(medidor)
+        try:
+            for parte in contenido:
+                tamano += len(parte)
+                yield parte
+        finally:
+            medidor_actual.set(None)
+            registro.registrar(vista, time.perf_counter() - inicio, medidor.consultas, medidor.segundos,
+                               tamano, estado)
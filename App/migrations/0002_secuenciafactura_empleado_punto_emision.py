@@ -0,0 +1,31 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empleado',
+            name='punto_emision',
+            field=models.CharField(blank=True, default='', max_length=3, validators=[django.core.validators.RegexValidator(message='El punto de emision debe tener exactamente 3 digitos numericos.', regex='^\\d{3}$')], verbose_name='Punto de Emision'),
+        ),
+        migrations.CreateModel(
+            name='SecuenciaFactura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('establecimiento', models.CharField(max_length=3, verbose_name='Establecimiento')),
+                ('punto_emision', models.CharField(max_length=3, verbose_name='Punto de Emision')),
+                ('ultimo_numero', models.PositiveBigIntegerField(default=0, verbose_name='Ultimo Numero Emitido')),
+            ],
+            options={
+                'verbose_name': 'Secuencia de Factura',
+                'verbose_name_plural': 'Secuencias de Factura',
+                'constraints': [models.UniqueConstraint(fields=('establecimiento', 'punto_emision'), name='secuencia_factura_unica')],
+            },
+        ),
+    ]
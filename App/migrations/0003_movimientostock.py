@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def registrar_stock_existente(apps, schema_editor):
+    Producto = apps.get_model('App', 'Producto')
+    MovimientoStock = apps.get_model('App', 'MovimientoStock')
+    MovimientoStock.objects.bulk_create(
+        [
+            MovimientoStock(producto_id=producto_id, tipo='inicial', cantidad=stock)
+            for producto_id, stock in Producto.objects.filter(stock__gt=0).values_list('id', 'stock').iterator()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0002_secuenciafactura_empleado_punto_emision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('inicial', 'Stock Inicial'), ('venta', 'Venta'), ('devolucion', 'Devolucion'), ('reposicion', 'Reposicion'), ('ajuste', 'Ajuste'), ('saldo', 'Saldo Compactado')], max_length=12, verbose_name='Tipo')),
+                ('cantidad', models.IntegerField(verbose_name='Cantidad')),
+                ('referencia', models.CharField(blank=True, default='', max_length=50, verbose_name='Referencia')),
+                ('fecha', models.DateTimeField(auto_now_add=True, verbose_name='Fecha')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='App.producto', verbose_name='Producto')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Stock',
+                'verbose_name_plural': 'Movimientos de Stock',
+                'ordering': ['-fecha', '-id'],
+                'indexes': [models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha')],
+            },
+        ),
+        migrations.RunPython(registrar_stock_existente, migrations.RunPython.noop),
+    ]
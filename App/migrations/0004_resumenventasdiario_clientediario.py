@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0003_movimientostock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClienteDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='App.cliente', verbose_name='Cliente')),
+            ],
+            options={
+                'verbose_name': 'Cliente Atendido en el Dia',
+                'verbose_name_plural': 'Clientes Atendidos por Dia',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'cliente'), name='cliente_diario_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenVentasDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('facturas', models.PositiveIntegerField(default=0, verbose_name='Facturas Emitidas')),
+                ('clientes', models.PositiveIntegerField(default=0, verbose_name='Clientes Nuevos del Dia')),
+                ('subtotal_sin_iva', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('subtotal_con_iva', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('valor_iva', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('empleado', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='App.empleado', verbose_name='Empleado')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Ventas Diario',
+                'verbose_name_plural': 'Resumenes de Ventas Diarios',
+                'ordering': ['-fecha'],
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'empleado'), name='resumen_ventas_fecha_empleado')],
+            },
+        ),
+    ]
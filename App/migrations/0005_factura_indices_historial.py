@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0004_resumenventasdiario_clientediario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['fecha', 'id'], name='factura_fecha_id'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['empleado', 'fecha', 'id'], name='factura_empleado_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['cliente', 'fecha', 'id'], name='factura_cliente_fecha'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0005_factura_indices_historial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['nombre', 'id'], name='producto_nombre'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['marca'], name='producto_marca'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', 'stock'], name='producto_activo_stock'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import unicodedata
+from django.db import migrations, models
+
+
+def texto_busqueda(nombre, apellido):
+    texto = unicodedata.normalize('NFKD', f'{nombre} {apellido}')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(texto.split())[:201]
+
+
+def llenar_busqueda(apps, schema_editor):
+    Cliente = apps.get_model('App', 'Cliente')
+    lote = []
+    for cliente in Cliente.objects.only('id', 'nombre', 'apellido').iterator(chunk_size=2000):
+        cliente.busqueda = texto_busqueda(cliente.nombre, cliente.apellido)
+        lote.append(cliente)
+        if len(lote) == 2000:
+            Cliente.objects.bulk_update(lote, ['busqueda'])
+            lote = []
+    Cliente.objects.bulk_update(lote, ['busqueda'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0006_producto_indices_lista'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='busqueda',
+            field=models.CharField(default='', editable=False, max_length=201, verbose_name='Texto de Busqueda'),
+        ),
+        migrations.RunPython(llenar_busqueda, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['busqueda', 'id'], name='cliente_busqueda'),
+        ),
+    ]
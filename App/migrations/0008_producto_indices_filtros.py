@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0007_cliente_busqueda'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='producto',
+            name='producto_marca',
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['marca', 'nombre', 'id'], name='producto_marca_nombre'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['es_primera_necesidad', 'nombre', 'id'], name='producto_iva_nombre'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0008_producto_indices_filtros'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factura',
+            name='clave_sincronizacion',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True,
+                                   verbose_name='Clave de Sincronizacion'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+import App.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0009_factura_clave_sincronizacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='version_datos',
+            field=models.BigIntegerField(default=App.models.version_actual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='version_stock',
+            field=models.BigIntegerField(default=App.models.version_actual, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['version_datos'], name='producto_version_datos'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['version_stock'], name='producto_version_stock'),
+        ),
+    ]
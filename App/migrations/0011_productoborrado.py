@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import App.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0010_producto_versiones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoBorrado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('producto_id', models.BigIntegerField(verbose_name='Producto')),
+                ('version', models.BigIntegerField(default=App.models.version_actual, editable=False)),
+            ],
+            options={
+                'verbose_name': 'Producto Borrado',
+                'verbose_name_plural': 'Productos Borrados',
+                'indexes': [models.Index(fields=['version'], name='producto_borrado_version')],
+            },
+        ),
+    ]
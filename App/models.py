@@ -1,15 +1,41 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Case, When, Sum
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, MinValueValidator
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from decimal import Decimal
+from django.dispatch import receiver, Signal
+from decimal import Decimal, ROUND_HALF_UP
+import time
+import unicodedata
+
+IVA = Decimal('0.15')
+CENTAVO = Decimal('0.01')
 
 cedula_validator = RegexValidator(
     regex=r'^\d{10}$',
     message='La cedula debe tener exactamente 10 digitos numericos.'
 )
 
+punto_emision_validator = RegexValidator(
+    regex=r'^\d{3}$',
+    message='El punto de emision debe tener exactamente 3 digitos numericos.'
+)
+
+# Se envia tras el commit con delta: {producto_id: cantidad con signo}
+stock_actualizado = Signal()
+
+
+class StockInsuficiente(Exception):
+    pass
+
+
+def normalizar_texto(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+
 CATEGORIAS_PRIMERA_NECESIDAD = [
     'arroz', 'pan', 'leche', 'huevos', 'aceite', 'azucar', 'sal', 'harina',
     'legumbres', 'frejol', 'lenteja', 'frutas', 'verduras', 'carne', 'pollo',
@@ -62,6 +88,13 @@ class Empleado(Persona):
     )
     activo = models.BooleanField(default=True, verbose_name='Activo')
     fecha_ingreso = models.DateField(auto_now_add=True, verbose_name='Fecha de Ingreso')
+    punto_emision = models.CharField(
+        max_length=3,
+        blank=True,
+        default='',
+        validators=[punto_emision_validator],
+        verbose_name='Punto de Emision'
+    )
 
     class Meta:
         verbose_name = 'Empleado'
@@ -78,17 +111,33 @@ class Cliente(Persona):
         verbose_name='Es Consumidor Final'
     )
     fecha_registro = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Registro')
+    # 'nombre apellido' en minusculas y sin tildes: se busca por prefijo con el indice
+    busqueda = models.CharField(max_length=201, default='', editable=False, verbose_name='Texto de Busqueda')
 
     class Meta:
         verbose_name = 'Cliente'
         verbose_name_plural = 'Clientes'
         ordering = ['apellido', 'nombre']
+        indexes = [
+            models.Index(fields=['busqueda', 'id'], name='cliente_busqueda'),
+        ]
 
     def __str__(self):
         if self.es_consumidor_final:
             return "Consumidor Final"
         return f"{self.nombre_completo}"
 
+    @staticmethod
+    def texto_busqueda(nombre, apellido):
+        return ' '.join(normalizar_texto(f"{nombre} {apellido}").split())[:201]
+
+    def save(self, *args, **kwargs):
+        self.busqueda = self.texto_busqueda(self.nombre, self.apellido)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'nombre', 'apellido'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'busqueda'}
+        super().save(*args, **kwargs)
+
     @classmethod
     def get_consumidor_final(cls):
         cliente, created = cls.objects.get_or_create(
@@ -104,6 +153,13 @@ class Cliente(Persona):
         return cliente
 
 
+def version_actual():
+    # Version del catalogo de las cajas: microsegundos desde 1970. Crece con el
+    # tiempo sin una fila contador que todas las cajas actualicen en cada venta
+    # (ver App/catalogo.py).
+    return time.time_ns() // 1000
+
+
 class Producto(models.Model):
     codigo = models.CharField(
         max_length=20,
@@ -127,28 +183,134 @@ class Producto(models.Model):
     activo = models.BooleanField(default=True, verbose_name='Activo')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
+    # Ultimo cambio de los datos (cualquier save) y ultimo movimiento de stock
+    version_datos = models.BigIntegerField(default=version_actual, editable=False)
+    version_stock = models.BigIntegerField(default=version_actual, editable=False)
 
     class Meta:
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['nombre']
+        # Orden y filtros de la lista de productos
+        indexes = [
+            models.Index(fields=['nombre', 'id'], name='producto_nombre'),
+            models.Index(fields=['marca', 'nombre', 'id'], name='producto_marca_nombre'),
+            models.Index(fields=['es_primera_necesidad', 'nombre', 'id'], name='producto_iva_nombre'),
+            models.Index(fields=['activo', 'stock'], name='producto_activo_stock'),
+            models.Index(fields=['version_datos'], name='producto_version_datos'),
+            models.Index(fields=['version_stock'], name='producto_version_stock'),
+        ]
 
     def __str__(self):
         return f"{self.codigo} - {self.nombre}"
 
+    def save(self, *args, **kwargs):
+        self.version_datos = version_actual()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version_datos'}
+        super().save(*args, **kwargs)
+
     @property
     def tiene_stock(self):
         return self.stock > 0
 
     @property
     def iva_porcentaje(self):
-        return Decimal('0') if self.es_primera_necesidad else Decimal('0.15')
+        return Decimal('0') if self.es_primera_necesidad else IVA
 
     def calcular_precio_con_iva(self, cantidad=1):
         subtotal = self.precio_unitario * cantidad
         iva = subtotal * self.iva_porcentaje
         return subtotal + iva
 
+    def stock_en(self, fecha):
+        total = self.movimientos.filter(fecha__lte=fecha).aggregate(total=Sum('cantidad'))['total']
+        return total or 0
+
+    def ajustar_stock(self, nuevo_stock, tipo='ajuste', referencia=''):
+        with transaction.atomic():
+            actual = Producto.objects.select_for_update().values_list('stock', flat=True).get(pk=self.pk)
+            if nuevo_stock != actual:
+                MovimientoStock.registrar([(self.pk, nuevo_stock - actual)], tipo, referencia)
+        self.stock = nuevo_stock
+
+
+class ProductoBorrado(models.Model):
+    # Productos eliminados de verdad (no desactivados), para quitarlos de las
+    # cajas con los cambios del catalogo (App/catalogo.py). Sin FK: el producto
+    # ya no existe.
+    producto_id = models.BigIntegerField(verbose_name='Producto')
+    version = models.BigIntegerField(default=version_actual, editable=False)
+
+    class Meta:
+        verbose_name = 'Producto Borrado'
+        verbose_name_plural = 'Productos Borrados'
+        indexes = [
+            models.Index(fields=['version'], name='producto_borrado_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} ({self.version})"
+
+
+class SecuenciaFactura(models.Model):
+    establecimiento = models.CharField(max_length=3, verbose_name='Establecimiento')
+    punto_emision = models.CharField(max_length=3, verbose_name='Punto de Emision')
+    ultimo_numero = models.PositiveBigIntegerField(default=0, verbose_name='Ultimo Numero Emitido')
+
+    class Meta:
+        verbose_name = 'Secuencia de Factura'
+        verbose_name_plural = 'Secuencias de Factura'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['establecimiento', 'punto_emision'],
+                name='secuencia_factura_unica'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.establecimiento}-{self.punto_emision} ({self.ultimo_numero})"
+
+    @classmethod
+    def siguiente_numero(cls, establecimiento=None, punto_emision=None):
+        # Debe llamarse dentro de la transaccion que guarda la factura: el UPDATE
+        # bloquea solo la fila de esta serie y, si la factura falla, el numero se
+        # libera con el rollback, asi la serie no tiene huecos.
+        establecimiento = establecimiento or settings.FACTURACION_ESTABLECIMIENTO
+        punto_emision = punto_emision or settings.FACTURACION_PUNTO_EMISION
+        serie = cls.objects.filter(establecimiento=establecimiento, punto_emision=punto_emision)
+
+        with transaction.atomic(savepoint=False):
+            if not serie.update(ultimo_numero=F('ultimo_numero') + 1):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            establecimiento=establecimiento,
+                            punto_emision=punto_emision,
+                            ultimo_numero=1
+                        )
+                except IntegrityError:
+                    serie.update(ultimo_numero=F('ultimo_numero') + 1)
+            numero = serie.values_list('ultimo_numero', flat=True).get()
+
+        return f"{establecimiento}-{punto_emision}-{str(numero).zfill(9)}"
+
+
+def importes(subtotal_sin_iva, subtotal_gravado):
+    # Totales de una factura a partir de la suma de las lineas con IVA 0% y de las
+    # gravadas. Se redondea aqui (mitad hacia arriba, como MySQL al guardar
+    # DECIMAL) para que los valores en memoria y los resumenes coincidan con los
+    # guardados.
+    valor_iva = subtotal_gravado * IVA
+    subtotal_con_iva = subtotal_gravado + valor_iva
+    valores = {
+        'subtotal_sin_iva': subtotal_sin_iva,
+        'subtotal_con_iva': subtotal_con_iva,
+        'valor_iva': valor_iva,
+        'total': subtotal_sin_iva + subtotal_con_iva,
+    }
+    return {campo: valor.quantize(CENTAVO, rounding=ROUND_HALF_UP) for campo, valor in valores.items()}
+
 
 class Factura(models.Model):
     numero = models.CharField(max_length=20, unique=True, verbose_name='Numero de Factura')
@@ -187,40 +349,59 @@ class Factura(models.Model):
         default=Decimal('0.00'),
         verbose_name='Total a Pagar'
     )
+    # Generada por la caja (UUID) para que reenviar la misma venta no la duplique
+    clave_sincronizacion = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Clave de Sincronizacion'
+    )
 
     class Meta:
         verbose_name = 'Factura'
         verbose_name_plural = 'Facturas'
         ordering = ['-fecha']
+        # Para el historial paginado por (fecha, id), con y sin filtro de empleado o cliente
+        indexes = [
+            models.Index(fields=['fecha', 'id'], name='factura_fecha_id'),
+            models.Index(fields=['empleado', 'fecha', 'id'], name='factura_empleado_fecha'),
+            models.Index(fields=['cliente', 'fecha', 'id'], name='factura_cliente_fecha'),
+        ]
 
     def __str__(self):
         return f"Factura {self.numero} - {self.cliente}"
 
     def save(self, *args, **kwargs):
-        if not self.numero:
-            ultima = Factura.objects.order_by('-id').first()
-            if ultima:
-                ultimo_num = int(ultima.numero.split('-')[1])
-                self.numero = f"FAC-{str(ultimo_num + 1).zfill(8)}"
+        if self.numero:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic(savepoint=False):
+            self.numero = SecuenciaFactura.siguiente_numero(
+                punto_emision=self.empleado.punto_emision or None
+            )
+            super().save(*args, **kwargs)
+
+    def asignar_totales(self, lineas):
+        # lineas: pares (es_primera_necesidad, total_linea)
+        sin_iva = Decimal('0.00')
+        gravado = Decimal('0.00')
+
+        for es_primera_necesidad, total_linea in lineas:
+            if es_primera_necesidad:
+                sin_iva += total_linea
             else:
-                self.numero = "FAC-00000001"
-        super().save(*args, **kwargs)
-
-    def calcular_totales(self):
-        detalles = self.detalles.all()
-
-        self.subtotal_sin_iva = Decimal('0.00')
-        self.subtotal_con_iva = Decimal('0.00')
+                gravado += total_linea
 
-        for detalle in detalles:
-            if detalle.producto.es_primera_necesidad:
-                self.subtotal_sin_iva += detalle.total_linea
-            else:
-                self.subtotal_con_iva += detalle.total_linea
+        for campo, valor in importes(sin_iva, gravado).items():
+            setattr(self, campo, valor)
 
-        self.valor_iva = self.subtotal_con_iva * Decimal('0.15')
-        self.subtotal_con_iva = self.subtotal_con_iva + self.valor_iva
-        self.total = self.subtotal_sin_iva + self.subtotal_con_iva
+    def calcular_totales(self):
+        detalles = self.detalles.select_related('producto')
+        self.asignar_totales(
+            (detalle.producto.es_primera_necesidad, detalle.total_linea) for detalle in detalles
+        )
         self.save()
 
 
@@ -263,17 +444,181 @@ class DetalleFactura(models.Model):
         super().save(*args, **kwargs)
 
 
+class ResumenVentasDiario(models.Model):
+    fecha = models.DateField(verbose_name='Fecha')
+    empleado = models.ForeignKey(
+        Empleado,
+        on_delete=models.PROTECT,
+        verbose_name='Empleado'
+    )
+    facturas = models.PositiveIntegerField(default=0, verbose_name='Facturas Emitidas')
+    # Clientes atendidos por primera vez en el dia por este empleado: la suma
+    # de todos los empleados da los clientes distintos del dia.
+    clientes = models.PositiveIntegerField(default=0, verbose_name='Clientes Nuevos del Dia')
+    subtotal_sin_iva = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    subtotal_con_iva = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    valor_iva = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Resumen de Ventas Diario'
+        verbose_name_plural = 'Resumenes de Ventas Diarios'
+        ordering = ['-fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'empleado'], name='resumen_ventas_fecha_empleado'),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} - {self.empleado_id}: {self.total}"
+
+    @classmethod
+    def registrar(cls, factura):
+        # Se llama dentro de la transaccion de la factura y al final de ella: la
+        # fila solo es del empleado que factura, asi que cajas distintas no se
+        # bloquean entre si.
+        fecha = timezone.localdate(factura.fecha)
+        nuevo_cliente = 0
+        visita = ClienteDiario.objects.filter(fecha=fecha, cliente_id=factura.cliente_id)
+        if not visita.exists():
+            try:
+                with transaction.atomic():
+                    ClienteDiario.objects.create(fecha=fecha, cliente_id=factura.cliente_id)
+                nuevo_cliente = 1
+            except IntegrityError:
+                pass
+
+        resumen = cls.objects.filter(fecha=fecha, empleado_id=factura.empleado_id)
+        cambios = {
+            'facturas': F('facturas') + 1,
+            'clientes': F('clientes') + nuevo_cliente,
+            'subtotal_sin_iva': F('subtotal_sin_iva') + factura.subtotal_sin_iva,
+            'subtotal_con_iva': F('subtotal_con_iva') + factura.subtotal_con_iva,
+            'valor_iva': F('valor_iva') + factura.valor_iva,
+            'total': F('total') + factura.total,
+        }
+        if not resumen.update(**cambios):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(fecha=fecha, empleado_id=factura.empleado_id)
+            except IntegrityError:
+                pass
+            resumen.update(**cambios)
+
+
+class ClienteDiario(models.Model):
+    fecha = models.DateField(verbose_name='Fecha')
+    cliente = models.ForeignKey(
+        Cliente,
+        on_delete=models.CASCADE,
+        verbose_name='Cliente'
+    )
+
+    class Meta:
+        verbose_name = 'Cliente Atendido en el Dia'
+        verbose_name_plural = 'Clientes Atendidos por Dia'
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'cliente'], name='cliente_diario_unico'),
+        ]
+
+
+class MovimientoStock(models.Model):
+    TIPO_CHOICES = [
+        ('inicial', 'Stock Inicial'),
+        ('venta', 'Venta'),
+        ('devolucion', 'Devolucion'),
+        ('reposicion', 'Reposicion'),
+        ('ajuste', 'Ajuste'),
+        ('saldo', 'Saldo Compactado'),
+    ]
+
+    # Un producto sin ventas se puede borrar con su diario; las ventas lo
+    # protegen por DetalleFactura
+    producto = models.ForeignKey(
+        Producto,
+        on_delete=models.CASCADE,
+        related_name='movimientos',
+        verbose_name='Producto'
+    )
+    tipo = models.CharField(max_length=12, choices=TIPO_CHOICES, verbose_name='Tipo')
+    cantidad = models.IntegerField(verbose_name='Cantidad')
+    referencia = models.CharField(max_length=50, blank=True, default='', verbose_name='Referencia')
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name='Fecha')
+
+    class Meta:
+        verbose_name = 'Movimiento de Stock'
+        verbose_name_plural = 'Movimientos de Stock'
+        ordering = ['-fecha', '-id']
+        indexes = [
+            models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} - {self.producto_id}"
+
+    @classmethod
+    def registrar(cls, cantidades, tipo, referencia=''):
+        # cantidades: pares (producto_id, cantidad con signo). Se agrega una fila
+        # al diario por par y el stock se mueve con un solo UPDATE condicional,
+        # sin leer ni reescribir el resto de la fila del producto.
+        cantidades = [(producto_id, cantidad) for producto_id, cantidad in cantidades if cantidad]
+        if not cantidades:
+            return
+
+        delta = {}
+        for producto_id, cantidad in cantidades:
+            delta[producto_id] = delta.get(producto_id, 0) + cantidad
+
+        condicion = Q()
+        casos = []
+        for producto_id, cantidad in delta.items():
+            if cantidad < 0:
+                condicion |= Q(pk=producto_id, stock__gte=-cantidad)
+            else:
+                condicion |= Q(pk=producto_id)
+            casos.append(When(pk=producto_id, then=F('stock') + cantidad))
+
+        with transaction.atomic(savepoint=False):
+            actualizados = Producto.objects.filter(condicion).update(stock=Case(*casos), version_stock=version_actual())
+            if actualizados != len(delta):
+                raise StockInsuficiente('Stock insuficiente para completar la operacion.')
+
+            cls.objects.bulk_create([
+                cls(producto_id=producto_id, tipo=tipo, cantidad=cantidad, referencia=referencia)
+                for producto_id, cantidad in cantidades
+            ])
+            transaction.on_commit(lambda: stock_actualizado.send(sender=cls, delta=delta))
+
+    @classmethod
+    def registrar_iniciales(cls, productos):
+        # Lo que hace registrar_stock_inicial, para productos nuevos insertados con
+        # bulk_create (sin senales). MySQL no devuelve los ids: se buscan por codigo.
+        con_stock = [producto for producto in productos if producto.stock]
+        sin_id = [producto for producto in con_stock if producto.pk is None]
+        if sin_id:
+            ids = dict(Producto.objects.filter(codigo__in=[p.codigo for p in sin_id]).values_list('codigo', 'id'))
+            for producto in sin_id:
+                producto.pk = ids[producto.codigo]
+        cls.objects.bulk_create([
+            cls(producto_id=producto.pk, tipo='inicial', cantidad=producto.stock) for producto in con_stock
+        ])
+
+
+@receiver(post_save, sender=Producto)
+def registrar_stock_inicial(sender, instance, created, raw=False, **kwargs):
+    if created and instance.stock and not raw:
+        MovimientoStock.objects.create(producto=instance, tipo='inicial', cantidad=instance.stock)
+
+
 @receiver(post_save, sender=DetalleFactura)
 def reducir_stock(sender, instance, created, **kwargs):
     if created:
-        producto = instance.producto
-        producto.stock -= instance.cantidad
-        producto.save()
+        MovimientoStock.registrar(
+            [(instance.producto_id, -instance.cantidad)], 'venta', instance.factura.numero
+        )
 
 
 @receiver(post_delete, sender=DetalleFactura)
 def restaurar_stock(sender, instance, **kwargs):
-    producto = instance.producto
-    producto.stock += instance.cantidad
-    producto.save()
-
+    MovimientoStock.registrar(
+        [(instance.producto_id, instance.cantidad)], 'devolucion', instance.factura.numero
+    )
@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections, DatabaseError
+from django.utils import timezone
+
+# Replicas de lectura
+#
+# Solo las vistas marcadas con @lectura_en_replica leen de una replica (la
+# primera consulta elige una sana y el resto de la solicitud usa la misma);
+# todo lo demas, las escrituras y las apps de autenticacion van a la primaria.
+# Despues de una escritura (POST exitoso) el usuario lee de la primaria durante
+# REPLICA_VENTANA_ESCRITURA segundos para ver lo que acaba de hacer. Una replica
+# que no responde o va mas de REPLICA_RETRASO_MAXIMO segundos atrasada se deja
+# de usar hasta la proxima revision.
+
+PRIMARIA = 'default'
+COOKIE_ESCRITURA = 'primaria_hasta'
+# Sesion y usuario recien creados tienen que verse en la siguiente solicitud
+APPS_PRIMARIA = {'auth', 'sessions', 'contenttypes'}
+
+# None: la vista no lee de replicas. {}: todavia no se eligio. {'alias': ...}: elegida.
+# Un dict y no el alias: asi la eleccion hecha en el hilo de sync_to_async de una
+# vista async tambien vale para el resto de la solicitud.
+lectura = ContextVar('lectura_en_replica', default=None)
+
+
+def retraso_mysql(cursor):
+    try:
+        cursor.execute('SHOW REPLICA STATUS')
+    except DatabaseError:
+        # Anterior a MySQL 8.0.22
+        cursor.execute('SHOW SLAVE STATUS')
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    estado = dict(zip([columna[0] for columna in cursor.description], fila))
+    return estado.get('Seconds_Behind_Source', estado.get('Seconds_Behind_Master'))
+
+
+def retraso_por_datos(alias):
+    # Sin estado de replicacion (SQLite en local, dos archivos): el atraso es la
+    # antiguedad de la primera factura de la primaria que la replica no tiene
+    from .models import Factura
+    ultima = Factura.objects.using(alias).order_by('-id').values_list('id', flat=True).first() or 0
+    faltante = (Factura.objects.using(PRIMARIA).filter(id__gt=ultima).order_by('id')
+                .values_list('fecha', flat=True).first())
+    if faltante is None:
+        return 0
+    return max(0.0, (timezone.now() - faltante).total_seconds())
+
+
+def medir_retraso(alias):
+    # Segundos de atraso; None si la replica no responde o no esta replicando
+    try:
+        conexion = connections[alias]
+        if conexion.vendor == 'mysql':
+            with conexion.cursor() as cursor:
+                return retraso_mysql(cursor)
+        return retraso_por_datos(alias)
+    except DatabaseError:
+        return None
+
+
+class EstadoReplicas:
+    # Por proceso: cada replica se revisa como mucho cada REPLICA_REVISION segundos
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revisiones = {}
+
+    def reiniciar(self):
+        with self.lock:
+            self.revisiones = {}
+
+    def retraso(self, alias):
+        revision = self.revisiones.get(alias)
+        if revision is None or time.monotonic() - revision[0] > settings.REPLICA_REVISION:
+            with self.lock:
+                revision = self.revisiones.get(alias)
+                if revision is None or time.monotonic() - revision[0] > settings.REPLICA_REVISION:
+                    revision = (time.monotonic(), medir_retraso(alias))
+                    self.revisiones[alias] = revision
+        return revision[1]
+
+    def disponibles(self):
+        return [
+            alias for alias in settings.REPLICAS
+            if (retraso := self.retraso(alias)) is not None and retraso <= settings.REPLICA_RETRASO_MAXIMO
+        ]
+
+
+estado = EstadoReplicas()
+
+
+def escritura_reciente(request):
+    try:
+        return float(request.COOKIES.get(COOKIE_ESCRITURA, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def lectura_en_replica(vista):
+    # Para vistas de solo lectura. No consulta nada al entrar (puede ser una vista
+    # async): la replica se elige en el router, en la primera consulta.
+    def preparar(request):
+        if not settings.REPLICAS or escritura_reciente(request):
+            return None
+        return {}
+
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            token = lectura.set(preparar(request))
+            try:
+                return await vista(request, *args, **kwargs)
+            finally:
+                lectura.reset(token)
+    else:
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            token = lectura.set(preparar(request))
+            try:
+                return vista(request, *args, **kwargs)
+            finally:
+                lectura.reset(token)
+    return envoltura
+
+
+class RouterReplicas:
+    def db_for_read(self, model, **hints):
+        eleccion = lectura.get()
+        if eleccion is None or model._meta.app_label in APPS_PRIMARIA:
+            return PRIMARIA
+        if 'alias' not in eleccion:
+            disponibles = estado.disponibles()
+            eleccion['alias'] = random.choice(disponibles) if disponibles else PRIMARIA
+        return eleccion['alias']
+
+    def db_for_write(self, model, **hints):
+        return PRIMARIA
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primaria y replicas tienen los mismos datos
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las replicas reciben el esquema por replicacion
+        if db in settings.REPLICAS:
+            return False
+        return None
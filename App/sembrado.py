@@ -0,0 +1,208 @@
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import (Cliente, Empleado, Producto, Factura, DetalleFactura, MovimientoStock,
+                     CATEGORIAS_PRIMERA_NECESIDAD, importes)
+
+# Datos sinteticos para benchmarks y pruebas de planes de consulta. Se insertan
+# por lotes sin senales (las facturas sin movimientos de stock ni resumenes) y con
+# establecimiento '900' para no chocar con la numeracion real. La misma semilla
+# produce los mismos datos.
+ESTABLECIMIENTO_SINTETICO = '900'
+PREFIJO_PRODUCTO = 'SIN'
+PREFIJO_CEDULA = '8'
+PREFIJO_CEDULA_EMPLEADO = '7'
+LOTE = 5000
+# Exponente de popularidad: con 1.0 el 20% de los productos (y de los clientes)
+# se lleva cerca del 80% de las lineas (de las facturas)
+ALFA = 1.0
+
+MARCAS = ['Conejo', 'Vita', 'Supan', 'La Favorita', 'Nestle', 'Toni', 'Pronaca', 'Real', 'Facundo', 'Oriental']
+PRESENTACIONES = ['250g', '500g', '1kg', '2kg', '1L', '500ml', 'x6', 'x12', 'Familiar', 'Personal']
+NOMBRES = ['Maria', 'Jose', 'Luis', 'Ana', 'Carlos', 'Rosa', 'Jorge', 'Lucia', 'Andres', 'Monica']
+APELLIDOS = ['Garcia', 'Perez', 'Lopez', 'Zambrano', 'Mendoza', 'Vera', 'Cedeño', 'Muñoz', 'Guaman', 'Chavez']
+
+
+def insertar(modelo, objetos, guardado=None):
+    # guardado(lote) se llama despues de cada bulk_create, en su transaccion
+    lote = []
+    for objeto in objetos:
+        lote.append(objeto)
+        if len(lote) == LOTE:
+            insertar_lote(modelo, lote, guardado)
+            lote = []
+    insertar_lote(modelo, lote, guardado)
+
+
+def insertar_lote(modelo, lote, guardado):
+    with transaction.atomic():
+        modelo.objects.bulk_create(lote)
+        if guardado:
+            guardado(lote)
+
+
+def siguiente_numero(modelo, campo, prefijo):
+    # Para sembrar otra vez sobre datos sinteticos: se sigue despues del mayor
+    # numero usado. Son de ancho fijo, asi que el orden de texto sirve.
+    ultimo = (modelo.objects.filter(**{f'{campo}__startswith': prefijo})
+              .order_by(f'-{campo}').values_list(campo, flat=True).first())
+    return int(ultimo[len(prefijo):]) + 1 if ultimo else 0
+
+
+def sembrar_productos(cantidad, rnd):
+    categorias = CATEGORIAS_PRIMERA_NECESIDAD + ['galletas', 'jabon', 'shampoo', 'chocolate']
+
+    def producto(i):
+        categoria = rnd.choice(categorias)
+        return Producto(
+            codigo=f'{PREFIJO_PRODUCTO}{i:08d}',
+            nombre=f'{categoria.title()} {rnd.choice(MARCAS)} {rnd.choice(PRESENTACIONES)} {i}',
+            descripcion='Producto sintetico',
+            marca=rnd.choice(MARCAS),
+            precio_unitario=Decimal(rnd.randint(25, 2500)) / 100,
+            stock=rnd.choice([0, rnd.randint(1, 5)] + [rnd.randint(6, 500)] * 8),
+            es_primera_necesidad=categoria in CATEGORIAS_PRIMERA_NECESIDAD,
+            activo=rnd.random() > 0.05,
+        )
+    inicio = siguiente_numero(Producto, 'codigo', PREFIJO_PRODUCTO)
+    # Con su stock inicial en el diario, como si se hubieran creado con save()
+    insertar(Producto, (producto(i) for i in range(inicio, inicio + cantidad)), MovimientoStock.registrar_iniciales)
+
+
+def sembrar_clientes(cantidad, rnd):
+    def cliente(i):
+        nombre = rnd.choice(NOMBRES)
+        apellido = f'{rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}'
+        return Cliente(
+            cedula=f'{PREFIJO_CEDULA}{i:09d}', nombre=nombre, apellido=apellido, celular='0990000000',
+            correo=f'cliente{i}@correo.com', busqueda=Cliente.texto_busqueda(nombre, apellido),
+        )
+    inicio = siguiente_numero(Cliente, 'cedula', PREFIJO_CEDULA)
+    insertar(Cliente, (cliente(i) for i in range(inicio, inicio + cantidad)))
+
+
+def sembrar_empleados(cantidad, rnd):
+    # Cajeros para repartir las facturas; con uno solo el planificador recorre la
+    # tabla de empleados en vez de buscar por id y los planes no son los reales
+    def empleado(i):
+        return Empleado(
+            cedula=f'{PREFIJO_CEDULA_EMPLEADO}{i:09d}', nombre=rnd.choice(NOMBRES),
+            apellido=f'{rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}', celular='0990000000',
+            correo=f'empleado{i}@sintetico.com', cargo='cajero',
+        )
+    inicio = siguiente_numero(Empleado, 'cedula', PREFIJO_CEDULA_EMPLEADO)
+    insertar(Empleado, (empleado(i) for i in range(inicio, inicio + cantidad)))
+
+
+def insertar_filas(modelo, campos, filas):
+    # INSERT directo con executemany: para millones de lineas el costo de armar
+    # instancias y pasar cada valor por el ORM supera al de la base
+    opciones = modelo._meta
+    columnas = ', '.join(connection.ops.quote_name(opciones.get_field(campo).column) for campo in campos)
+    marcas = ', '.join(['%s'] * len(campos))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {connection.ops.quote_name(opciones.db_table)} ({columnas}) VALUES ({marcas})', filas
+        )
+
+
+def pareto(elementos, rnd, alfa=ALFA):
+    # Pesos acumulados 1/rango^alfa (Zipf, el Pareto discreto) para rnd.choices;
+    # el rango se reparte al azar para que la popularidad no siga al id
+    elementos = list(elementos)
+    rnd.shuffle(elementos)
+    return elementos, list(accumulate(rango ** -alfa for rango in range(1, len(elementos) + 1)))
+
+
+def siguiente_id(modelo):
+    return (modelo.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0) + 1
+
+
+def sembrar_facturas(cantidad, rnd, dias=365, lineas=3, desde=None, hasta=None, alfa=ALFA, progreso=None):
+    # Facturas entre desde y hasta (por defecto los ultimos dias), en orden de
+    # fecha y numero. Lineas por factura: 1 mas una geometrica de media lineas - 1.
+    # Los ids se asignan aqui, asi que cada lote son dos INSERT sin releer nada.
+    empleados = list(Empleado.objects.order_by('id').values_list('id', flat=True))
+    if not empleados:
+        empleados = [Empleado.objects.create(
+            cedula='8999999999', nombre='Cajero', apellido='Sintetico', celular='0990000000',
+            correo='cajero@sintetico.com', cargo='cajero'
+        ).pk]
+    clientes, pesos_clientes = pareto(Cliente.objects.order_by('id').values_list('id', flat=True), rnd, alfa)
+    productos, pesos_productos = pareto(
+        Producto.objects.order_by('id').values_list('id', 'precio_unitario', 'es_primera_necesidad'), rnd, alfa
+    )
+    media = 1 / math.log(lineas / (lineas - 1)) if lineas > 1 else 0
+
+    hasta = hasta or timezone.now()
+    desde = desde or hasta - timedelta(days=dias)
+    paso = (hasta - desde) / max(cantidad, 1)
+    serie = f'{ESTABLECIMIENTO_SINTETICO}-001-'
+    primero = max(siguiente_numero(Factura, 'numero', serie), 1)
+    factura_id = siguiente_id(Factura)
+    detalle_id = siguiente_id(DetalleFactura)
+    fecha_bd = connection.ops.adapt_datetimefield_value
+    total_lineas = 0
+
+    for inicio in range(0, cantidad, LOTE):
+        facturas = []
+        detalles = []
+        n = min(LOTE, cantidad - inicio)
+        for i, cliente_id in zip(range(inicio, inicio + n), rnd.choices(clientes, cum_weights=pesos_clientes, k=n)):
+            k = 1 + int(rnd.expovariate(1 / media)) if media else 1
+            # Un producto elegido dos veces va en una sola linea, como en la caja
+            cantidades = {}
+            for producto in rnd.choices(productos, cum_weights=pesos_productos, k=k):
+                cantidades[producto] = cantidades.get(producto, 0) + rnd.randint(1, 5)
+            sin_iva = gravado = Decimal('0')
+            for (producto_id, precio, primera_necesidad), cantidad_linea in cantidades.items():
+                total = precio * cantidad_linea
+                if primera_necesidad:
+                    sin_iva += total
+                else:
+                    gravado += total
+                detalles.append((detalle_id, factura_id, producto_id, cantidad_linea, precio, total))
+                detalle_id += 1
+            # Los mismos importes (y redondeo) que Factura.asignar_totales
+            valores = importes(sin_iva, gravado)
+            facturas.append((
+                factura_id, f'{serie}{primero + i:09d}', cliente_id,
+                empleados[i % len(empleados)], fecha_bd(desde + paso * (i + rnd.random())),
+                valores['subtotal_sin_iva'], valores['subtotal_con_iva'], valores['valor_iva'], valores['total'],
+            ))
+            factura_id += 1
+
+        with transaction.atomic():
+            insertar_filas(Factura, ('id', 'numero', 'cliente', 'empleado', 'fecha', 'subtotal_sin_iva',
+                                     'subtotal_con_iva', 'valor_iva', 'total'), facturas)
+            insertar_filas(DetalleFactura, ('id', 'factura', 'producto', 'cantidad', 'precio_unitario',
+                                            'total_linea'), detalles)
+        total_lineas += len(detalles)
+        if progreso:
+            progreso(inicio + n, total_lineas)
+
+    # PostgreSQL no mueve la secuencia con ids explicitos; MySQL y SQLite si
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Factura, DetalleFactura]):
+            cursor.execute(sql)
+    return total_lineas
+
+
+def sembrar(productos=0, clientes=0, facturas=0, dias=365, semilla=42, empleados=0, **opciones):
+    # opciones: lineas, desde, hasta, alfa y progreso de sembrar_facturas
+    rnd = random.Random(semilla)
+    if productos:
+        sembrar_productos(productos, rnd)
+    if clientes:
+        sembrar_clientes(clientes, rnd)
+    if empleados:
+        sembrar_empleados(empleados, rnd)
+    if facturas:
+        return sembrar_facturas(facturas, rnd, dias, **opciones)
+    return 0
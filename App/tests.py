@@ -1,3 +1,703 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User, Group
+from django.core.cache import caches
+from django.db import connection, IntegrityError
+from django.db.models import ProtectedError, Sum
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .busqueda import IndiceProductos, indice_productos, LIMITE_32
+from .facturacion import registrar_factura
+from .cache import CEDULA_CONSUMIDOR_FINAL, cliente_por_cedula, consumidor_final, version_roles
+from .checks import revisar_cache_compartida
+from .importacion import ImportacionClientes, ImportacionProductos, leer_filas
+from .listados import filtrar_clientes, filtrar_productos, CLIENTES_POR_PAGINA, PRODUCTOS_POR_PAGINA
+from .metricas import ACUMULADO, Registro, agregadas, vacia, vivo
+from .middleware import ReplicasMiddleware
+from .models import Cliente, Empleado, Producto, Factura, DetalleFactura, MovimientoStock, ProductoBorrado
+from .replicas import estado, lectura_en_replica, COOKIE_ESCRITURA
+from .sembrado import sembrar
 
-# Create your tests here.
+# Presupuesto por vista: (consultas maximas, segundos maximos), medido con las
+# caches vacias. Las paginas listan 24-50 filas: un N+1 nuevo supera el limite
+# de consultas en decenas. Si un cambio necesita mas, se sube aqui a proposito.
+# Las vistas que leen los roles ya traen 7 en frio: sesion, usuario, roles (2)
+# y el guardado de la sesion con su savepoint. procesar_factura tiene el mismo presupuesto con 1,
+# 10 y 100 lineas: ninguna consulta puede depender del numero de lineas. La
+# sincronizacion si crece con el numero de facturas, no con sus lineas. Lo mismo
+# para el carrito: agregar la linea 100 o cobrar 100 lineas cuesta lo mismo que 1.
+PRESUPUESTOS = {
+    'dashboard': (14, 0.25),
+    'lista_empleados': (8, 0.25),
+    'lista_productos': (10, 0.25),
+    'lista_productos_json': (9, 0.25),
+    'lista_clientes': (9, 0.25),
+    'editar_producto': (8, 0.25),
+    'editar_cliente': (8, 0.25),
+    'facturacion': (8, 0.25),
+    'buscar_producto': (3, 0.25),
+    'buscar_codigo': (3, 0.25),
+    'buscar_cliente': (3, 0.25),
+    'buscar_clientes': (3, 0.25),
+    'historial_facturas': (9, 0.25),
+    'historial_facturas_filtrado': (9, 0.25),
+    'detalle_factura': (9, 0.25),
+    'descargar_factura': (4, 0.25),
+    'exportar_facturas': (9, 1.0),
+    'exportar_detalles': (10, 1.0),
+    'archivo_comprobantes': (11, 2.0),
+    'estadisticas_cache': (7, 0.25),
+    'metricas': (7, 0.25),
+    'procesar_factura_1': (30, 0.25),
+    'procesar_factura_10': (30, 0.5),
+    'procesar_factura_100': (30, 1.0),
+    'catalogo_facturacion': (8, 0.5),
+    'catalogo_cambios': (10, 0.25),
+    'sincronizar_facturas_10': (140, 1.0),
+    'carrito_agregar_1': (6, 0.25),
+    'carrito_agregar_100': (6, 0.25),
+    'carrito_cobrar_1': (29, 0.25),
+    'carrito_cobrar_10': (29, 0.25),
+    'carrito_cobrar_100': (29, 0.5),
+}
+
+
+def crear_datos():
+    grupo_admin, _ = Group.objects.get_or_create(name='Admin')
+    grupo_cajero, _ = Group.objects.get_or_create(name='Cajero')
+    admin = User.objects.create_user('admin_pruebas', password='clave')
+    admin.groups.add(grupo_admin)
+    cajero = User.objects.create_user('cajero_pruebas', password='clave')
+    cajero.groups.add(grupo_cajero)
+    Empleado.objects.create(
+        cedula='0900000001', nombre='Ana', apellido='Caja', celular='0990000000', correo='caja@unimark.com',
+        cargo='cajero', usuario=cajero, punto_emision='002'
+    )
+    Empleado.objects.create(
+        cedula='0900000002', nombre='Luis', apellido='Oficina', celular='0990000000',
+        correo='oficina@unimark.com', cargo='administrativo'
+    )
+    Cliente.objects.create(
+        cedula=CEDULA_CONSUMIDOR_FINAL, nombre='Consumidor', apellido='Final', celular='0000000000',
+        correo='consumidor@final.com', es_consumidor_final=True
+    )
+    sembrar(productos=500, clientes=300, facturas=600)
+    return admin, cajero
+
+
+class MedicionMixin:
+    def on_commit(self):
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def medir(self, nombre, url, metodo='get', usuario=None, **kwargs):
+        if usuario is not None:
+            self.client.force_login(usuario)
+        # Cache en frio: un N+1 tapado por la cache tambien cuenta
+        caches['default'].clear()
+        caches['comprobantes'].clear()
+
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            with self.on_commit():
+                response = getattr(self.client, metodo)(url, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            duracion = time.perf_counter() - inicio
+
+        self.assertLess(response.status_code, 400, f'{nombre}: respuesta {response.status_code}')
+        maximo_consultas, maximo_segundos = PRESUPUESTOS[nombre]
+        self.assertLessEqual(
+            len(consultas), maximo_consultas,
+            f'{nombre}: {len(consultas)} consultas (presupuesto {maximo_consultas}):\n'
+            + '\n'.join(consulta['sql'] for consulta in consultas.captured_queries)
+        )
+        self.assertLessEqual(duracion, maximo_segundos,
+                             f'{nombre}: {duracion:.3f}s (presupuesto {maximo_segundos}s)')
+        return response
+
+
+@override_settings(METRICAS_DIR=os.path.join(tempfile.gettempdir(), 'unimark_metricas_pruebas'))
+class PresupuestoConsultasTests(MedicionMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin, cls.cajero = crear_datos()
+        cls.factura = Factura.objects.order_by('-fecha', '-id').first()
+        cls.producto = Producto.objects.filter(activo=True, stock__gt=0).order_by('id').first()
+        cls.cliente = Cliente.objects.filter(es_consumidor_final=False).order_by('id').first()
+        cls.con_stock = list(Producto.objects.filter(activo=True, stock__gte=10).order_by('id')
+                             .values_list('id', flat=True)[:100])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        indice_productos.cargar()
+
+    def test_dashboard(self):
+        self.medir('dashboard', reverse('dashboard'))
+
+    def test_lista_empleados(self):
+        self.medir('lista_empleados', reverse('lista_empleados'))
+
+    def test_lista_productos(self):
+        response = self.medir('lista_productos', reverse('lista_productos') + '?pagina=3')
+        esperados = filtrar_productos({})[0][2 * PRODUCTOS_POR_PAGINA:3 * PRODUCTOS_POR_PAGINA]
+        self.assertEqual(response.context['productos'].number, 3)
+        self.assertEqual([p.pk for p in response.context['productos']], [p.pk for p in esperados])
+
+    def test_lista_productos_json(self):
+        response = self.medir('lista_productos_json', reverse('lista_productos') + '?pagina=2&formato=json')
+        esperados = filtrar_productos({})[0][PRODUCTOS_POR_PAGINA:2 * PRODUCTOS_POR_PAGINA]
+        datos = response.json()
+        self.assertEqual([p['id'] for p in datos['productos']], [p.pk for p in esperados])
+        self.assertIn('pagina=3', datos['siguiente'])
+
+    def test_lista_clientes(self):
+        response = self.medir('lista_clientes', reverse('lista_clientes') + '?pagina=2')
+        esperados = filtrar_clientes({})[0][CLIENTES_POR_PAGINA:2 * CLIENTES_POR_PAGINA]
+        self.assertEqual(response.context['clientes'].number, 2)
+        self.assertEqual([c.pk for c in response.context['clientes']], [c.pk for c in esperados])
+
+    def test_editar_producto(self):
+        self.medir('editar_producto', reverse('editar_producto', args=[self.producto.pk]))
+
+    def test_editar_cliente(self):
+        self.medir('editar_cliente', reverse('editar_cliente', args=[self.cliente.pk]))
+
+    def test_facturacion(self):
+        self.medir('facturacion', reverse('facturacion'), usuario=self.cajero)
+
+    def test_buscar_producto(self):
+        self.medir('buscar_producto', reverse('buscar_producto') + '?q=arro', usuario=self.cajero)
+
+    def test_buscar_codigo(self):
+        self.medir('buscar_codigo', reverse('buscar_codigo') + f'?codigo={self.producto.codigo}',
+                   usuario=self.cajero)
+
+    def test_buscar_cliente(self):
+        self.medir('buscar_cliente', reverse('buscar_cliente') + f'?cedula={self.cliente.cedula}',
+                   usuario=self.cajero)
+
+    def test_buscar_clientes(self):
+        self.medir('buscar_clientes', reverse('buscar_clientes') + '?q=mar', usuario=self.cajero)
+
+    def test_historial_facturas(self):
+        self.medir('historial_facturas', reverse('historial_facturas'))
+
+    def test_historial_facturas_filtrado(self):
+        self.medir('historial_facturas_filtrado',
+                   reverse('historial_facturas') + f'?cedula={self.factura.cliente.cedula}&tamano=100')
+
+    def test_detalle_factura(self):
+        self.medir('detalle_factura', reverse('detalle_factura', args=[self.factura.pk]))
+
+    def test_descargar_factura(self):
+        self.medir('descargar_factura', reverse('descargar_factura', args=[self.factura.pk]))
+
+    def test_exportar_facturas(self):
+        self.medir('exportar_facturas', reverse('exportar_facturas') + '?desde=2000-01-01')
+
+    def test_exportar_detalles(self):
+        self.medir('exportar_detalles', reverse('exportar_facturas') + '?desde=2000-01-01&contenido=detalles')
+
+    def test_estadisticas_cache(self):
+        self.medir('estadisticas_cache', reverse('estadisticas_cache'))
+
+    def test_metricas(self):
+        self.medir('metricas', reverse('metricas'))
+
+    def procesar(self, lineas):
+        items = [{'producto_id': producto_id, 'cantidad': 1} for producto_id in self.con_stock[:lineas]]
+        self.assertEqual(len(items), lineas)
+        response = self.medir(
+            f'procesar_factura_{lineas}', reverse('procesar_factura'), metodo='post', usuario=self.cajero,
+            data=json.dumps({'cliente_id': self.cliente.pk, 'items': items}), content_type='application/json'
+        )
+        datos = response.json()
+        self.assertTrue(datos['success'], datos.get('error'))
+        self.assertEqual(Factura.objects.get(pk=datos['factura_id']).detalles.count(), lineas)
+
+    def test_procesar_factura_1_linea(self):
+        self.procesar(1)
+
+    def test_procesar_factura_10_lineas(self):
+        self.procesar(10)
+
+    def test_procesar_factura_100_lineas(self):
+        self.procesar(100)
+
+    def test_procesar_factura_con_clave_repetida(self):
+        self.client.force_login(self.cajero)
+        datos = json.dumps({'cliente_id': self.cliente.pk, 'clave': 'caja-repetida-0001',
+                            'items': [{'producto_id': self.con_stock[0], 'cantidad': 1}]})
+        primera = self.client.post(reverse('procesar_factura'), datos, content_type='application/json').json()
+        segunda = self.client.post(reverse('procesar_factura'), datos, content_type='application/json').json()
+        self.assertEqual(primera['estado'], 'creada')
+        self.assertEqual(segunda['estado'], 'duplicada')
+        self.assertEqual(primera['factura_id'], segunda['factura_id'])
+
+    def test_catalogo_facturacion(self):
+        response = self.medir('catalogo_facturacion', reverse('catalogo_facturacion'), usuario=self.cajero,
+                              HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        datos = json.loads(gzip.decompress(response.content))
+        self.assertTrue(datos['completo'])
+        self.assertEqual(len(datos['productos']['id']), Producto.objects.filter(activo=True).count())
+
+    def test_catalogo_cambios(self):
+        self.client.force_login(self.cajero)
+        version = self.client.get(reverse('catalogo_facturacion')).json()['version']
+        # Los cambios se piden con margen: lo anterior a la primera version no cuenta
+        with mock.patch('App.catalogo.MARGEN', 0):
+            vendido, editado, desactivado = Producto.objects.filter(pk__in=self.con_stock[:3]).order_by('id')
+            self.client.post(reverse('procesar_factura'), json.dumps({
+                'cliente_id': self.cliente.pk, 'items': [{'producto_id': vendido.pk, 'cantidad': 2}]
+            }), content_type='application/json')
+            editado.precio_unitario += 1
+            editado.save()
+            desactivado.activo = False
+            desactivado.save()
+            borrado = Producto.objects.create(codigo='BORRADO', nombre='Borrado', descripcion='-', marca='-',
+                                              precio_unitario=Decimal('1.00'))
+            borrado_id = borrado.pk
+            borrado.delete()
+
+            response = self.medir('catalogo_cambios', reverse('catalogo_facturacion') + f'?desde={version}')
+        datos = response.json()
+        self.assertFalse(datos['completo'])
+        self.assertGreater(datos['version'], version)
+        self.assertEqual(datos['productos']['id'], [editado.pk, desactivado.pk])
+        self.assertEqual(datos['productos']['precio'][0], str(editado.precio_unitario))
+        self.assertEqual(datos['productos']['activo'], [True, False])
+        self.assertEqual(datos['borrados'], [borrado_id])
+        self.assertEqual(datos['stock'], {'id': [vendido.pk], 'stock': [vendido.stock - 2]})
+
+    def test_sincronizar_facturas(self):
+        facturas = [{'clave': f'caja-sin-conexion-{i:04d}', 'cliente_id': self.cliente.pk,
+                     'items': [{'producto_id': producto_id, 'cantidad': 1} for producto_id in self.con_stock[i:i + 3]]}
+                    for i in range(9)]
+        agotado = Producto.objects.get(pk=self.con_stock[50])
+        facturas.append({'clave': 'caja-sin-conexion-agotado', 'cliente_id': self.cliente.pk,
+                         'items': [{'producto_id': agotado.pk, 'cantidad': agotado.stock + 1}]})
+        datos = json.dumps({'facturas': facturas})
+
+        response = self.medir('sincronizar_facturas_10', reverse('sincronizar_facturas'), metodo='post',
+                              usuario=self.cajero, data=datos, content_type='application/json')
+        estados = [resultado['estado'] for resultado in response.json()['resultados']]
+        self.assertEqual(estados, ['creada'] * 9 + ['rechazada'])
+        self.assertEqual(Producto.objects.get(pk=agotado.pk).stock, agotado.stock)
+
+        # Reenviar el lote (la respuesta se perdio) no duplica ninguna factura
+        total = Factura.objects.count()
+        reenvio = self.client.post(reverse('sincronizar_facturas'), datos, content_type='application/json').json()
+        self.assertEqual([r['estado'] for r in reenvio['resultados']], ['duplicada'] * 9 + ['rechazada'])
+        self.assertEqual(Factura.objects.count(), total)
+
+    def test_sincronizar_clave_en_carrera(self):
+        # Otra solicitud registra la misma clave durante el lote: la fila no se ve
+        # dentro de la transaccion (REPEATABLE READ), pero el lote no falla
+        self.client.force_login(self.cajero)
+        factura = {'clave': 'caja-en-carrera-0001', 'cliente_id': self.cliente.pk,
+                   'items': [{'producto_id': self.con_stock[0], 'cantidad': 1}]}
+        datos = json.dumps({'facturas': [factura]})
+
+        with mock.patch('App.facturacion.registrar_factura', side_effect=IntegrityError):
+            response = self.client.post(reverse('sincronizar_facturas'), datos, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['resultados'], [{'clave': factura['clave'], 'estado': 'pendiente'}])
+
+        # Si la otra ya confirmo al terminar el lote, se informa como duplicada
+        ganadora = registrar_factura(self.cliente, self.cajero.empleado.pk, factura['items'], clave=factura['clave'])
+        with mock.patch('App.facturacion.registrar_factura', side_effect=IntegrityError), \
+                mock.patch('App.facturacion.Factura.objects.filter', side_effect=[Factura.objects.none(),
+                                                                                  Factura.objects.filter(pk=ganadora.pk)]):
+            response = self.client.post(reverse('sincronizar_facturas'), datos, content_type='application/json')
+        resultado = response.json()['resultados'][0]
+        self.assertEqual((resultado['estado'], resultado['factura_id']), ('duplicada', ganadora.pk))
+
+    def llenar_carrito(self, lineas):
+        self.client.force_login(self.cajero)
+        for producto_id in self.con_stock[:lineas]:
+            datos = self.client.post(reverse('carrito_agregar'), json.dumps({'producto_id': producto_id}),
+                                     content_type='application/json').json()
+            self.assertTrue(datos['success'], datos.get('error'))
+
+    def agregar(self, lineas):
+        self.llenar_carrito(lineas - 1)
+        response = self.medir(
+            f'carrito_agregar_{lineas}', reverse('carrito_agregar'), metodo='post',
+            data=json.dumps({'producto_id': self.con_stock[lineas - 1], 'cantidad': 2}),
+            content_type='application/json'
+        )
+        datos = response.json()
+        self.assertTrue(datos['success'], datos.get('error'))
+        self.assertEqual(datos['linea']['cantidad'], 2)
+        self.assertEqual(datos['totales']['lineas'], lineas)
+
+    def test_carrito_agregar_1(self):
+        self.agregar(1)
+
+    def test_carrito_agregar_100(self):
+        self.agregar(100)
+
+    def cobrar(self, lineas):
+        self.llenar_carrito(lineas)
+        totales = self.client.get(reverse('carrito')).json()['totales']
+        response = self.medir(
+            f'carrito_cobrar_{lineas}', reverse('carrito_cobrar'), metodo='post',
+            data=json.dumps({'cliente_id': self.cliente.pk}), content_type='application/json'
+        )
+        datos = response.json()
+        self.assertTrue(datos['success'], datos.get('error'))
+        factura = Factura.objects.get(pk=datos['factura_id'])
+        self.assertEqual(factura.detalles.count(), lineas)
+        self.assertEqual(str(factura.total), totales['total'])
+        self.assertEqual(self.client.get(reverse('carrito')).json()['lineas'], [])
+
+    def test_carrito_cobrar_1_linea(self):
+        self.cobrar(1)
+
+    def test_carrito_cobrar_10_lineas(self):
+        self.cobrar(10)
+
+    def test_carrito_cobrar_100_lineas(self):
+        self.cobrar(100)
+
+    def test_carrito_totales_incrementales(self):
+        self.llenar_carrito(5)
+        actualizar = json.dumps({'producto_id': self.con_stock[0], 'cantidad': 3})
+        self.client.post(reverse('carrito_actualizar'), actualizar, content_type='application/json')
+        quitar = json.dumps({'producto_id': self.con_stock[1], 'cantidad': 0})
+        datos = self.client.post(reverse('carrito_actualizar'), quitar, content_type='application/json').json()
+        self.assertIsNone(datos['linea'])
+
+        # Los subtotales acumulados dan lo mismo que facturar todo de una vez
+        factura = Factura()
+        productos = Producto.objects.in_bulk([self.con_stock[0]] + self.con_stock[2:5])
+        factura.asignar_totales(
+            (producto.es_primera_necesidad, producto.precio_unitario * (3 if pk == self.con_stock[0] else 1))
+            for pk, producto in productos.items()
+        )
+        self.assertEqual(datos['totales']['total'], str(factura.total))
+        self.assertEqual(datos['totales']['articulos'], 6)
+
+    def test_carrito_cobrar_sin_stock(self):
+        self.llenar_carrito(3)
+        agotado = Producto.objects.get(pk=self.con_stock[1])
+        # Otra caja vendio todo despues del escaneo
+        agotado.ajustar_stock(0)
+        total = Factura.objects.count()
+        datos = self.client.post(reverse('carrito_cobrar'), json.dumps({'cliente_id': self.cliente.pk}),
+                                 content_type='application/json').json()
+        self.assertFalse(datos['success'])
+        self.assertIn(agotado.nombre, datos['error'])
+        self.assertEqual(Factura.objects.count(), total)
+        self.assertEqual(len(self.client.get(reverse('carrito')).json()['lineas']), 3)
+
+
+@override_settings(METRICAS_DIR=os.path.join(tempfile.gettempdir(), 'unimark_metricas_pruebas'))
+class PresupuestoArchivoTests(MedicionMixin, TransactionTestCase):
+    # El ZIP arma los comprobantes en hilos con su propia conexion: necesitan ver
+    # datos confirmados. Solo se cuentan las consultas del hilo de la solicitud.
+
+    def setUp(self):
+        admin, _ = crear_datos()
+        self.client.force_login(admin)
+
+    def on_commit(self):
+        return nullcontext()
+
+    def test_archivo_comprobantes(self):
+        response = self.medir('archivo_comprobantes', reverse('archivo_comprobantes') + '?desde=2000-01-01')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+
+class CacheCompartidaTests(SimpleTestCase):
+    def test_caches_locales(self):
+        # Los comprobantes tambien se invalidan entre workers: su cache no puede ser local
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}
+        with override_settings(CACHES={'default': redis, 'comprobantes': redis}):
+            self.assertEqual(revisar_cache_compartida(None), [])
+        with override_settings(CACHES={'default': redis, 'comprobantes': locmem}):
+            avisos = revisar_cache_compartida(None)
+        self.assertEqual([aviso.id for aviso in avisos], ['App.W001'])
+        self.assertIn('comprobantes', avisos[0].msg)
+
+
+class MetricasTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+
+    def escribir(self, nombre, cantidad):
+        datos = vacia()
+        datos['cubetas'][0] = datos['cantidad'] = cantidad
+        with open(os.path.join(self.directorio, nombre), 'w') as archivo:
+            json.dump({'vista': datos}, archivo)
+
+    def test_archivos_de_procesos_terminados(self):
+        # Los archivos de workers terminados se juntan en el acumulado y se
+        # borran; el total no cambia
+        pid = os.getpid()
+        self.escribir('999999-1.json', 2)
+        self.escribir(f'{pid}-1.json', 3)  # pid reutilizado: el archivo viejo es de otro proceso
+        self.escribir(f'{pid}-2.json', 4)
+        with override_settings(METRICAS_DIR=self.directorio), mock.patch('App.metricas.registro', Registro()), \
+                mock.patch('App.metricas.vivo', lambda otro: otro == pid):
+            self.assertEqual(agregadas()['vista']['cantidad'], 9)
+            self.assertEqual(sorted(nombre for nombre in os.listdir(self.directorio) if nombre.endswith('.json')),
+                             [f'{pid}-2.json', ACUMULADO])
+
+            self.escribir('999998-1.json', 1)
+            self.assertEqual(agregadas()['vista']['cantidad'], 10)
+
+            # Ya sumado pero sin borrar (el proceso se corto): no se cuenta dos veces
+            self.escribir('999998-1.json', 1)
+            self.assertEqual(agregadas()['vista']['cantidad'], 10)
+
+    def test_vivo(self):
+        terminado = subprocess.Popen([sys.executable, '-c', ''])
+        terminado.wait()
+        self.assertTrue(vivo(os.getpid()))
+        self.assertFalse(vivo(terminado.pid))
+
+    def test_bloqueo_sin_fcntl(self):
+        # En Windows el bloqueo va con msvcrt
+        self.escribir(f'{os.getpid()}-1.json', 1)
+        with override_settings(METRICAS_DIR=self.directorio), mock.patch('App.metricas.registro', Registro()), \
+                mock.patch('App.metricas.fcntl', None), mock.patch('App.metricas.msvcrt', create=True) as msvcrt:
+            self.assertEqual(agregadas()['vista']['cantidad'], 1)
+        self.assertEqual([llamada.args[1] for llamada in msvcrt.locking.call_args_list],
+                         [msvcrt.LK_LOCK, msvcrt.LK_UNLCK])
+
+
+@override_settings(REPLICAS=['replica'])
+class RouterReplicasTests(SimpleTestCase):
+    # Solo se mira el alias que elige el router (queryset.db), sin consultar: no
+    # hace falta una replica configurada y el atraso se simula
+
+    def setUp(self):
+        estado.reiniciar()
+        self.factory = RequestFactory()
+
+    def alias(self, request=None, retraso=0):
+        @lectura_en_replica
+        def vista(request):
+            return Producto.objects.all().db, User.objects.all().db
+
+        with mock.patch('App.replicas.medir_retraso', return_value=retraso):
+            return vista(request or self.factory.get('/'))
+
+    def test_vista_de_lectura_usa_la_replica(self):
+        # Usuarios y sesiones siempre de la primaria
+        self.assertEqual(self.alias(), ('replica', 'default'))
+
+    def test_otras_vistas_usan_la_primaria(self):
+        self.assertEqual(Producto.objects.all().db, 'default')
+
+    def test_vista_async_usa_la_replica(self):
+        @lectura_en_replica
+        async def vista(request):
+            return await sync_to_async(lambda: Producto.objects.all().db)()
+
+        with mock.patch('App.replicas.medir_retraso', return_value=0):
+            self.assertEqual(async_to_sync(vista)(self.factory.get('/')), 'replica')
+
+    def test_replica_atrasada_usa_la_primaria(self):
+        self.assertEqual(self.alias(retraso=60)[0], 'default')
+
+    def test_replica_caida_usa_la_primaria(self):
+        self.assertEqual(self.alias(retraso=None)[0], 'default')
+
+    def test_lee_sus_propias_escrituras(self):
+        middleware = ReplicasMiddleware(lambda request: HttpResponse())
+        self.assertNotIn(COOKIE_ESCRITURA, middleware(self.factory.get('/')).cookies)
+
+        cookie = middleware(self.factory.post('/')).cookies[COOKIE_ESCRITURA].value
+        request = self.factory.get('/')
+        request.COOKIES[COOKIE_ESCRITURA] = cookie
+        self.assertEqual(self.alias(request)[0], 'default')
+
+
+class RolesTests(TestCase):
+    def test_vaciar_grupo_invalida_a_sus_usuarios(self):
+        grupo = Group.objects.create(name='Admin')
+        usuario = User.objects.create_user('jefe', password='x')
+        usuario.groups.add(grupo)
+        antes = version_roles(usuario.pk)
+        grupo.user_set.clear()
+        self.assertNotEqual(version_roles(usuario.pk), antes)
+
+
+class ConsumidorFinalTests(TestCase):
+    def test_editado_en_otro_proceso(self):
+        fijo = Cliente.get_consumidor_final()
+        self.assertEqual(consumidor_final()['nombre'], fijo.nombre)
+        Cliente.objects.filter(pk=fijo.pk).update(nombre='Final')
+        # Otro worker lo edita: aqui solo cambia la version compartida
+        caches['default'].set('cliente:consumidor_final:version', time.time_ns(), None)
+        self.assertEqual(consumidor_final()['nombre'], 'Final')
+
+
+class IndiceProductosTests(TestCase):
+    def crear(self, codigo, nombre):
+        return Producto.objects.create(codigo=codigo, nombre=nombre, descripcion='-', marca='-',
+                                       precio_unitario=Decimal('1.00'), stock=5)
+
+    def test_cambios_incrementales(self):
+        arroz = self.crear('ARZ1', 'Arroz Conejo 1kg')
+        self.crear('ARZ2', 'Arroz Flor 2kg')
+        indice = IndiceProductos()
+        indice.cargar()
+        self.assertEqual(indice.buscar('arz1'), [arroz.pk])
+
+        # Entra despues de cargar: tambien la encuentran las listas ordenadas
+        nuevo = self.crear('ARZ0', 'Arroz Conejo 5kg')
+        indice.actualizar(nuevo)
+        self.assertEqual(indice.buscar('conejo'), [arroz.pk, nuevo.pk])
+        arroz.activo = False
+        indice.actualizar(arroz)
+        self.assertEqual(indice.buscar('conejo'), [nuevo.pk])
+
+    def test_id_de_64_bits_desde_async(self):
+        # Un id que no entra en las listas de 4 bytes obliga a rearmar el indice:
+        # desde el bucle de eventos se responde con el actual y el rearmado va a
+        # otro hilo (leer la base ahi seria SynchronousOnlyOperation)
+        arroz = self.crear('ARZ1', 'Arroz Conejo 1kg')
+        indice = IndiceProductos()
+        indice.cargar()
+        indice.actualizar(Producto(pk=LIMITE_32, codigo='ARZ9', nombre='Arroz Grande', stock=1))
+        with mock.patch.object(indice, '_recargar'):
+            self.assertEqual(async_to_sync(indice.abuscar)('arroz'), [arroz.pk])
+        self.assertTrue(indice._recargando)
+
+    @override_settings(BUSQUEDA_INDICE_MAXIMO=1)
+    def test_catalogo_mayor_al_maximo(self):
+        self.crear('ARZ1', 'Arroz Conejo 1kg')
+        self.crear('ARZ2', 'Arroz Flor 2kg')
+        indice = IndiceProductos()
+        indice.cargar()
+        # La busqueda va al ORM
+        self.assertIsNone(indice.buscar('arroz'))
+
+
+class BorrarProductoTests(TestCase):
+    def test_borrar_con_stock_inicial(self):
+        # El stock inicial queda en el diario; un producto sin ventas se puede borrar igual
+        crear_datos()
+        sin_ventas = Producto.objects.create(codigo='SINVENTAS', nombre='Sin ventas', descripcion='-', marca='-',
+                                             precio_unitario=Decimal('1.00'), stock=5)
+        self.assertTrue(sin_ventas.movimientos.filter(tipo='inicial').exists())
+
+        producto_id = sin_ventas.pk
+        sin_ventas.delete()
+        self.assertFalse(MovimientoStock.objects.filter(producto_id=producto_id).exists())
+        self.assertTrue(ProductoBorrado.objects.filter(producto_id=producto_id).exists())
+        # Con ventas sigue protegido, como antes del diario
+        with self.assertRaises(ProtectedError):
+            DetalleFactura.objects.first().producto.delete()
+
+
+class ImportacionTests(TestCase):
+    def importar(self, clase, texto, formato='csv', **kwargs):
+        return clase(**kwargs).importar(leer_filas(io.StringIO(texto), formato))
+
+    def test_productos_por_lotes(self):
+        filas = ['codigo,nombre,descripcion,marca,precio_unitario,stock,es_primera_necesidad']
+        filas += [f'IMP{i:04d},Producto {i},Importado,Vita,1.50,{i % 3},{"si" if i % 2 else "no"}' for i in range(250)]
+        filas += [',Sin codigo,Importado,Vita,2.00,5,si', 'IMPMALO,,Importado,Vita,-1,1,no']
+
+        # Las consultas dependen del numero de lotes (3), no de las filas
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = self.importar(ImportacionProductos, '\n'.join(filas), tamano_lote=100)
+        self.assertLessEqual(len(consultas), 20)
+        self.assertEqual((resultado.leidas, resultado.creadas, resultado.con_error), (252, 251, 1))
+        self.assertIn('linea 253', resultado.errores[0])
+
+        generado = Producto.objects.get(nombre='Sin codigo')
+        self.assertTrue(generado.codigo.startswith('PN'))
+        # Stock inicial en el diario, como con save()
+        self.assertEqual(generado.stock_en(timezone.now()), 5)
+        self.assertEqual(Producto.objects.get(codigo='IMP0002').stock_en(timezone.now()), 2)
+
+        # Otra vez: actualiza los datos, no el stock, y omite el sin codigo por nombre
+        resultado = self.importar(ImportacionProductos, '\n'.join(filas).replace('1.50', '1.75'))
+        self.assertEqual((resultado.creadas, resultado.actualizadas, resultado.omitidas), (0, 250, 1))
+        producto = Producto.objects.get(codigo='IMP0002')
+        self.assertEqual((producto.precio_unitario, producto.stock), (Decimal('1.75'), 2))
+
+    def test_clientes_jsonl(self):
+        filas = [
+            {'cedula': '0911111111', 'nombre': 'José', 'apellido': 'Cedeño Vera', 'celular': '0990000000',
+             'correo': 'jose@correo.com'},
+            {'cedula': '0911111111', 'nombre': 'Otro', 'apellido': 'Igual', 'celular': '0990000000',
+             'correo': 'otro@correo.com'},
+        ]
+        texto = '\n'.join(json.dumps(fila) for fila in filas) + '\nno es json\n'
+        # Antes de importar la cedula queda en cache como "no encontrado"
+        self.assertIsNone(cliente_por_cedula('0911111111'))
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = self.importar(ImportacionClientes, texto, 'jsonl')
+        self.assertEqual((resultado.creadas, resultado.con_error), (1, 2))
+        self.assertEqual(Cliente.objects.get(cedula='0911111111').busqueda, 'jose cedeno vera')
+        self.assertEqual(cliente_por_cedula('0911111111')['nombre'], 'José')
+
+    def test_sin_unique_fields(self):
+        # MySQL no acepta unique_fields en el upsert: se apoya en el indice unico
+        texto = 'cedula,nombre,apellido,celular,correo\n0922222222,Ana,Mora,0990000001,ana@correo.com\n'
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(Cliente.objects, 'bulk_create') as bulk_create:
+            self.importar(ImportacionClientes, texto)
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+        self.assertNotIn('unique_fields', bulk_create.call_args.kwargs)
+
+
+class SembradoTests(TestCase):
+    def test_facturas_reproducibles_y_concentradas(self):
+        sembrar(productos=200, clientes=100)
+        with CaptureQueriesContext(connection) as consultas:
+            sembrar(facturas=600, semilla=5)
+        # Dos INSERT por lote, no por factura
+        self.assertLessEqual(len(consultas), 15)
+
+        facturas = Factura.objects.order_by('id')
+        primeras = list(facturas.values_list('cliente_id', 'total'))
+        # Los importes son los que calcula asignar_totales con las lineas
+        for factura in facturas.prefetch_related('detalles__producto')[:50]:
+            esperada = Factura()
+            esperada.asignar_totales((detalle.producto.es_primera_necesidad, detalle.total_linea)
+                                     for detalle in factura.detalles.all())
+            for campo in ('subtotal_sin_iva', 'subtotal_con_iva', 'valor_iva', 'total'):
+                self.assertEqual(getattr(factura, campo), getattr(esperada, campo))
+
+        # El 20% mas vendido se lleva la mayor parte de las unidades
+        unidades = list(DetalleFactura.objects.values('producto').annotate(total=Sum('cantidad'))
+                        .order_by('-total').values_list('total', flat=True))
+        self.assertGreater(sum(unidades[:40]), sum(unidades) * 0.6)
+
+        Factura.objects.all().delete()
+        sembrar(facturas=600, semilla=5)
+        self.assertEqual(list(facturas.values_list('cliente_id', 'total')), primeras)
+
+    def test_sembrar_dos_veces(self):
+        sembrar(productos=30, clientes=20)
+        sembrar(productos=30, clientes=20)
+        self.assertEqual(Producto.objects.filter(codigo__startswith='SIN').count(), 60)
+        self.assertEqual(Cliente.objects.filter(cedula__startswith='8').count(), 40)
+        # El stock inicial queda en el diario, como con save()
+        ahora = timezone.now()
+        for producto in Producto.objects.filter(codigo__startswith='SIN')[:10]:
+            self.assertEqual(producto.stock_en(ahora), producto.stock)
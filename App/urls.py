@@ -21,11 +21,25 @@ urlpatterns = [
     path('gestion/clientes/editar/<int:pk>/', views.editar_cliente, name='editar_cliente'),
     path('gestion/clientes/eliminar/<int:pk>/', views.eliminar_cliente, name='eliminar_cliente'),
 
+    path('gestion/exportar/', views.exportar_facturas, name='exportar_facturas'),
+    path('gestion/comprobantes/', views.archivo_comprobantes, name='archivo_comprobantes'),
+    path('gestion/cache/', views.estadisticas_cache, name='estadisticas_cache'),
+    path('gestion/metricas/', views.metricas, name='metricas'),
+
     path('facturacion/', views.facturacion, name='facturacion'),
     path('facturacion/buscar-producto/', views.buscar_producto, name='buscar_producto'),
+    path('facturacion/buscar-codigo/', views.buscar_codigo, name='buscar_codigo'),
     path('facturacion/buscar-cliente/', views.buscar_cliente, name='buscar_cliente'),
+    path('facturacion/buscar-clientes/', views.buscar_clientes, name='buscar_clientes'),
     path('facturacion/crear-cliente/', views.crear_cliente, name='crear_cliente'),
     path('facturacion/procesar/', views.procesar_factura, name='procesar_factura'),
+    path('facturacion/carrito/', views.carrito, name='carrito'),
+    path('facturacion/carrito/agregar/', views.carrito_agregar, name='carrito_agregar'),
+    path('facturacion/carrito/actualizar/', views.carrito_actualizar, name='carrito_actualizar'),
+    path('facturacion/carrito/vaciar/', views.carrito_vaciar, name='carrito_vaciar'),
+    path('facturacion/carrito/cobrar/', views.carrito_cobrar, name='carrito_cobrar'),
+    path('facturacion/sincronizar/', views.sincronizar_facturas, name='sincronizar_facturas'),
+    path('facturacion/catalogo/', views.catalogo_facturacion, name='catalogo_facturacion'),
     path('facturacion/descargar/<int:pk>/', views.descargar_factura, name='descargar_factura'),
     path('facturacion/historial/', views.historial_facturas, name='historial_facturas'),
     path('facturacion/detalle/<int:pk>/', views.detalle_factura, name='detalle_factura'),
@@ -1,28 +1,46 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User, Group
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Q
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.safestring import mark_safe
 from django.views.decorators.http import require_POST, require_GET
+from asgiref.sync import sync_to_async
 from decimal import Decimal
+import gzip
 import json
-import textwrap
-from .models import Empleado, Cliente, Producto, Factura, DetalleFactura
+from .models import Empleado, Cliente, Producto, Factura, ResumenVentasDiario, StockInsuficiente
+from .facturacion import (registrar_factura_idempotente, sincronizar_facturas as sincronizar_lote, validar_clave,
+                          resultado_factura, ErrorFacturacion)
+from .carrito import Carrito
+from .catalogo import cambios, comprimir
+from .comprobantes import comprobante, etag, ArchivoComprobantes, NOMBRE_LOCAL
+from .exportacion import Exportacion, CONTENIDOS, FORMATOS
+from .listados import (filtrar_productos, filtrar_clientes, clientes_por_texto, pagina, PRODUCTOS_POR_PAGINA,
+                       CLIENTES_POR_PAGINA)
+from .historial import (filtrar_facturas, pagina_facturas, url_pagina, leer_fecha, TAMANO_PAGINA,
+                        TAMANO_MAXIMO)
+from .busqueda import indice_productos, buscar_productos_orm
+from .metricas import agregadas, formato_prometheus
+from .replicas import lectura_en_replica
+from .cache import (producto_a_dict, producto_por_codigo, cliente_a_dict, cliente_por_cedula,
+                    invalidar_cliente, estadisticas, totales_dashboard, marcas_productos, catalogo_caja,
+                    consumidor_final)
 
-NOMBRE_LOCAL = "UNIMARK"
-MENSAJE_LOCAL = ("En Unimark encontraras productos de calidad a precios "
-                 "justos y atencion rapida y amable. Visitanos hoy y descubre "
-                 "por que nuestros clientes confian en nosotros.")
 
+def es_admin(request):
+    return request.roles.es_admin
 
-def es_admin(user):
-    return user.groups.filter(name='Admin').exists() or user.is_superuser
 
-
-def es_cajero(user):
-    return user.groups.filter(name='Cajero').exists()
+def es_cajero(request):
+    return request.roles.es_cajero
 
 
 def login_view(request):
@@ -52,31 +70,26 @@ def logout_view(request):
 
 
 @login_required
+@lectura_en_replica
 def dashboard(request):
-    if es_admin(request.user):
-        from django.utils import timezone
-        from django.db.models import Sum
-        hoy = timezone.now().date()
-
-        facturas_hoy_qs = Factura.objects.filter(fecha__date=hoy)
-        ventas_hoy = facturas_hoy_qs.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        facturas_hoy = facturas_hoy_qs.count()
-        clientes_hoy = facturas_hoy_qs.values('cliente').distinct().count()
+    if es_admin(request):
+        resumen = ResumenVentasDiario.objects.filter(fecha=timezone.localdate()).aggregate(
+            ventas=Sum('total'),
+            facturas=Sum('facturas'),
+            clientes=Sum('clientes')
+        )
 
         context = {
-            'total_empleados': Empleado.objects.filter(activo=True).count(),
-            'total_productos': Producto.objects.filter(activo=True).count(),
-            'total_clientes': Cliente.objects.count(),
-            'total_facturas': Factura.objects.count(),
+            **totales_dashboard(),
             'productos_bajo_stock': Producto.objects.filter(stock__lte=5, activo=True)[:10],
-            'ultimas_facturas': Factura.objects.all().order_by('-fecha')[:5],
-            'ventas_hoy': ventas_hoy,
-            'facturas_hoy': facturas_hoy,
-            'clientes_hoy': clientes_hoy,
+            'ultimas_facturas': Factura.objects.select_related('cliente').order_by('-fecha')[:5],
+            'ventas_hoy': resumen['ventas'] or Decimal('0.00'),
+            'facturas_hoy': resumen['facturas'] or 0,
+            'clientes_hoy': resumen['clientes'] or 0,
             'es_admin': True,
         }
         return render(request, 'admin/dashboard.html', context)
-    elif es_cajero(request.user):
+    elif es_cajero(request):
         return redirect('facturacion')
     else:
         messages.error(request, 'No tienes permisos para acceder al sistema.')
@@ -86,8 +99,9 @@ def dashboard(request):
 # Empleados
 
 @login_required
+@lectura_en_replica
 def lista_empleados(request):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -97,7 +111,7 @@ def lista_empleados(request):
 
 @login_required
 def crear_empleado(request):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -109,12 +123,17 @@ def crear_empleado(request):
             celular = request.POST.get('celular')
             correo = request.POST.get('correo')
             cargo = request.POST.get('cargo')
+            punto_emision = request.POST.get('punto_emision', '').strip()
             crear_usuario = request.POST.get('crear_usuario') == 'on'
 
             if len(cedula) != 10 or not cedula.isdigit():
                 messages.error(request, 'La cedula debe tener exactamente 10 digitos.')
                 return redirect('crear_empleado')
 
+            if punto_emision and (len(punto_emision) != 3 or not punto_emision.isdigit()):
+                messages.error(request, 'El punto de emision debe tener exactamente 3 digitos.')
+                return redirect('crear_empleado')
+
             if Empleado.objects.filter(cedula=cedula).exists():
                 messages.error(request, 'Ya existe un empleado con esta cedula.')
                 return redirect('crear_empleado')
@@ -125,7 +144,8 @@ def crear_empleado(request):
                 apellido=apellido,
                 celular=celular,
                 correo=correo,
-                cargo=cargo
+                cargo=cargo,
+                punto_emision=punto_emision
             )
 
             if crear_usuario and cargo == 'cajero':
@@ -155,7 +175,7 @@ def crear_empleado(request):
 
 @login_required
 def editar_empleado(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -163,11 +183,17 @@ def editar_empleado(request, pk):
 
     if request.method == 'POST':
         try:
+            punto_emision = request.POST.get('punto_emision', '').strip()
+            if punto_emision and (len(punto_emision) != 3 or not punto_emision.isdigit()):
+                messages.error(request, 'El punto de emision debe tener exactamente 3 digitos.')
+                return redirect('editar_empleado', pk=pk)
+
             empleado.nombre = request.POST.get('nombre')
             empleado.apellido = request.POST.get('apellido')
             empleado.celular = request.POST.get('celular')
             empleado.correo = request.POST.get('correo')
             empleado.cargo = request.POST.get('cargo')
+            empleado.punto_emision = punto_emision
             empleado.activo = request.POST.get('activo') == 'on'
             empleado.save()
 
@@ -186,7 +212,7 @@ def editar_empleado(request, pk):
 
 @login_required
 def eliminar_empleado(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -205,18 +231,40 @@ def eliminar_empleado(request, pk):
 # Productos
 
 @login_required
+@lectura_en_replica
 def lista_productos(request):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
-    productos = Producto.objects.all()
-    return render(request, 'admin/productos.html', {'productos': productos})
+    productos, filtros = filtrar_productos(request.GET)
+    pagina_productos = pagina(productos, request.GET.get('pagina'), PRODUCTOS_POR_PAGINA)
+    siguiente = (
+        url_pagina(filtros, pagina=pagina_productos.next_page_number()) if pagina_productos.has_next() else None
+    )
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'html': render_to_string('admin/producto_tarjetas.html', {'productos': pagina_productos}, request),
+            'productos': [producto_a_dict(producto) for producto in pagina_productos],
+            'total': pagina_productos.paginator.count,
+            'siguiente': siguiente and siguiente + '&formato=json',
+        })
+
+    return render(request, 'admin/productos.html', {
+        'productos': pagina_productos,
+        'filtros': filtros,
+        'marcas': marcas_productos(),
+        'url_siguiente': siguiente,
+        'url_anterior': (
+            url_pagina(filtros, pagina=pagina_productos.previous_page_number()) if pagina_productos.has_previous() else None
+        ),
+    })
 
 
 @login_required
 def crear_producto(request):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -255,7 +303,7 @@ def crear_producto(request):
 
 @login_required
 def editar_producto(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -267,10 +315,15 @@ def editar_producto(request, pk):
             producto.descripcion = request.POST.get('descripcion')
             producto.marca = request.POST.get('marca')
             producto.precio_unitario = Decimal(request.POST.get('precio_unitario'))
-            producto.stock = int(request.POST.get('stock'))
+            nuevo_stock = int(request.POST.get('stock'))
             producto.es_primera_necesidad = request.POST.get('es_primera_necesidad') == 'on'
             producto.activo = request.POST.get('activo') == 'on'
-            producto.save()
+            # El stock no se reescribe con save(): las ventas concurrentes lo mueven por el diario
+            producto.save(update_fields=[
+                'nombre', 'descripcion', 'marca', 'precio_unitario',
+                'es_primera_necesidad', 'activo', 'fecha_actualizacion'
+            ])
+            producto.ajustar_stock(nuevo_stock)
 
             messages.success(request, 'Producto actualizado exitosamente.')
             return redirect('lista_productos')
@@ -286,13 +339,13 @@ def editar_producto(request, pk):
 
 @login_required
 def eliminar_producto(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
     producto = get_object_or_404(Producto, pk=pk)
     producto.activo = False
-    producto.save()
+    producto.save(update_fields=['activo', 'fecha_actualizacion'])
 
     messages.success(request, 'Producto desactivado exitosamente.')
     return redirect('lista_productos')
@@ -301,18 +354,29 @@ def eliminar_producto(request, pk):
 # Clientes
 
 @login_required
+@lectura_en_replica
 def lista_clientes(request):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
-    clientes = Cliente.objects.all()
-    return render(request, 'admin/clientes.html', {'clientes': clientes})
+    clientes, filtros = filtrar_clientes(request.GET)
+    pagina_clientes = pagina(clientes, request.GET.get('pagina'), CLIENTES_POR_PAGINA)
+    return render(request, 'admin/clientes.html', {
+        'clientes': pagina_clientes,
+        'filtros': filtros,
+        'url_siguiente': (
+            url_pagina(filtros, pagina=pagina_clientes.next_page_number()) if pagina_clientes.has_next() else None
+        ),
+        'url_anterior': (
+            url_pagina(filtros, pagina=pagina_clientes.previous_page_number()) if pagina_clientes.has_previous() else None
+        ),
+    })
 
 
 @login_required
 def editar_cliente(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -325,6 +389,7 @@ def editar_cliente(request, pk):
             cliente.celular = request.POST.get('celular')
             cliente.correo = request.POST.get('correo')
             cliente.save()
+            invalidar_cliente(cliente.cedula)
 
             messages.success(request, 'Cliente actualizado exitosamente.')
             return redirect('lista_clientes')
@@ -340,7 +405,7 @@ def editar_cliente(request, pk):
 
 @login_required
 def eliminar_cliente(request, pk):
-    if not es_admin(request.user):
+    if not es_admin(request):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
@@ -351,94 +416,196 @@ def eliminar_cliente(request, pk):
         return redirect('lista_clientes')
 
     cliente.delete()
+    invalidar_cliente(cliente.cedula)
     messages.success(request, 'Cliente eliminado exitosamente.')
     return redirect('lista_clientes')
 
 
+@login_required
+@require_GET
+def estadisticas_cache(request):
+    if not es_admin(request):
+        return JsonResponse({'error': 'No tienes permisos para esta accion.'}, status=403)
+    return JsonResponse(estadisticas())
+
+
+@require_GET
+def metricas(request):
+    # Sin login_required: un scraper no tiene sesion y recibiria una redireccion
+    token = settings.METRICAS_TOKEN
+    autorizado = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not autorizado and not es_admin(request):
+        return HttpResponse('No autorizado.', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(formato_prometheus(agregadas()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@require_GET
+def exportar_facturas(request):
+    if not es_admin(request):
+        messages.error(request, 'No tienes permisos para esta accion.')
+        return redirect('dashboard')
+
+    hoy = timezone.localdate()
+    desde = leer_fecha(request.GET.get('desde')) or hoy.replace(day=1)
+    hasta = leer_fecha(request.GET.get('hasta')) or hoy
+    contenido = request.GET.get('contenido', 'facturas')
+    formato = request.GET.get('formato', 'csv')
+    if desde > hasta or contenido not in CONTENIDOS or formato not in FORMATOS:
+        return HttpResponse('Parametros de exportacion invalidos.', status=400, content_type='text/plain; charset=utf-8')
+
+    exportacion = Exportacion(desde, hasta, contenido, formato, comprimir=request.GET.get('gzip') == '1')
+    response = StreamingHttpResponse(exportacion, content_type=exportacion.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{exportacion.nombre_archivo}"'
+    return response
+
+
+@login_required
+@require_GET
+def archivo_comprobantes(request):
+    if not es_admin(request):
+        messages.error(request, 'No tienes permisos para esta accion.')
+        return redirect('dashboard')
+
+    hoy = timezone.localdate()
+    desde = leer_fecha(request.GET.get('desde')) or hoy.replace(day=1)
+    hasta = leer_fecha(request.GET.get('hasta')) or hoy
+    if desde > hasta:
+        return HttpResponse('Rango de fechas invalido.', status=400, content_type='text/plain; charset=utf-8')
+
+    archivo = ArchivoComprobantes(desde, hasta)
+    response = StreamingHttpResponse(archivo, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{archivo.nombre_archivo}"'
+    return response
+
+
 # Facturacion
 
 @login_required
 def facturacion(request):
-    if not (es_cajero(request.user) or es_admin(request.user)):
+    if not (es_cajero(request) or es_admin(request)):
         messages.error(request, 'No tienes permisos para esta accion.')
         return redirect('dashboard')
 
-    productos = Producto.objects.filter(activo=True, stock__gt=0)
     return render(request, 'cajero/facturacion.html', {
-        'productos': productos,
-        'nombre_local': NOMBRE_LOCAL
+        'nombre_local': NOMBRE_LOCAL,
+        # Para facturar a Consumidor Final aunque se caiga la conexion
+        'consumidor_final': consumidor_final()
     })
 
 
+def empleado_de_caja(request):
+    # (empleado_id, punto_emision) de quien factura; un admin sin ficha de
+    # empleado factura como el primer administrativo
+    if request.roles.empleado_id is not None:
+        return request.roles.empleado_id, request.roles.punto_emision
+    empleado = Empleado.objects.filter(cargo='administrativo').values('id', 'punto_emision').first()
+    if not empleado:
+        return None, None
+    return empleado['id'], empleado['punto_emision']
+
+
+@login_required
+@require_GET
+def catalogo_facturacion(request):
+    # Sin parametros el catalogo completo; con ?desde=<version> solo lo que
+    # cambio desde esa version (ver App/catalogo.py)
+    if not (es_cajero(request) or es_admin(request)):
+        return JsonResponse({'error': 'No tienes permisos para esta accion.'}, status=403)
+    desde = request.GET.get('desde')
+    if desde is None:
+        cuerpo = catalogo_caja()
+    else:
+        try:
+            cuerpo = comprimir(cambios(int(desde)))
+        except ValueError:
+            return JsonResponse({'error': 'Version invalida.'}, status=400)
+
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(cuerpo, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(cuerpo), content_type='application/json')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+# Busquedas de la caja: una por tecla, solo lectura. Son async para que con
+# ASGI (Proyecto/gunicorn.conf.py, SERVIDOR=asgi) esperen la base o la cache sin
+# ocupar un worker; con WSGI Django las ejecuta igual, en un bucle por solicitud.
+
 @login_required
 @require_GET
-def buscar_producto(request):
+@lectura_en_replica
+async def buscar_producto(request):
     query = request.GET.get('q', '')
     if len(query) < 2:
         return JsonResponse({'productos': []})
 
-    productos = Producto.objects.filter(
-        Q(nombre__icontains=query) | Q(codigo__icontains=query),
-        activo=True,
-        stock__gt=0
-    )[:10]
-
-    data = [{
-        'id': p.id,
-        'codigo': p.codigo,
-        'nombre': p.nombre,
-        'marca': p.marca,
-        'precio': str(p.precio_unitario),
-        'stock': p.stock,
-        'es_primera_necesidad': p.es_primera_necesidad,
-        'iva': '0%' if p.es_primera_necesidad else '15%'
-    } for p in productos]
+    ids = await indice_productos.abuscar(query) if settings.BUSQUEDA_EN_MEMORIA else None
+    if ids is not None:
+        # El indice solo elige y ordena; precio y stock se leen frescos por pk
+        encontrados = await Producto.objects.ain_bulk(ids)
+        productos = [
+            encontrados[i] for i in ids
+            if i in encontrados and encontrados[i].activo and encontrados[i].stock > 0
+        ]
+    else:
+        productos = [producto async for producto in buscar_productos_orm(query)]
+
+    data = [producto_a_dict(p) for p in productos]
 
     return JsonResponse({'productos': data})
 
 
+# producto_por_codigo y cliente_por_cedula combinan cache y ORM; en un solo
+# sync_to_async es un salto de hilo en lugar de uno por cada aget/aset/afirst
+# (las caches de Django tambien son sync por dentro).
+
 @login_required
 @require_GET
-def buscar_cliente(request):
-    cedula = request.GET.get('cedula', '')
+@lectura_en_replica
+async def buscar_codigo(request):
+    codigo = request.GET.get('codigo', '').strip()
+    if not codigo or len(codigo) > 20 or not codigo.isalnum():
+        return JsonResponse({'encontrado': False})
 
-    if cedula == '9999999999':
-        cliente = Cliente.get_consumidor_final()
-        return JsonResponse({
-            'encontrado': True,
-            'cliente': {
-                'id': cliente.id,
-                'cedula': cliente.cedula,
-                'nombre': cliente.nombre,
-                'apellido': cliente.apellido,
-                'celular': cliente.celular,
-                'correo': cliente.correo,
-                'es_consumidor_final': True
-            }
-        })
+    producto = await sync_to_async(producto_por_codigo)(codigo)
+    if producto is None:
+        return JsonResponse({'encontrado': False})
+    return JsonResponse({'encontrado': True, 'producto': producto})
 
-    try:
-        cliente = Cliente.objects.get(cedula=cedula)
-        return JsonResponse({
-            'encontrado': True,
-            'cliente': {
-                'id': cliente.id,
-                'cedula': cliente.cedula,
-                'nombre': cliente.nombre,
-                'apellido': cliente.apellido,
-                'celular': cliente.celular,
-                'correo': cliente.correo,
-                'es_consumidor_final': cliente.es_consumidor_final
-            }
-        })
-    except Cliente.DoesNotExist:
+
+@login_required
+@require_GET
+@lectura_en_replica
+async def buscar_cliente(request):
+    cedula = request.GET.get('cedula', '')
+    if len(cedula) != 10 or not cedula.isdigit():
         return JsonResponse({'encontrado': False})
 
+    cliente = await sync_to_async(cliente_por_cedula)(cedula)
+    if cliente is None:
+        return JsonResponse({'encontrado': False})
+    return JsonResponse({'encontrado': True, 'cliente': cliente})
+
+
+@login_required
+@require_GET
+@lectura_en_replica
+async def buscar_clientes(request):
+    consulta = request.GET.get('q', '').strip()
+    if len(consulta) < 3:
+        return JsonResponse({'clientes': []})
+
+    clientes = [cliente_a_dict(cliente) async for cliente in clientes_por_texto(consulta)[:10]]
+    return JsonResponse({'clientes': clientes})
+
 
 @login_required
 @require_POST
 def crear_cliente(request):
-    if not es_cajero(request.user):
+    if not es_cajero(request):
         return JsonResponse({
             'success': False,
             'error': 'Solo los cajeros pueden crear nuevos clientes.'
@@ -467,18 +634,10 @@ def crear_cliente(request):
             celular=data.get('celular'),
             correo=data.get('correo')
         )
+        # Puede haber un "no encontrado" en cache de la busqueda previa
+        invalidar_cliente(cedula)
 
-        return JsonResponse({
-            'success': True,
-            'cliente': {
-                'id': cliente.id,
-                'cedula': cliente.cedula,
-                'nombre': cliente.nombre,
-                'apellido': cliente.apellido,
-                'celular': cliente.celular,
-                'correo': cliente.correo
-            }
-        })
+        return JsonResponse({'success': True, 'cliente': cliente_a_dict(cliente)})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -498,124 +657,176 @@ def procesar_factura(request):
             })
 
         cliente = get_object_or_404(Cliente, pk=cliente_id)
+        clave = validar_clave(data.get('clave'))
 
-        try:
-            empleado = Empleado.objects.get(usuario=request.user)
-        except Empleado.DoesNotExist:
-            empleado = Empleado.objects.filter(cargo='administrativo').first()
-            if not empleado:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'No se encontro empleado asociado.'
-                })
-
-        factura = Factura.objects.create(
-            cliente=cliente,
-            empleado=empleado
-        )
-
-        for item in items:
-            producto = get_object_or_404(Producto, pk=item['producto_id'])
-            cantidad = int(item['cantidad'])
-
-            if producto.stock < cantidad:
-                factura.delete()
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Stock insuficiente para {producto.nombre}. Disponible: {producto.stock}'
-                })
-
-            DetalleFactura.objects.create(
-                factura=factura,
-                producto=producto,
-                cantidad=cantidad,
-                precio_unitario=producto.precio_unitario
-            )
+        empleado_id, punto_emision = empleado_de_caja(request)
+        if empleado_id is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'No se encontro empleado asociado.'
+            })
 
-        factura.calcular_totales()
+        factura, creada = registrar_factura_idempotente(cliente, empleado_id, items, punto_emision, clave)
 
         return JsonResponse({
             'success': True,
-            'factura_id': factura.id,
-            'numero': factura.numero,
-            'total': str(factura.total)
+            **resultado_factura(factura, 'creada' if creada else 'duplicada')
         })
 
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def respuesta_carrito(carrito, producto_id, error=None):
+    # La linea tocada (None si ya no esta) y los totales: la caja corrige lo que
+    # mostro antes de la respuesta sin volver a pedir el carrito entero
+    datos = {
+        'success': error is None,
+        'linea': carrito.linea(producto_id) if producto_id is not None else None,
+        'totales': carrito.totales(),
+    }
+    if error is not None:
+        datos['error'] = error
+    return JsonResponse(datos)
+
+
 @login_required
-def descargar_factura(request, pk):
-    factura = get_object_or_404(Factura, pk=pk)
+@require_GET
+def carrito(request):
+    return JsonResponse({'success': True, **Carrito(request.session).estado()})
+
+
+@login_required
+@require_POST
+def carrito_agregar(request):
+    carrito = Carrito(request.session)
+    producto_id = None
+    try:
+        data = json.loads(request.body)
+        producto_id = data.get('producto_id')
+        producto_id = carrito.agregar(int(data.get('cantidad', 1)), producto_id=producto_id, codigo=data.get('codigo'))
+    except (ErrorFacturacion, StockInsuficiente, TypeError, ValueError) as e:
+        return respuesta_carrito(carrito, producto_id, str(e))
+    return respuesta_carrito(carrito, producto_id)
 
-    linea = "=" * 50
-    linea_simple = "-" * 50
 
-    contenido = f"""
-{linea}
-{"UNIMARK":^50}
-{linea}
+@login_required
+@require_POST
+def carrito_actualizar(request):
+    carrito = Carrito(request.session)
+    producto_id = None
+    try:
+        data = json.loads(request.body)
+        producto_id = int(data['producto_id'])
+        carrito.actualizar(producto_id, int(data['cantidad']))
+    except (ErrorFacturacion, StockInsuficiente, KeyError, TypeError, ValueError) as e:
+        return respuesta_carrito(carrito, producto_id, str(e))
+    return respuesta_carrito(carrito, producto_id)
 
-FACTURA N: {factura.numero}
-FECHA: {factura.fecha.strftime('%d/%m/%Y %H:%M')}
 
-{linea_simple}
-DATOS DEL CLIENTE
-{linea_simple}
-Cedula: {factura.cliente.cedula}
-Nombre: {factura.cliente.nombre_completo}
-Telefono: {factura.cliente.celular}
-Correo: {factura.cliente.correo}
+@login_required
+@require_POST
+def carrito_vaciar(request):
+    carrito = Carrito(request.session)
+    carrito.vaciar()
+    return respuesta_carrito(carrito, None)
 
-{linea_simple}
-"""
 
-    width = len(linea)
-    mensaje_lineas = textwrap.wrap(MENSAJE_LOCAL, width=width, break_long_words=False, break_on_hyphens=False)
-    mensaje_formateado = "\n".join([ml.center(width) for ml in mensaje_lineas]) + "\n"
+@login_required
+@require_POST
+def carrito_cobrar(request):
+    try:
+        data = json.loads(request.body)
+        cliente = get_object_or_404(Cliente, pk=data.get('cliente_id'))
+        clave = validar_clave(data.get('clave'))
+
+        empleado_id, punto_emision = empleado_de_caja(request)
+        if empleado_id is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'No se encontro empleado asociado.'
+            })
 
-    contenido += mensaje_formateado
-    contenido += f"{linea_simple}\n\n"
+        factura, creada = Carrito(request.session).cobrar(cliente, empleado_id, punto_emision, clave)
 
-    contenido += "{:<20} {:>6} {:>10} {:>10}\n{}\n".format("PRODUCTO", "CANT", "P.UNIT", "TOTAL", linea_simple)
+        return JsonResponse({
+            'success': True,
+            **resultado_factura(factura, 'creada' if creada else 'duplicada')
+        })
 
-    for detalle in factura.detalles.all():
-        nombre = detalle.producto.nombre[:20]
-        iva_tag = "(0%)" if detalle.producto.es_primera_necesidad else "(15%)"
-        contenido += f"{nombre:<20} {detalle.cantidad:>6} ${detalle.precio_unitario:>9.2f} ${detalle.total_linea:>9.2f} {iva_tag}\n"
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
 
-    contenido += f"""
-{linea_simple}
 
-{"Subtotal (IVA 0%):":<30} ${factura.subtotal_sin_iva:>15.2f}
-{"Subtotal (IVA 15%):":<30} ${factura.subtotal_con_iva:>15.2f}
-{linea}
-{"TOTAL A PAGAR:":<30} ${factura.total:>15.2f}
-{linea}
+@login_required
+@require_POST
+def sincronizar_facturas(request):
+    # Ventas que la caja guardo sin conexion; cada una trae su clave y se puede
+    # reenviar el lote entero sin duplicar las que ya entraron
+    if not (es_cajero(request) or es_admin(request)):
+        return JsonResponse({'success': False, 'error': 'No tienes permisos para esta accion.'}, status=403)
+    try:
+        facturas = json.loads(request.body).get('facturas')
+        if not isinstance(facturas, list):
+            raise ErrorFacturacion('Se esperaba una lista de facturas.')
+        empleado_id, punto_emision = empleado_de_caja(request)
+        if empleado_id is None:
+            raise ErrorFacturacion('No se encontro empleado asociado.')
+        resultados = sincronizar_lote(facturas, empleado_id, punto_emision)
+    except (ValueError, AttributeError, ErrorFacturacion) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, 'resultados': resultados})
 
-Atendido por: {factura.empleado.nombre_completo}
 
-Gracias por su compra!
-Vuelva pronto a UNIMARK
-"""
+@login_required
+def descargar_factura(request, pk):
+    datos = comprobante(pk)
+    if datos is None:
+        raise Http404('Factura no encontrada.')
 
-    response = HttpResponse(contenido, content_type='text/plain; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="factura_{factura.numero}.txt"'
-    return response
+    response = HttpResponse(datos['texto'], content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="factura_%s.txt"' % datos['numero']
+    response['ETag'] = datos['etag_texto']
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=datos['etag_texto'], response=response)
 
 
 @login_required
+@lectura_en_replica
 def historial_facturas(request):
-    facturas = Factura.objects.all().order_by('-fecha')
-    return render(request, 'cajero/historial.html', {'facturas': facturas})
+    facturas, filtros = filtrar_facturas(request.GET)
+
+    try:
+        tamano = min(max(int(request.GET.get('tamano', TAMANO_PAGINA)), 1), TAMANO_MAXIMO)
+    except ValueError:
+        tamano = TAMANO_PAGINA
+    if tamano != TAMANO_PAGINA:
+        filtros['tamano'] = tamano
+
+    pagina = pagina_facturas(facturas, request.GET.get('antes'), request.GET.get('despues'), tamano)
+
+    return render(request, 'cajero/historial.html', {
+        'facturas': pagina['facturas'],
+        'filtros': filtros,
+        'empleados': Empleado.objects.filter(activo=True).only('id', 'nombre', 'apellido').order_by('nombre', 'apellido'),
+        'url_anteriores': url_pagina(filtros, antes=pagina['antes']) if pagina['antes'] else None,
+        'url_recientes': url_pagina(filtros, despues=pagina['despues']) if pagina['despues'] else None,
+    })
 
 
 @login_required
 def detalle_factura(request, pk):
-    factura = get_object_or_404(Factura, pk=pk)
-    return render(request, 'cajero/detalle_factura.html', {
-        'factura': factura,
-        'nombre_local': NOMBRE_LOCAL,
-        'mensaje_local': MENSAJE_LOCAL
+    datos = comprobante(pk)
+    if datos is None:
+        raise Http404('Factura no encontrada.')
+
+    # El comprobante viene de la cache; el resto de la pagina depende del usuario,
+    # asi que el ETag se calcula sobre la pagina ya armada.
+    response = render(request, 'cajero/detalle_factura.html', {
+        'factura_id': pk,
+        'numero': datos['numero'],
+        'comprobante': mark_safe(datos['html']),
     })
+    response['ETag'] = etag(response.content.decode('utf-8'))
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
@@ -0,0 +1,41 @@
+"""
+Configuracion de gunicorn con dos perfiles.
+
+    WSGI (por defecto):  gunicorn -c Proyecto/gunicorn.conf.py Proyecto.wsgi
+    ASGI:                SERVIDOR=asgi gunicorn -c Proyecto/gunicorn.conf.py Proyecto.asgi
+
+Con WSGI cada worker atiende una solicitud a la vez: las busquedas por tecla
+de todas las cajas compiten con la facturacion por los mismos workers. Con
+ASGI cada worker es un bucle de eventos (uvicorn): las busquedas de la caja
+son vistas async y esperan la base sin ocupar el worker, y las vistas sync
+(facturar, gestion) corren en hilos.
+
+Variables: SERVIDOR (wsgi | asgi), WORKERS, BIND. Para comparar cuantos workers
+necesita cada perfil: python manage.py benchmark_asgi.
+"""
+import multiprocessing
+import os
+
+perfil = os.environ.get('SERVIDOR', 'wsgi')
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+timeout = 30
+# Sin esto una rafaga de cajas que abren conexion a la vez recibe rechazos
+backlog = 4096
+
+if perfil == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Un bucle por nucleo basta: la concurrencia esta dentro de cada worker.
+    # Sin CONN_MAX_AGE (por defecto 0): en modo async las conexiones persistentes
+    # quedarian atadas a hilos que no se reutilizan.
+    workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+else:
+    workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+
+def post_worker_init(worker):
+    # Cada worker arma el indice de busqueda de productos antes de atender: si
+    # no, la primera tecla que le llega espera la carga completa (segundos con
+    # catalogos grandes) y bloquea el worker. Mientras carga sigue avisando que
+    # esta vivo, o el arbitro lo mataria al pasar el timeout.
+    from App.busqueda import precargar
+    precargar(worker.notify)
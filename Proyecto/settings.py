@@ -29,11 +29,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'App.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'App.middleware.RolesMiddleware',
+    'App.middleware.ReplicasMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,6 +81,23 @@ DATABASES = {
     }
 }
 
+# Replicas de lectura (App/replicas.py): cualquier alias de DATABASES ademas de
+# 'default'. El dashboard, el historial, los listados y las busquedas de la caja
+# leen de ellas; con la lista vacia todo va a la primaria. Ejemplo:
+#
+#     DATABASES['replica'] = {**DATABASES['default'], 'HOST': 'replica1', 'TEST': {'MIRROR': 'default'}}
+#
+# Para probar en local con dos SQLite, 'default' y 'replica' apuntan a dos
+# archivos y "replicar" es copiar db.sqlite3 sobre el de la replica; el atraso
+# se mide por las facturas que le faltan.
+DATABASE_ROUTERS = ['App.replicas.RouterReplicas']
+REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Segundos: atraso tolerado, lectura de la primaria tras una escritura propia y
+# cada cuanto se vuelve a medir el atraso de cada replica
+REPLICA_RETRASO_MAXIMO = 5
+REPLICA_VENTANA_ESCRITURA = 10
+REPLICA_REVISION = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -98,6 +118,30 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# La cache por defecto la comparten todos los workers de gunicorn y los comandos
+# de gestion (importaciones): guarda las versiones del catalogo y de los roles,
+# los clientes no encontrados y la marca de borrados del catalogo, y lo que un
+# proceso invalida lo tienen que ver los demas. LocMemCache solo sirve con un
+# proceso (runserver); 'manage.py check --deploy' avisa si queda configurada.
+# Los comprobantes renderizados van en su propia base de Redis, tambien
+# compartida: si una factura se edita, ningun worker debe seguir sirviendo el
+# comprobante viejo con su ETag.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'KEY_PREFIX': 'unimark',
+    },
+    'comprobantes': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/2',
+        'KEY_PREFIX': 'unimark',
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -125,3 +169,25 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
+
+# Facturacion - serie por defecto (establecimiento-punto de emision).
+# Cada cajero puede tener su propio punto de emision en Empleado.punto_emision.
+FACTURACION_ESTABLECIMIENTO = '001'
+FACTURACION_PUNTO_EMISION = '001'
+
+# Busqueda de productos con indice en memoria (App/busqueda.py).
+# El indice se recarga completo cada BUSQUEDA_INDICE_TTL segundos para
+# recoger cambios hechos por otros procesos del servidor. Cada worker guarda el
+# suyo (unos 50 MB por cada 100k productos activos); con mas de
+# BUSQUEDA_INDICE_MAXIMO no se arma y la busqueda va al ORM.
+BUSQUEDA_EN_MEMORIA = True
+BUSQUEDA_INDICE_TTL = 300
+BUSQUEDA_INDICE_MAXIMO = 500000
+
+# Metricas por vista (App/metricas.py), expuestas en formato Prometheus en
+# /gestion/metricas/. Cada proceso vuelca sus contadores a un archivo de
+# METRICAS_DIR cada METRICAS_INTERVALO segundos; el endpoint los suma. Con
+# METRICAS_TOKEN el scraper puede autenticarse con 'Authorization: Bearer'.
+METRICAS_DIR = BASE_DIR / 'metricas'
+METRICAS_INTERVALO = 1
+METRICAS_TOKEN = None